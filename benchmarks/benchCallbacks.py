@@ -0,0 +1,88 @@
+import sys
+import os
+import time
+import statistics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+os.chdir(ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'dashApp'))
+import app
+import fanout
+
+'''
+File: benchCallbacks.py
+Author: SonnyP
+Latency of the two update_data_to_event callbacks with stubbed Eventbrite, DynamoDB and Google Maps backends,
+with the external calls run one after another (the old behaviour) and fanned out on the shared executor.
+Run from the repository root: python benchmarks/benchCallbacks.py [latency ms] [repeats]
+Functions:
+    stub_backends
+    callbacks
+    time_callback
+'''
+
+#Replace every external call with a sleep of latency seconds (dbLatency/mapLatency override it for DynamoDB
+#and Google Maps)
+def stub_backends(latency, dbLatency=None, mapLatency=None):
+    dbLatency = latency if dbLatency is None else dbLatency
+    mapLatency = latency if mapLatency is None else mapLatency
+
+    def eventbrite(key, eventID):
+        time.sleep(2 * latency) #event + venue requests
+        event = {"name": "Event", "description": "", "start": "", "venue_id": "1", "logo": ""}
+        venue = {"address": "1 Main St", "state": "California", "zipcode": "94607", "county": "Alameda"}
+        return event, venue, "200"
+
+    def covid(*args, **kwargs):
+        time.sleep(dbLatency)
+        return {"daily-covid-cases": 1, "daily-covid-deaths": 0,
+                "monthly-covid-case-rate": 0, "monthly-covid-death-rate": 0}, 200
+
+    def flu(*args, **kwargs):
+        time.sleep(dbLatency)
+        return {"today-case-rate": 0, "week3-case-rate": 0}, 200
+
+    def map_url(*args, **kwargs):
+        time.sleep(mapLatency)
+        return "/maps/stub.png"
+
+    app.a.authenticate_eventbrite = lambda: "key"
+    app.a.authenticate_map = lambda: "key"
+    app.a.get_eventbrite = eventbrite
+    app.db.get_df_covid = covid
+    app.db.get_df_flu = flu
+    app.mapCache.get_map_url = map_url
+
+#Undecorated event and state/county callbacks (both are named update_data_to_event in app.py)
+def callbacks():
+    funcs = {}
+    for callbackId, entry in app.app.callback_map.items():
+        if "submit-event-button.n_clicks" in callbackId:
+            funcs["event"] = (entry["callback"].__wrapped__, (1, 893792827407))
+        elif "submit-state-button.n_clicks" in callbackId:
+            funcs["state"] = (entry["callback"].__wrapped__, (1, "california", "alameda"))
+    return funcs
+
+#Median wall time of fn(*args) over repeats
+def time_callback(fn, args, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+if __name__ == "__main__":
+    latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 50) / 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    stub_backends(latency)
+    shared = fanout.executor
+
+    print(f"stub latency per call: {latency * 1000:.0f} ms, median of {repeats}")
+    for name, (fn, args) in callbacks().items():
+        fanout.executor = None
+        serial = time_callback(fn, args, repeats)
+        fanout.executor = shared
+        parallel = time_callback(fn, args, repeats)
+        print(f"{name:>6} callback  serial: {serial * 1000:7.1f} ms  fan-out: {parallel * 1000:7.1f} ms  "
+              f"speedup: {serial / parallel:4.1f}x")
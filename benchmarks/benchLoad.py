@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+from datetime import datetime
+import requests
+from werkzeug.serving import make_server
+
+import benchCallbacks
+from benchCallbacks import app
+
+'''
+File: benchLoad.py
+Author: SonnyP
+Concurrent-user load test of the dashboard. The Dash app is served by a threaded werkzeug server on localhost
+with Eventbrite, DynamoDB and Google Maps replaced by sleeping stubs (benchCallbacks.stub_backends). Client
+threads POST both update_data_to_event callbacks to /_dash-update-component, the way the browser does, for
+each concurrency level. Throughput and p50/p95/p99 latency are reported per level and per callback.
+Clients and server share one process (and the GIL), so treat the numbers as one worker's upper bound.
+Run from the repository root: python benchmarks/benchLoad.py [--concurrency 1 8 32] [--duration 10]
+Functions:
+    callback_payloads
+    start_server
+    run_level
+    percentiles
+'''
+
+RESULTS_DIR = './benchmarks/results'
+
+#Request body of each update_data_to_event callback as the Dash renderer would send it
+def callback_payloads(eventID, state, county):
+    values = {"submit-event-button.n_clicks": 1, "submit-state-button.n_clicks": 1,
+              "event-id.value": eventID, "state-id.value": state, "county-id.value": county}
+    payloads = {}
+    for callbackId, entry in app.app.callback_map.items():
+        name = {"submit-event-button": "event", "submit-state-button": "state"}.get(entry["inputs"][0]["id"])
+        if name is None:
+            continue
+        outputs = [{"id": out.component_id, "property": out.component_property} for out in entry["output"]]
+        prop = lambda p: dict(p, value=values[f"{p['id']}.{p['property']}"])
+        payloads[name] = {
+            "output": callbackId,
+            "outputs": outputs,
+            "inputs": [prop(p) for p in entry["inputs"]],
+            "state": [prop(p) for p in entry["state"]],
+            "changedPropIds": [f"{p['id']}.{p['property']}" for p in entry["inputs"]],
+        }
+    return payloads
+
+#Serve the Flask server on a free localhost port from a background thread. Returns (server, base url)
+def start_server():
+    server = make_server("127.0.0.1", 0, app.server, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+#concurrency clients send callbacks (picked at random with eventShare the event callback) for duration seconds
+#Returns {callback name: [latency seconds, ...]}, error count and elapsed seconds
+def run_level(url, payloads, concurrency, duration, eventShare, seed=7):
+    latencies = {name: [] for name in payloads}
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client(worker):
+        rng = random.Random(seed + worker)
+        session = requests.Session()
+        while time.perf_counter() < stop:
+            name = "event" if rng.random() < eventShare else "state"
+            start = time.perf_counter()
+            try:
+                ok = session.post(url + "/_dash-update-component", json=payloads[name], timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(w,)) for w in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+#p50, p95 and p99 in milliseconds
+def percentiles(samples):
+    if len(samples) == 1:
+        return [round(samples[0] * 1000, 1)] * 3
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return [round(cuts[p - 1] * 1000, 1) for p in (50, 95, 99)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent-user load test of the dashboard callbacks")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--eventbrite-ms", type=float, default=150, help="stub latency of each Eventbrite request")
+    parser.add_argument("--db-ms", type=float, default=20, help="stub latency of each DynamoDB lookup")
+    parser.add_argument("--map-ms", type=float, default=100, help="stub latency of a Google static map")
+    parser.add_argument("--event-share", type=float, default=0.5, help="fraction of requests using the event callback")
+    parser.add_argument("--save", action="store_true", help="save results json to benchmarks/results")
+    args = parser.parse_args()
+
+    benchCallbacks.stub_backends(args.eventbrite_ms / 1000, dbLatency=args.db_ms / 1000, mapLatency=args.map_ms / 1000)
+    payloads = callback_payloads("893792827407", "california", "alameda")
+    server, url = start_server()
+    results = {"run": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), "stubs": {
+        "eventbriteMs": args.eventbrite_ms, "dbMs": args.db_ms, "mapMs": args.map_ms}, "levels": []}
+
+    print(f"stubs: eventbrite {args.eventbrite_ms:.0f} ms, db {args.db_ms:.0f} ms, map {args.map_ms:.0f} ms; "
+          f"{args.duration:.0f}s per level")
+    print(f"{'users':>6} {'req/s':>8} {'errors':>7}  {'callback':>8} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    try:
+        for concurrency in args.concurrency:
+            latencies, errors, elapsed = run_level(url, payloads, concurrency, args.duration, args.event_share)
+            latencies["all"] = latencies["event"] + latencies["state"]
+            throughput = len(latencies["all"]) / elapsed
+            level = {"concurrency": concurrency, "requestsPerSecond": round(throughput, 1), "errors": errors}
+            for i, name in enumerate(["event", "state", "all"]):
+                p50, p95, p99 = percentiles(latencies[name]) if latencies[name] else (0, 0, 0)
+                level[name] = {"count": len(latencies[name]), "p50": p50, "p95": p95, "p99": p99}
+                lead = f"{concurrency:>6} {throughput:>8.1f} {errors:>7}" if i == 0 else " " * 23
+                print(f"{lead}  {name:>8} {len(latencies[name]):>6} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}")
+            results["levels"].append(level)
+    finally:
+        server.shutdown()
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"load-{results['run'].replace(':', '')}.json")
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {path}")
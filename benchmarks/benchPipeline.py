@@ -0,0 +1,191 @@
+import sys
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+#moto needs credentials to be set, they are never sent anywhere
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+from moto import mock_aws
+import boto3
+from loadTo import loadToDynamo, batchWriter
+
+'''
+File: benchPipeline.py
+Author: SonnyP
+Offline benchmark of the loadTo ETL stages (putDynamoCovid for every state, putDynamoFlu, updateDynamoCovidRates,
+updateDynamoFluRates) against moto's in-process S3 and DynamoDB. Synthetic disease.sh and FluView payloads are
+generated for every (state, county) in assets/geo_data.csv, and the three previous weeks are seeded so the rate
+updaters read four full partitions.
+Each stage is run twice: once for wall time and rows/s, once under tracemalloc for its peak traced memory.
+Results are saved to benchmarks/results/pipeline-<timestamp>.json; --compare prints the change against an
+earlier results file.
+Requires moto. Run from the repository root: python benchmarks/benchPipeline.py [--states N] [--compare results.json]
+Functions:
+    loadCounties
+    covidPayload
+    fluPayload
+    setupAWS
+    seedHistory
+    stages
+    runStage
+    compare
+'''
+
+GEO_CSV = './assets/geo_data.csv'
+RESULTS_DIR = './benchmarks/results'
+REGION = 'us-east-2'
+BUCKET = 'bench-etl'
+TABLES = {'covid': 'covidtable', 'covidmonthly': 'covidmonthly', 'flu': 'flutable', 'flumonthly': 'flumonthly'}
+
+#{state id (as in statesPartial.csv, e.g. new_york): [county, ...]} for the first maxStates states in geo_data.csv
+def loadCounties(maxStates=None):
+    counties = {}
+    with open(GEO_CSV, newline='') as f:
+        for row in csv.DictReader(f):
+            state = row['state'].lower().replace(' ', '_')
+            if state not in counties:
+                if maxStates is not None and len(counties) >= maxStates:
+                    continue
+                counties[state] = set()
+            counties[state].add(row['county'].lower())
+    return {state: sorted(names) for state, names in counties.items()}
+
+#disease.sh /historical/usacounties/<state>?lastdays=1 style payload for a day
+def covidPayload(state, counties, day, rng):
+    date = day.strftime('%-m/%-d/%y')
+    data = [{'province': state.replace('_', ' '), 'county': county,
+             'timeline': {'cases': {date: rng.randint(1000, 500000)}, 'deaths': {date: rng.randint(10, 5000)}}}
+            for county in counties]
+    return json.dumps(data).encode('utf-8')
+
+#FluView epidata payload for an HHS region
+def fluPayload(region, day, rng):
+    patients = rng.randint(50000, 200000)
+    ili = rng.randint(500, 5000)
+    row = {'release_date': day.strftime('%Y-%m-%d'), 'region': f'hhs{region}', 'issue': 202440, 'epiweek': 202440,
+           'lag': 0, 'num_ili': ili, 'num_patients': patients, 'num_providers': 500, 'num_age_0': ili // 2,
+           'num_age_1': ili // 2, 'wili': ili / patients * 100, 'ili': ili / patients * 100}
+    return json.dumps({'epidata': [row]}).encode('utf-8')
+
+def setupAWS():
+    s3_client = boto3.client('s3', region_name=REGION)
+    s3_client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    db_client = boto3.client('dynamodb', region_name=REGION)
+    db_resource = boto3.resource('dynamodb', region_name=REGION)
+    schema = json.load(open('./assets/tableSchema.json'))
+    for name, key, attr in [('covid', 'covidKey', 'covidAttr'), ('flu', 'fluKey', 'fluAttr'),
+                            ('flumonthly', 'fluMonthKey', 'fluMonthAttr'), ('covidmonthly', 'covidMonthKey', 'covidMonthAttr')]:
+        keySchema = [dict(k, KeyType=k['KeyType'].upper()) for k in schema[key]]
+        indexes = {'GlobalSecondaryIndexes': schema['covidMonthIndexes']} if name == 'covidmonthly' else {}
+        db_client.create_table(TableName=TABLES[name], KeySchema=keySchema, AttributeDefinitions=schema[attr],
+                               BillingMode='PAY_PER_REQUEST', **indexes)
+    return s3_client, db_client, db_resource
+
+#Put today's payloads in S3 and write the three previous weeks straight to the daily tables
+def seedHistory(s3_client, writer, counties, seed=7):
+    rng = random.Random(seed)
+    today = datetime.today()
+    for week in range(4):
+        day = today - timedelta(days=7 * week)
+        date = day.strftime('%Y-%m-%d')
+        for state, names in counties.items():
+            payload = covidPayload(state, names, day, rng)
+            if week == 0:
+                s3_client.put_object(Bucket=BUCKET, Key=loadToDynamo.covidKey(state, date), Body=payload)
+            else:
+                writer.putDf(loadToDynamo.transformCovid(payload, date), TABLES['covid'])
+        for region in range(1, 11):
+            payload = fluPayload(region, day, rng)
+            if week == 0:
+                s3_client.put_object(Bucket=BUCKET, Key=f"flu/hhs{region}/{date}", Body=payload)
+            else:
+                row = dict(json.loads(payload)['epidata'][0], date=date)
+                writer.putItems([{k: row[k] for k in ['date', 'region', 'num_ili', 'num_patients']}], TABLES['flu'])
+
+#(stage name, fn) in ETL order. Each fn returns the number of rows it produced.
+def stages(s3_client, db_resource, writer, states):
+    def covidLoad():
+        for state in states:
+            loadToDynamo.putDynamoCovid(state, s3_client, TABLES['covid'], BUCKET, writer=writer)
+        return writer.stats['items']
+    def fluLoad():
+        loadToDynamo.putDynamoFlu(s3_client, BUCKET, TABLES['flu'], writer=writer)
+        return writer.stats['items']
+    def covidRates():
+        return len(loadToDynamo.updateDynamoCovidRates(db_resource, TABLES['covid'], TABLES['covidmonthly'], writer=writer))
+    def fluRates():
+        return len(loadToDynamo.updateDynamoFluRates(db_resource, TABLES['flu'], TABLES['flumonthly'], writer=writer))
+    return [('putDynamoCovid', covidLoad), ('putDynamoFlu', fluLoad),
+            ('updateDynamoCovidRates', covidRates), ('updateDynamoFluRates', fluRates)]
+
+#Wall time and rows of fn, or its peak traced memory (MB) with traceMemory
+def runStage(fn, writer, traceMemory=False):
+    writer.stats['items'] = 0
+    if traceMemory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    rows = fn()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if traceMemory:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return rows, elapsed, peak
+
+#Print each stage's change in seconds and peak memory against an earlier results file
+def compare(results, previousPath):
+    previous = {s['stage']: s for s in json.load(open(previousPath))['stages']}
+    print(f"\nagainst {previousPath}")
+    for stage in results['stages']:
+        before = previous.get(stage['stage'])
+        if before is None:
+            continue
+        print(f"{stage['stage']:>24} seconds: {before['seconds']:8.2f} -> {stage['seconds']:8.2f} "
+              f"({stage['seconds'] / before['seconds'] - 1:+.0%})  peak MB: {before['peakMB']:7.1f} -> {stage['peakMB']:7.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the loadTo ETL stages against moto")
+    parser.add_argument("--states", type=int, default=None, help="limit to the first N states (default: all)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--compare", default=None, help="earlier results json to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    counties = loadCounties(args.states)
+    states = list(counties)
+    with mock_aws():
+        s3_client, db_client, db_resource = setupAWS()
+        writer = batchWriter.ThrottledWriter(db_client)
+        start = time.perf_counter()
+        seedHistory(s3_client, writer, counties, args.seed)
+        print(f"states: {len(states)}, counties: {sum(len(c) for c in counties.values())}, "
+              f"seeded in {time.perf_counter() - start:.1f}s")
+
+        results = {'run': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'states': len(states),
+                   'counties': sum(len(c) for c in counties.values()), 'python': sys.version.split()[0], 'stages': []}
+        print(f"{'stage':>24} {'rows':>8} {'seconds':>9} {'rows/s':>10} {'peak MB':>9}")
+        for name, fn in stages(s3_client, db_resource, writer, states):
+            rows, elapsed, _ = runStage(fn, writer)
+            _, _, peak = runStage(fn, writer, traceMemory=True)
+            results['stages'].append({'stage': name, 'rows': rows, 'seconds': round(elapsed, 4),
+                                      'rowsPerSecond': round(rows / elapsed, 1), 'peakMB': round(peak, 2)})
+            print(f"{name:>24} {rows:>8} {elapsed:>9.2f} {rows / elapsed:>10.0f} {peak:>9.1f}")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"pipeline-{results['run'].replace(':', '')}.json")
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {path}")
+    if args.compare:
+        compare(results, args.compare)
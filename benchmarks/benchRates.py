@@ -0,0 +1,100 @@
+import sys
+import os
+import time
+import random
+import warnings
+from decimal import Decimal
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from loadTo import rateEngine
+
+'''
+File: benchRates.py
+Author: SonnyP
+Benchmark of the columnar rate engine against the original row-by-row merge/iterrows loop.
+Run from the repository root: python benchmarks/benchRates.py [counties] [repeats]
+Functions:
+    makeWeeks
+    legacyCovidRates
+    engineCovidRates
+    timeIt
+'''
+
+#Build four weekly partitions of DynamoDB style items (Decimal values), shuffled so position merging is wrong
+def makeWeeks(counties, seed=7):
+    rng = random.Random(seed)
+    keys = [f"state{i % 50}-county{i}" for i in range(counties)]
+    weeks = []
+    for t in range(4):
+        items = []
+        for k in keys:
+            base = rng.randint(0, 50000)
+            items.append({'state-county': k, 'state': k.split('-')[0],
+                          'cases': Decimal(base + (3 - t) * 100), 'deaths': Decimal(base // 100)})
+        if t > 0:
+            rng.shuffle(items)
+        weeks.append(items)
+    return weeks
+
+#Original updateDynamoCovidRates merge and iterrows loop (kept here as the reference for timing)
+def legacyCovidRates(weeks):
+    cols = ['state-county', 'state', 'cases-today', 'deaths-today',
+            'cases-week1', 'deaths-week1',
+            'cases-week2', 'deaths-week2',
+            'cases-week3', 'deaths-week3']
+    dataLists = [[], [], [], []]
+    for t in range(4):
+        for ln in weeks[t]:
+            if t == 0:
+                dataLists[0].append([{cols[0]: ln['state-county'], cols[1]: ln['state'],
+                                      cols[2]: ln['cases'], cols[3]: ln['deaths']}])
+            else:
+                dataLists[t].append([{cols[2+2*t]: ln['cases'], cols[3+2*t]: ln['deaths']}])
+    data = []
+    for i in range(len(dataLists[0])):
+        dataTemp = dataLists[0][i][0]
+        for d in dataLists[1:]:
+            for dd in d[i]:
+                dataTemp.update(dd)
+        data.append(dataTemp)
+
+    ds = pd.DataFrame(data, columns=cols)
+    ds['monthly-case-rate'] = 0
+    ds['monthly-death-rate'] = 0
+    warnings.simplefilter('ignore', FutureWarning) #pandas warns on the int -> Decimal upcast done by ds.at
+    for index, row in ds.iterrows():
+        if row['cases-week3'] != 0:
+            ds.at[index, 'monthly-case-rate'] = round((row['cases-today'] - row['cases-week3']) / row['cases-week3'], 2) * 100
+        if row['deaths-week3'] != 0:
+            ds.at[index, 'monthly-death-rate'] = round((row['deaths-today'] - row['deaths-week3']) / row['deaths-week3'], 2) * 100
+    return ds
+
+#Columnar engine path used by updateDynamoCovidRates
+def engineCovidRates(weeks):
+    snapshots = {}
+    for t in range(4):
+        snapshots[rateEngine.WEEKS[t]] = rateEngine.itemsToColumns(weeks[t], ['state-county', 'state'], ['cases', 'deaths'])
+    ds = rateEngine.computeCovidRates(snapshots)
+    return rateEngine.toDecimalColumns(ds, ['monthly-case-rate', 'monthly-death-rate'])
+
+#Best wall time of fn(weeks) over repeats
+def timeIt(fn, weeks, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(weeks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3200
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    weeks = makeWeeks(counties)
+
+    legacy = timeIt(legacyCovidRates, weeks, repeats)
+    engine = timeIt(engineCovidRates, weeks, repeats)
+    print(f"counties: {counties} x 4 snapshots, best of {repeats}")
+    print(f"legacy merge + iterrows : {legacy * 1000:9.1f} ms")
+    print(f"columnar key join       : {engine * 1000:9.1f} ms")
+    print(f"speedup                 : {legacy / engine:9.1f}x")
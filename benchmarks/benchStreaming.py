@@ -0,0 +1,77 @@
+import sys
+import os
+import io
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from loadTo import jsonStream
+
+'''
+File: benchStreaming.py
+Author: SonnyP
+Peak memory of the eager putDynamoCovid parse (read + json.loads + json_normalize) against the streaming parser,
+for disease.sh style payloads of growing history length.
+Run from the repository root: python benchmarks/benchStreaming.py [counties] [days ...]
+Functions:
+    makePayload
+    eagerParse
+    streamParse
+    measure
+'''
+
+#disease.sh /historical/usacounties/<state>?lastdays=<days> style payload as bytes
+def makePayload(counties, days):
+    end = datetime(2023, 3, 9)
+    dates = [(end - timedelta(days=d)).strftime('%-m/%-d/%y') for d in range(days - 1, -1, -1)]
+    data = []
+    for c in range(counties):
+        data.append({
+            'province': 'california',
+            'county': f'county {c}',
+            'timeline': {
+                'cases': {d: 1000 + c + i for i, d in enumerate(dates)},
+                'deaths': {d: 10 + i for i, d in enumerate(dates)},
+            },
+        })
+    return json.dumps(data).encode('utf-8')
+
+#What putDynamoCovid does today: whole body, json.loads, json_normalize
+def eagerParse(stream):
+    data = json.loads(stream.read())
+    df = pd.json_normalize(data)
+    return len(df)
+
+#Streaming mode: incremental array parse, rows grouped into fixed-size frames handed to the writer
+def streamParse(stream, chunkRows=5000):
+    rows = 0
+    counties = jsonStream.iterJsonArray(stream)
+    for df in jsonStream.iterFrames(jsonStream.iterCovidRows(counties, '2023-03-10'), chunkRows=chunkRows):
+        rows += len(df)
+    return rows
+
+#Peak traced memory (MB) and wall time of fn over a stream of payload. The payload itself is not counted.
+def measure(fn, payload):
+    stream = io.BufferedReader(io.BytesIO(payload))
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(stream)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20, elapsed
+
+if __name__ == "__main__":
+    counties = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    daysList = [int(d) for d in sys.argv[2:]] or [1, 30, 180, 365]
+
+    print(f"counties: {counties}")
+    print(f"{'days':>6} {'payload MB':>11} {'eager peak MB':>14} {'stream peak MB':>15} {'eager s':>8} {'stream s':>9}")
+    for days in daysList:
+        payload = makePayload(counties, days)
+        eagerPeak, eagerTime = measure(eagerParse, payload)
+        streamPeak, streamTime = measure(streamParse, payload)
+        print(f"{days:>6} {len(payload) / 2**20:>11.1f} {eagerPeak:>14.1f} {streamPeak:>15.1f} {eagerTime:>8.2f} {streamTime:>9.2f}")
@@ -1,41 +1,117 @@
-import json
-from eventbrite import Eventbrite
-import requests
-import pandas as pd
 import logging
+import geoIndex
+import httpClient
+import cache
+import metrics
 
 '''
 Provides functions for making API calls to EventBrite and Mapbox
+All requests go through the pooled sessions in httpClient; keys are read from keys/apikey.json once.
+Eventbrite event and venue payloads are cached in-process (venues for longer, and shared across events);
+ids Eventbrite reports as not found are cached briefly so repeated bad ids do not use API quota.
+Classes:
+    EventbriteError
+    EventbriteNotFound
 Functions:
     authenticate_eventbrite
+    fetch_eventbrite
+    get_event
+    get_venue
     get_eventbrite
     authenticate_map
+    map_location
     get_map
 '''
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename='python_log.log', encoding='utf-8', level=logging.DEBUG)
 
+EVENTBRITE_URL = "https://www.eventbriteapi.com/v3/"
+MAP_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+EVENT_TTL = 900
+VENUE_TTL = 86400
+NOT_FOUND_TTL = 300
+#First item of the (NOT_FOUND, status, error, description) tuple cached for ids Eventbrite reports as not found
+NOT_FOUND = object()
+
+eventCache = cache.TTLCache("eventbrite-event", maxSize=2048, ttl=EVENT_TTL)
+venueCache = cache.TTLCache("eventbrite-venue", maxSize=4096, ttl=VENUE_TTL)
+metrics.add_cache("eventbrite-event", lambda: eventCache.stats())
+metrics.add_cache("eventbrite-venue", lambda: venueCache.stats())
+
+#Error payload returned by the Eventbrite API (status_code, error, error_description)
+class EventbriteError(Exception):
+    def __init__(self, status, error="", description=""):
+        super().__init__(f"Eventbrite {status} {error}: {description}")
+        self.status = status
+        self.error = error
+        self.description = description
+
+class EventbriteNotFound(EventbriteError):
+    pass
+
 def authenticate_eventbrite():
-    data = json.load(open('./keys/apikey.json'))
-    key = data.get('eventbrite')
+    key = httpClient.get_key('eventbrite')
     
     return key
 
+#GET an Eventbrite v3 resource (e.g. "events/123/") and return its json payload, raising EventbriteError
+#(EventbriteNotFound for 404s) when the API reports an error
+def fetch_eventbrite(key, path):
+    header = {"Authorization": "Bearer " + key}
+    response = httpClient.get(EVENTBRITE_URL + path, headers=header)
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {"status_code": response.status_code, "error_description": "response is not json"}
+
+    if response.status_code != 200 or 'status_code' in payload:
+        status = int(payload.get('status_code', response.status_code))
+        error = payload.get('error', "")
+        description = payload.get('error_description', "")
+        logging.info(f"::fetch_eventbrite Error - {path} {status} {error} {description}")
+        if status == 404:
+            raise EventbriteNotFound(status, error, description)
+        raise EventbriteError(status, error, description)
+    return payload
+
+_fetch_event = metrics.timed("eventbrite_event")(fetch_eventbrite)
+_fetch_venue = metrics.timed("eventbrite_venue")(fetch_eventbrite)
+
+#Payload for cacheKey from cacheTTL, fetched with fetch on a miss. Not found results are cached for
+#NOT_FOUND_TTL (the error details only, not the exception and its traceback) and a new EventbriteNotFound
+#is raised on each hit
+def _cached_fetch(cacheTTL, fetch, key, path, cacheKey):
+    payload = cacheTTL.get(cacheKey)
+    if isinstance(payload, tuple) and payload[0] is NOT_FOUND:
+        raise EventbriteNotFound(*payload[1:])
+    if payload is None:
+        try:
+            payload = fetch(key, path)
+        except EventbriteNotFound as err:
+            cacheTTL.set(cacheKey, (NOT_FOUND, err.status, err.error, err.description), ttl=NOT_FOUND_TTL)
+            raise
+        cacheTTL.set(cacheKey, payload)
+    return payload
+
+#Event payload, cached for EVENT_TTL
+def get_event(key, eventID):
+    eventID = str(eventID).strip()
+    return _cached_fetch(eventCache, _fetch_event, key, f"events/{eventID}/", eventID)
+
+#Venue payload, cached for VENUE_TTL and shared by every event at the venue
+def get_venue(key, venueID):
+    venueID = str(venueID).strip()
+    return _cached_fetch(venueCache, _fetch_venue, key, f"venues/{venueID}/", venueID)
+
 def get_eventbrite(key, eventID):
     info = ["name", "description", "start", "end", "venue_id", "logo"]
     info_base = ["text", "text", "local", "local"]
     info_logo = ["url"]
 
-    eb = Eventbrite(key)
-    event = eb.get_event(str(eventID))
-    # print(event)
-    if 'status_code' in event:
-        status = event['status_code']
-        logging.info("::get_eventbrite Error - ", status, event['error_description'])
-        raise #TODO: create custom exceptions for API error codes
-    else:
-        status = "200"
+    event = get_event(key, eventID)
+    status = "200"
 
     eventData = {}
     for i in range(len(info)):
@@ -50,24 +126,19 @@ def get_eventbrite(key, eventID):
             eventData.update(item)
     # print(eventData)
 
-    #Venue endpoint not available in Python SDK
     venueID = eventData['venue_id']
-    venueUrl = "https://www.eventbriteapi.com/v3/venues/"
-    venueUrl += venueID
-    header = {"Authorization": "Bearer " + key}
-    venueResponse = requests.get(venueUrl, headers=header).json()
-
-    if 'status_code' in venueResponse:
-        logging.info("::get_eventbrite Error - ", event['status_code'], event['error_description'])
-        raise #TODO: create custom exceptions for API error codes
+    venueResponse = get_venue(key, venueID)
 
     venueAddress = venueResponse['address']['localized_address_display']
     venueZipcode = venueResponse['address']['postal_code']
+    venueRegion = venueResponse['address'].get('region')
 
-    df = pd.read_csv("./refTables/geo_data.csv")
-    data = df[df['zipcode'] == venueZipcode]
-    venueState = data['state'].item()
-    venueCounty = data['county'].item()
+    #zip -> county from the preloaded index (multi-county zips resolve using the venue's state)
+    location = geoIndex.lookupZip(venueZipcode, venueRegion)
+    if location is None:
+        logging.info(f"::get_eventbrite Error - zipcode {venueZipcode} not in geo index")
+        raise ValueError(f"Venue zipcode {venueZipcode} not found in geo_data")
+    venueState, venueCounty = location[0], location[1]
     
     venueData = {
         "address": venueAddress,
@@ -79,30 +150,33 @@ def get_eventbrite(key, eventID):
     return eventData, venueData, status
 
 def authenticate_map():
-    data = json.load(open('./keys/apikey.json'))
-    key = data.get('googlemap')
+    key = httpClient.get_key('googlemap')
     return key
 
-def get_map(key, venueData):
-
-    mapUrl = "https://maps.googleapis.com/maps/api/staticmap?"
+#Map center for a venue dict (every field but county, comma separated) or a free text location
+def map_location(venueData):
     location = ""
     if isinstance(venueData, dict):
         for d in venueData:
             if d != "county":
                 location += str(venueData[d]) + ", "
-            location = location[:-2]
+        location = location[:-2]
     elif isinstance(venueData, str):
         location = venueData
+    return location
+
+@metrics.timed("get_map")
+def get_map(key, venueData, zoom="10", size="400x400"):
+
+    location = map_location(venueData)
     
-    zoom = "10"
-    size = "400x400"
-    parameter = f"center={location}&format=png&zoom={zoom}&size={size}&key={key}"
-    mapUrl += parameter
-    mapResponse = requests.get(mapUrl)
+    parameter = {"center": location, "format": "png", "zoom": zoom, "size": size, "key": key}
+    mapResponse = httpClient.get(MAP_URL, params=parameter)
     status = mapResponse.status_code
+    img = None
     if mapResponse.status_code != 200:
-        logging.info("::get_map Error - ", mapResponse.status_code)
+        logging.info(f"::get_map Error - {mapResponse.status_code}")
+        metrics.record_error("get_map", f"http_{mapResponse.status_code}")
     else:
         # f = open("testmap.png", "wb")
         # f.write(mapResponse.content)
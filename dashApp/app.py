@@ -1,22 +1,28 @@
 import os
-from dash import Dash, Input, Output, State, html, dcc, callback
+from dash import Dash, Input, Output, State, html, dcc, callback, no_update
 import dash_daq as daq
 from dash.exceptions import PreventUpdate
-import pandas as pd
+from functools import lru_cache
 import logging
 import api as a
 import awsdb as db
+import mapCache
+import fanout
+import countySnapshot
+import geoIndex
+import metrics
 import json
+import csv
 
 '''
 File: app.py
 Author: SonnyP
 Description: Flask/Dash dashboard application for integrated Covid & Flu risk at event locations.
+The DynamoDB resource and reference files are loaded on first use so the server starts without touching AWS.
 '''
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename='python_log.log', encoding='utf-8', level=logging.DEBUG)
-db_resource = db.connectDynamo(logger=logger, region="us-east-2")
 
 asst_path = os.path.join(os.getcwd(), "assets")
 app = Dash(
@@ -27,20 +33,98 @@ app = Dash(
 app.title = "Event Attendance Safety Levels"
 server = app.server
 app.config["suppress_callback_exceptions"] = True
+mapCache.register_routes(server)
+metrics.register_routes(server)
+
+#DynamoDB resource, connected on the first lookup
+@lru_cache(maxsize=None)
+def get_db_resource():
+    return db.connectDynamo(logger=logger, region="us-east-2")
 
 #Load tablenames from awstables.json for functions to access correct AWS DynamoDB Tables
-awsNames = json.load(open(asst_path + '/awstables.json'))
-covidbucket = awsNames.get('covidbucket')
-covidtable = awsNames.get('covidtable')
-covidmonthly = awsNames.get('covidmonthlytable')
-flubucket = awsNames.get('flubucket')
-flutable = awsNames.get('flutable')
-flumonthly = awsNames.get('flumonthlytable')
+@lru_cache(maxsize=None)
+def get_aws_names():
+    with open(asst_path + '/awstables.json') as f:
+        return json.load(f)
 
 #Load list of states and correlating regions for functions to access correct AWS DynamoDB Tables
-statesCsv = pd.read_csv(asst_path + '/statesPartial.csv', usecols=['State', 'Region'])
-hhsDict = dict(zip(statesCsv.State, statesCsv.Region))
-statesList = statesCsv['State'].tolist()
+#Returns (state -> HHS region dict, list of states). Regions are keyed by the csv id (new_york) and the
+#table form of the name (new york)
+@lru_cache(maxsize=None)
+def get_states():
+    with open(asst_path + '/statesPartial.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+    hhsDict = {row['State']: int(row['Region']) for row in rows}
+    hhsDict.update({geoIndex.normalizeName(row['State']): int(row['Region']) for row in rows})
+    statesList = [row['State'] for row in rows]
+    return hhsDict, statesList
+
+#Number of counties offered while typing in the county dropdown
+COUNTY_SEARCH_LIMIT = 10
+
+#Per-call timeouts (seconds) for the external calls made by the callbacks
+EVENTBRITE_TIMEOUT = 10
+DB_TIMEOUT = 5
+MAP_TIMEOUT = 8
+
+#Snapshot read mode: with ESL_SNAPSHOT set to the file written by loadToDynamo.py --snapshot, covid and flu
+#lookups are served from the memory-mapped snapshot and only fall back to DynamoDB for keys it does not have
+SNAPSHOT_PATH = os.environ.get("ESL_SNAPSHOT")
+snapshot = countySnapshot.SnapshotReader(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
+
+#Covid, flu and map lookups for a location, run at the same time on the shared executor
+def fetch_location_data(county, state, mapLocation):
+    keyMap = a.authenticate_map()
+    hhsDict = get_states()[0]
+    covidDict = fluDict = None
+    if snapshot is not None:
+        covidDict = snapshot.get_covid(county, state)
+        fluDict = snapshot.get_flu(state, hhsDict)
+
+    calls = {"map": (mapCache.get_map_url, (keyMap, mapLocation), MAP_TIMEOUT)}
+    if covidDict is None or fluDict is None:
+        db_resource = get_db_resource()
+        awsNames = get_aws_names()
+        if covidDict is None:
+            calls["covid"] = (db.get_df_covid, (county, state, db_resource, logger, awsNames.get('covidmonthlytable')), DB_TIMEOUT)
+        if fluDict is None:
+            calls["flu"] = (db.get_df_flu, (state, db_resource, logger, awsNames.get('flumonthlytable'), hhsDict), DB_TIMEOUT)
+    results = fanout.run_calls(calls, fallbacks={"map": mapCache.DEFAULT_IMAGE})
+
+    if covidDict is None:
+        covidDict = results["covid"][0]
+    if fluDict is None:
+        fluDict = results["flu"][0]
+    return covidDict, fluDict, results["map"]
+
+#Columns of the state heat map: (label, key in get_state_covid rows)
+HEATMAP_COLUMNS = [("Cases today", "daily-covid-cases"), ("Deaths today", "daily-covid-deaths"),
+                   ("Monthly case rate %", "monthly-covid-case-rate"), ("Monthly death rate %", "monthly-covid-death-rate")]
+
+#Plotly heatmap figure (as a dict, so plotly is not imported) of every county of a state x the covid measures.
+#Each column is scaled by its largest absolute value so counts and rates share one color scale; hover shows values
+def build_heatmap_figure(rows, state):
+    counties = [row["county"].title() for row in rows]
+    z, text = [], []
+    scales = [max([abs(row.get(key, 0)) for row in rows] + [0]) or 1 for _, key in HEATMAP_COLUMNS]
+    for row in rows:
+        values = [row.get(key, 0) for _, key in HEATMAP_COLUMNS]
+        z.append([value / scale for value, scale in zip(values, scales)])
+        text.append([f"{value:,.0f}" if isinstance(value, int) else f"{value:,.1f}" for value in values])
+    return {
+        "data": [{
+            "type": "heatmap", "z": z, "x": [label for label, _ in HEATMAP_COLUMNS], "y": counties,
+            "text": text, "hovertemplate": "%{y}<br>%{x}: %{text}<extra></extra>",
+            "colorscale": "RdBu", "reversescale": True, "zmid": 0, "showscale": False,
+        }],
+        "layout": {
+            "title": {"text": f"Covid by County: {state.replace('_', ' ').title()}"},
+            "height": max(300, 20 * len(counties) + 120),
+            "yaxis": {"autorange": "reversed", "automargin": True},
+            "xaxis": {"side": "top"},
+            "margin": {"t": 100},
+        },
+    }
 
 # ===== html object builds =====
 def build_banner():
@@ -148,19 +232,19 @@ def build_state_input():
         className="inputEvent",
         children=[
         dcc.Dropdown(
-            options=statesList,
+            options=get_states()[1],
             id="state-id",
             className="input",
             placeholder="Select State from Dropdown...",
             persistence=True,
             style={"width":"25vw", "margin":"2px"},
         ),
-        dcc.Input(
+        dcc.Dropdown(
+            options=[],
             id="county-id",
             className="input",
-            type="text",
             placeholder="Type in County here...",
-            debounce=True,
+            searchable=True,
             persistence=True,
             style={"width":"25vw", "margin":"2px"},
         ),
@@ -262,7 +346,7 @@ def build_flu_panel():
                 id="led-flu-1",
                 className="panelLED",
                 children=[
-                    html.H4("Current Flu Patient Cases"),
+                    html.H4("Current Flu Patients %"),
                     daq.LEDDisplay(
                         id="led-flu-cases-today",
                         value="000000",
@@ -282,7 +366,7 @@ def build_flu_panel():
                     id="led-flu-2",
                     className="panelLED",
                     children=[
-                        html.H4("Previous Month Flu Patient Cases"),
+                        html.H4("Previous Month Flu Patients %"),
                         daq.LEDDisplay(
                             id="led-flu-cases-week3",
                             value="000000",
@@ -313,6 +397,15 @@ def build_map_panel():
         ],
     )
 
+def build_heatmap_panel():
+    return html.Div(
+        id="heatmap-panel",
+        className="panelMap",
+        children=[
+            dcc.Graph(id="state-heatmap", config={"displayModeBar": False}),
+        ],
+    )
+
 def build_event_info_panel():
     return html.Div(
         id="event-info-panel",
@@ -458,6 +551,14 @@ def render_tab_content(tab_switch):
                             build_map_panel(),
                         ],
                     ),
+                    html.Div(
+                        id="heatmap-container",
+                        children=[
+                            html.H3("State Heat Map",
+                                    className="panelLabel"),
+                            build_heatmap_panel(),
+                        ],
+                    ),
                 ],
             ),
         )
@@ -502,15 +603,13 @@ def update_data_to_event(n_clicks, eventID):
     if (n_clicks == 1):
         # Update Covid Data
         keyEventBrite = a.authenticate_eventbrite()
-        event, venue = a.get_eventbrite(keyEventBrite, eventID)[0:2]
+        event, venue = fanout.run_calls({
+            "eventbrite": (a.get_eventbrite, (keyEventBrite, eventID), EVENTBRITE_TIMEOUT),
+        })["eventbrite"][0:2]
 
         county = venue['county']
         state = venue['state']
-        covidDict = db.get_df_covid(county=county, 
-                                state=state, 
-                                db_resource=db_resource, 
-                                logger=logger, 
-                                tableName=covidmonthly)[0]
+        covidDict, fluDict, imgUrl = fetch_location_data(county, state, venue)
 
         covidDict['monthly-covid-case-rate'] *= 100
         covidDict['monthly-covid-death-rate'] *= 100
@@ -518,25 +617,12 @@ def update_data_to_event(n_clicks, eventID):
         covidDeaths=covidDict['daily-covid-deaths']
         covidCaseRate=covidDict['monthly-covid-case-rate']
         covidDeathRate=covidDict['monthly-covid-death-rate']
-        logging.info("::update_data_to_event: covidDict = ", covidDict)
+        logging.info(f"::update_data_to_event: covidDict = {covidDict}")
         
         #Update Flu Data
-        fluDict = db.get_df_flu(state=state,
-                                  db_resource=db_resource,
-                                  logger=logger,
-                                  tableName=flumonthly,
-                                  hhsRegion=hhsDict)[0]
         fluCasesToday = fluDict['today-case-rate']
         fluCasesPast = fluDict['week3-case-rate']
-        logging.info("::update_data_to_event: fluDict = ", fluDict)
-   
-        #Update Map Data
-        keyMap = a.authenticate_map()
-        img = a.get_map(keyMap, venue)[0]
-        f = open("./dashApp/assets/staticmap.png", "wb")
-        f.write(img)
-        f.close
-        imgUrl = "/assets/staticmap.png"
+        logging.info(f"::update_data_to_event: fluDict = {fluDict}")
 
         #Update Event Data
         eventName = event['name']
@@ -552,6 +638,25 @@ def update_data_to_event(n_clicks, eventID):
         fluCasesToday, fluCasesPast, imgUrl, \
         eventName, eventDesc, eventTime, eventVenue, eventArtUrl
 
+# ====== Callback offering the counties of the selected state that start with what is typed =====
+#A selected county that is not in the selected state (e.g. after the state changed) is cleared
+@app.callback(
+    Output("county-id", "options"),
+    Output("county-id", "value"),
+    Input("county-id", "search_value"),
+    Input("state-id", "value"),
+    State("county-id", "value"),
+)
+def update_county_options(search, stateID, countyID):
+    valid = bool(countyID) and geoIndex.stateCountyKey(stateID, countyID) is not None
+    value = None if countyID and not valid else no_update
+    if not stateID:
+        return [], value
+    if not search:
+        #keep the selected county displayable until something new is typed
+        return ([countyID] if valid else []), value
+    return geoIndex.searchCounties(stateID, search, COUNTY_SEARCH_LIMIT), value
+
 # ====== Callbacks to update stored data via click, State/County =====
 @app.callback(
     output=[
@@ -560,6 +665,7 @@ def update_data_to_event(n_clicks, eventID):
             # Output("event-data", "data"), 
             # Output("map-img", "src"),
             Output("submit-state-button", "n_clicks"),
+            Output("validate-state", "children"),
             Output("led-covid-cases", "value"),
             Output("led-covid-deaths", "value"),
             Output("bar-covid-cases", "value"),
@@ -577,14 +683,27 @@ def update_data_to_event(n_clicks, eventID):
 )
 def update_data_to_event(n_clicks, stateID, countyID):
     if (n_clicks == 1):
+        #Reject unknown state/county pairs before any DynamoDB or map request
+        key = geoIndex.stateCountyKey(stateID, countyID)
+        if key is None:
+            logging.info(f"::update_data_to_event: unknown county {countyID} for {stateID}")
+            if not stateID or not countyID:
+                message = "Select a state and a county"
+            else:
+                message = f"Unknown county '{countyID}' for {stateID.replace('_', ' ').title()}"
+                suggestions = geoIndex.searchCounties(stateID, countyID[:3], 3)
+                if suggestions:
+                    message += ". Did you mean: " + ", ".join(suggestions) + "?"
+            return (None, message) + (no_update,) * 7
+
         # Update Covid Data
-        county = countyID
-        state = stateID
-        covidDict = db.get_df_covid(county=county, 
-                                state=state, 
-                                db_resource=db_resource, 
-                                logger=logger, 
-                                tableName=covidmonthly)[0]
+        state, county = key.split("-", 1)
+        try:
+            covidDict, fluDict, imgUrl = fetch_location_data(county, state, str(county + " " + state))
+        except LookupError as err:
+            #a county in geo_data.csv the monthly tables have no item for
+            logging.info(f"::update_data_to_event: {err}")
+            return (None, str(err)) + (no_update,) * 7
 
         covidDict['monthly-covid-case-rate'] *= 100
         covidDict['monthly-covid-death-rate'] *= 100
@@ -592,31 +711,41 @@ def update_data_to_event(n_clicks, stateID, countyID):
         covidDeaths=covidDict['daily-covid-deaths']
         covidCaseRate=covidDict['monthly-covid-case-rate']
         covidDeathRate=covidDict['monthly-covid-death-rate']
-        logging.info("::update_data_to_event: covidDict = ", covidDict)
+        logging.info(f"::update_data_to_event: covidDict = {covidDict}")
         
         #Update Flu Data
-        fluDict = db.get_df_flu(state=state,
-                                  db_resource=db_resource,
-                                  logger=logger,
-                                  tableName=flumonthly,
-                                  hhsRegion=hhsDict)[0]
         fluCasesToday = fluDict['today-case-rate']
         fluCasesPast = fluDict['week3-case-rate']
-        logging.info("::update_data_to_event: fluDict = ", fluDict)
-   
-        #Update Map Data
-        keyMap = a.authenticate_map()
-        img = a.get_map(keyMap, str(county + " " + state))[0]
-        f = open("./dashApp/assets/staticmap.png", "wb")
-        f.write(img)
-        f.close
-        imgUrl = "/assets/staticmap.png"
+        logging.info(f"::update_data_to_event: fluDict = {fluDict}")
 
     else:
         raise PreventUpdate
-    return None, \
+    return None, "", \
         covidCases, covidDeaths, covidCaseRate, covidDeathRate, \
         fluCasesToday, fluCasesPast, imgUrl
 
+# ====== Callback to draw every county of the selected state from one cached state query =====
+@app.callback(
+    Output("state-heatmap", "figure"),
+    Input("state-id", "value"),
+    prevent_initial_call=True
+)
+def update_state_heatmap(stateID):
+    if not stateID:
+        raise PreventUpdate
+    from botocore.exceptions import ClientError
+    tableName = get_aws_names().get('covidmonthlytable')
+    #runs on every state selection: a missing or backfilling state index, throttling or a slow query leaves the map
+    #empty instead of failing the callback
+    try:
+        rows = fanout.run_calls({
+            "state": (db.get_state_covid, (stateID.replace('_', ' '), get_db_resource(), logger, tableName), DB_TIMEOUT),
+        })["state"]
+    except (ClientError, fanout.TimeoutError) as err:
+        logger.error("::update_state_heatmap %s failed... %s: %s", stateID, type(err).__name__, err)
+        rows = []
+    logging.info(f"::update_state_heatmap: {stateID} {len(rows)} counties")
+    return build_heatmap_figure(rows, stateID)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
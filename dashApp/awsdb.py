@@ -1,23 +1,41 @@
-from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key, Attr
-import boto3
 import logging
 import json
 from decimal import Decimal
+import cache
+import metrics
 
 '''
-Provides functions for dashApp to access AWS DynamoDB data on Covid and Flu infection rates
+Provides functions for dashApp to access AWS DynamoDB data on Covid and Flu infection rates.
+Post-processed results are kept in in-process TTL caches that are cleared when the ETL writes a new run marker.
+boto3/botocore are imported when first needed so importing the dashboard does not load them.
 '''
 
+#Key of the item the ETL writes to each monthly table when a run finishes (see loadToDynamo.putRunMarker)
+ETL_RUN_KEY = "etl-run"
+#Global secondary index of covidmonthly on state (assets/tableSchema.json covidMonthIndexes)
+STATE_INDEX = "state-index"
+
+covidCache = cache.TTLCache("covidmonthly", maxSize=4096, ttl=3600)
+fluCache = cache.TTLCache("flumonthly", maxSize=64, ttl=3600)
+stateCache = cache.TTLCache("covidmonthly-state", maxSize=64, ttl=3600)
+metrics.add_cache("covidmonthly", lambda: covidCache.stats())
+metrics.add_cache("flumonthly", lambda: fluCache.stats())
+metrics.add_cache("covidmonthly-state", lambda: stateCache.stats())
+
 #Helper function for json dump 
 def decimal_serializer(obj):
     if isinstance(obj, Decimal):
         return int(obj)
     raise TypeError("Type not serializable")
 
+#Flu rates are stored as num_ili / num_patients fractions; the dashboard shows them as a percent of patients
+def flu_percent(obj):
+    return round(float(obj) * 100, 2)
+
 #Connect to AWS DynamoDB
 def connectDynamo(logger, region):
+    import boto3
+    from botocore.exceptions import ClientError
     try:
         db_resource = boto3.resource('dynamodb', region_name=region)
     except ClientError as err:
@@ -30,17 +48,35 @@ def connectDynamo(logger, region):
     
     return db_resource
 
-#Get dataframe of covid monthly rates
+#Run id of the last ETL run that updated a monthly table, None if no marker was written
+def get_etl_run(db_resource, tableName, key):
+    response = db_resource.Table(tableName).get_item(Key=key)
+    return response.get("Item", {}).get("run-id")
+
+#Hit/miss counts of the covid and flu caches
+def cache_stats():
+    return {"covid": covidCache.stats(), "flu": fluCache.stats(), "state": stateCache.stats()}
+
+#Get dataframe of covid monthly rates. Raises LookupError when the table has no item for the county
+@metrics.timed("get_df_covid")
 def get_df_covid(county, state, db_resource, logger, tableName):
     county = county.lower()
     state = state.lower()
     stateCounty = state + '-' + county
+
+    covidCache.checkMarker(lambda: get_etl_run(db_resource, tableName, {"state-county": ETL_RUN_KEY, "state": ETL_RUN_KEY}))
+    cached = covidCache.get((tableName, stateCounty))
+    if cached is not None:
+        #callers modify the returned dict, so hand out a copy
+        return dict(cached[0]), cached[1]
+
+    from botocore.exceptions import ClientError
     try:
         table = db_resource.Table(tableName)
         response = table.get_item(Key={"state-county": stateCounty, "state": state})
         if not 'Item' in response:
             logger.error('::Item not found in AWS Database::')
-            raise
+            raise LookupError(f"No Covid data for {county.title()}, {state.title()}")
         status = response["ResponseMetadata"]["HTTPStatusCode"]
         keep = {"monthly-death-rate", "deaths-today", "monthly-case-rate", "cases-today"}
         rename ={"cases-today":"daily-covid-cases", "deaths-today":"daily-covid-deaths", "monthly-case-rate":"monthly-covid-case-rate", "monthly-death-rate":"monthly-covid-death-rate"}
@@ -56,25 +92,75 @@ def get_df_covid(county, state, db_resource, logger, tableName):
         raise
     else:
         logging.info(f"::get_def_covid for {county}-{state} Covid monthly Successful")
-        return data, status
+        covidCache.set((tableName, stateCounty), (data, status))
+        return dict(data), status
+
+#Covid monthly rates of every county in a state from one paginated query of the state index
+#Returns a list of dicts (county plus the same keys as get_df_covid, rates kept as floats) sorted by county
+@metrics.timed("get_state_covid")
+def get_state_covid(state, db_resource, logger, tableName, indexName=STATE_INDEX):
+    state = state.lower()
 
-#Get dataframe of flu monthly rates 
+    stateCache.checkMarker(lambda: get_etl_run(db_resource, tableName, {"state-county": ETL_RUN_KEY, "state": ETL_RUN_KEY}))
+    cached = stateCache.get((tableName, state))
+    if cached is not None:
+        return [dict(row) for row in cached]
+
+    from boto3.dynamodb.conditions import Key
+    from botocore.exceptions import ClientError
+    rename = {"cases-today": "daily-covid-cases", "deaths-today": "daily-covid-deaths",
+              "monthly-case-rate": "monthly-covid-case-rate", "monthly-death-rate": "monthly-covid-death-rate"}
+    rows = []
+    try:
+        table = db_resource.Table(tableName)
+        query = {"IndexName": indexName, "KeyConditionExpression": Key("state").eq(state)}
+        while True:
+            response = table.query(**query)
+            for item in response["Items"]:
+                row = {"county": item["state-county"][len(state) + 1:]}
+                for key, name in rename.items():
+                    if key in item:
+                        row[name] = float(item[key]) if "rate" in key else decimal_serializer(item[key])
+                rows.append(row)
+            if "LastEvaluatedKey" not in response:
+                break
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as err:
+        logger.error(
+            "::get_state_covid Couldn't query DynamoDB -- %s: %s",
+            err.response["Error"]["Code"],
+            err.response["Error"]["Message"],
+        )
+        raise
+    logging.info(f"::get_state_covid {state}: {len(rows)} counties")
+    rows.sort(key=lambda row: row["county"])
+    stateCache.set((tableName, state), rows)
+    return [dict(row) for row in rows]
+
+#Get dataframe of flu monthly rates. Raises LookupError when the table has no item for the region
+@metrics.timed("get_df_flu")
 def get_df_flu(state, db_resource, logger, tableName, hhsRegion):
     state = state.lower()
     region = hhsRegion[state]
     key = "hhs" + str(region)
 
+    fluCache.checkMarker(lambda: get_etl_run(db_resource, tableName, {"region": ETL_RUN_KEY}))
+    cached = fluCache.get((tableName, key))
+    if cached is not None:
+        return dict(cached[0]), cached[1]
+
+    from botocore.exceptions import ClientError
     try:
         table = db_resource.Table(tableName)
         response = table.get_item(Key={"region": key})
         if not 'Item' in response:
             logger.error('::Item not found in AWS Database::')
-            raise
+            raise LookupError(f"No Flu data for {state.title()} (HHS region {region})")
         status = response["ResponseMetadata"]["HTTPStatusCode"]
         keep = {"today-case-rate", "week3-case-rate"}
         data = {key : val for key ,val in response["Item"].items() if key in keep}
         for key in data:
-            data[key] = decimal_serializer(data[key])
+            data[key] = flu_percent(data[key])
     except ClientError as err:
         logger.error(
             "::get_df_flu Couldn't retrieve items from DynamoDB -- ",
@@ -84,7 +170,8 @@ def get_df_flu(state, db_resource, logger, tableName, hhsRegion):
         raise
     else:
         logging.info(f"::get_def for {state}, HHS {region} Flu monthly Successful")
-        return data, status
+        fluCache.set((tableName, key), (data, status))
+        return dict(data), status
 
 if __name__ == "__main__":
     logger = logging.getLogger(__name__)
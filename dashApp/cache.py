@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import threading
+import logging
+import time
+
+'''
+File: cache.py
+Author: SonnyP
+In-process LRU cache with per-entry TTL, hit/miss counters and invalidation when the ETL run marker changes.
+Classes:
+    TTLCache
+'''
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+#Thread-safe LRU cache. Entries expire ttl seconds after they are set; the least recently used entry is evicted
+#once maxSize is reached. checkMarker clears everything when the ETL run marker changes.
+class TTLCache:
+    def __init__(self, name, maxSize=1024, ttl=3600, markerInterval=60, clock=time.monotonic):
+        self.name = name
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.markerInterval = markerInterval
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.marker = _MISSING
+        self.markerChecked = None
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+    #Cached value for key, or default on a miss (expired entries count as misses)
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] <= self.clock():
+                del self.entries[key]
+                self.counts['expired'] += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self.counts['misses'] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.counts['hits'] += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    #Read-through: cached value for key, otherwise loader() is called and its result cached
+    def getOrLoad(self, key, loader, ttl=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.counts['invalidations'] += 1
+
+    #Call loadMarker() at most once every markerInterval seconds and clear the cache when its value changes
+    def checkMarker(self, loadMarker):
+        now = self.clock()
+        with self.lock:
+            if self.markerChecked is not None and now - self.markerChecked < self.markerInterval:
+                return
+            self.markerChecked = now
+        try:
+            marker = loadMarker()
+        except Exception as err:
+            logger.info(f"::TTLCache {self.name} could not read ETL run marker: {err}")
+            return
+        with self.lock:
+            changed = self.marker is not _MISSING and marker != self.marker
+            self.marker = marker
+        if changed:
+            logger.info(f"::TTLCache {self.name} ETL run marker changed to {marker}, clearing cache")
+            self.invalidate()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, size=len(self.entries))
@@ -0,0 +1,118 @@
+import threading
+import logging
+import struct
+import mmap
+import time
+import os
+
+'''
+File: countySnapshot.py
+Author: SonnyP
+Reads the county snapshot written by the ETL (loadTo/countySnapshot.py) through a memory map, so covid and flu
+lookups are a binary search over fixed-width records instead of a DynamoDB round trip. SnapshotReader re-opens
+the file when a new snapshot replaces it.
+Classes:
+    CountySnapshot
+    SnapshotReader
+'''
+
+logger = logging.getLogger(__name__)
+
+#Must match loadTo/countySnapshot.py
+MAGIC = b'ESLSNAP\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIII36s')
+COVID_VALUES = '<qqdd'
+FLU_VALUES = '<dd'
+
+#One memory-mapped snapshot file
+class CountySnapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, covidWidth, fluWidth, covidCount, fluCount, runId = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} county snapshot")
+        self.runId = runId.rstrip(b'\x00').decode('utf-8')
+
+        self.covid = self._table(HEADER.size, covidWidth, covidCount, COVID_VALUES)
+        covidEnd = HEADER.size + covidCount * self.covid[1].size
+        self.flu = self._table(covidEnd, fluWidth, fluCount, FLU_VALUES)
+        if len(self.buffer) != covidEnd + fluCount * self.flu[1].size:
+            raise ValueError(f"{path} is truncated")
+
+    @staticmethod
+    def _table(offset, width, count, valueFormat):
+        return (offset, struct.Struct(f'{valueFormat[0]}{width}s{valueFormat[1:]}'), width, count)
+
+    #Values of the record with key, or None. Records are sorted by their NUL padded key bytes.
+    def _find(self, table, key):
+        offset, record, width, count = table
+        key = key.encode('utf-8')
+        if len(key) > width:
+            return None
+        key = key.ljust(width, b'\x00')
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * record.size
+            found = self.buffer[start:start + width]
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return record.unpack_from(self.buffer, start)[1:]
+        return None
+
+    #Same dict as awsdb.get_df_covid (values truncated to int the same way), or None if the county is missing
+    def get_covid(self, county, state):
+        values = self._find(self.covid, state.lower() + '-' + county.lower())
+        if values is None:
+            return None
+        names = ["daily-covid-cases", "daily-covid-deaths", "monthly-covid-case-rate", "monthly-covid-death-rate"]
+        return {name: int(value) for name, value in zip(names, values)}
+
+    #Same dict as awsdb.get_df_flu (rates as a percent of patients), or None if the region is missing
+    def get_flu(self, state, hhsRegion):
+        values = self._find(self.flu, "hhs" + str(hhsRegion[state.lower()]))
+        if values is None:
+            return None
+        return {"today-case-rate": round(values[0] * 100, 2), "week3-case-rate": round(values[1] * 100, 2)}
+
+#Current snapshot at path. At most every checkInterval seconds the file is stat'ed and, if it was replaced,
+#the new snapshot is mapped and swapped in; lookups already running keep using the old mapping.
+class SnapshotReader:
+    def __init__(self, path, checkInterval=5, clock=time.monotonic):
+        self.path = path
+        self.checkInterval = checkInterval
+        self.clock = clock
+        self.snapshot = None
+        self.signature = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        now = self.clock()
+        with self.lock:
+            if self.checked is not None and now - self.checked < self.checkInterval:
+                return self.snapshot
+            self.checked = now
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                if signature != self.signature:
+                    self.snapshot = CountySnapshot(self.path)
+                    self.signature = signature
+                    logger.info(f"::SnapshotReader loaded {self.path} run-id: {self.snapshot.runId}")
+            except (OSError, ValueError, struct.error) as err:
+                logger.info(f"::SnapshotReader could not load {self.path}, keeping previous snapshot: {err}")
+            return self.snapshot
+
+    def get_covid(self, county, state):
+        snapshot = self.current()
+        return None if snapshot is None else snapshot.get_covid(county, state)
+
+    def get_flu(self, state, hhsRegion):
+        snapshot = self.current()
+        return None if snapshot is None else snapshot.get_flu(state, hhsRegion)
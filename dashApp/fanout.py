@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import logging
+import time
+
+'''
+File: fanout.py
+Author: SonnyP
+Shared thread pool for running a callback's independent external calls (DynamoDB, Google Maps) at the same time.
+Functions:
+    run_calls
+'''
+
+logger = logging.getLogger(__name__)
+
+#Shared by every callback. Set to None to run calls one after another (used for latency comparisons).
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="callback-fanout")
+
+#Run independent calls concurrently and wait for all of them.
+#calls: dict of name -> (fn, args tuple, timeout seconds). Returns dict of name -> result.
+#A call that fails re-raises its error; a call still running after its timeout raises TimeoutError,
+#unless a fallback is given for its name, in which case the fallback value is used instead.
+def run_calls(calls, fallbacks=None):
+    fallbacks = fallbacks or {}
+    results = {}
+
+    if executor is None:
+        for name, (fn, args, _) in calls.items():
+            results[name] = fn(*args)
+        return results
+
+    start = time.monotonic()
+    futures = {name: executor.submit(fn, *args) for name, (fn, args, _) in calls.items()}
+    for name, future in futures.items():
+        timeout = calls[name][2]
+        try:
+            results[name] = future.result(timeout=max(0, start + timeout - time.monotonic()))
+        except TimeoutError:
+            logger.error(f"::run_calls {name} timed out after {timeout}s")
+            if name not in fallbacks:
+                raise
+            results[name] = fallbacks[name]
+    return results
@@ -0,0 +1,144 @@
+from bisect import bisect_left
+import threading
+import logging
+import pickle
+import csv
+import sys
+import os
+
+'''
+File: geoIndex.py
+Author: SonnyP
+Zipcode -> (state, county) index built once from assets/geo_data.csv and cached as a pickle next to it,
+so venue lookups are a dict get instead of a pandas scan per request.
+A per-state sorted index of county names from the same csv answers county prefix searches and validates
+(state, county) pairs in memory, before any DynamoDB or map request is made.
+Functions:
+    normalizeZip
+    buildZipIndex
+    loadZipIndex
+    lookupZip
+    normalizeName
+    buildCountyIndex
+    searchCounties
+    stateCountyKey
+'''
+
+logger = logging.getLogger(__name__)
+
+GEO_CSV = './assets/geo_data.csv'
+INDEX_PATH = './assets/geo_index.pkl'
+INDEX_VERSION = 2
+
+_index = None
+_counties = None
+_lock = threading.Lock()
+
+#5 character zipcode key as stored in geo_data.csv ("94105-1234" -> "94105", 501 -> "00501")
+def normalizeZip(zipcode):
+    zipcode = str(zipcode).strip()[:5]
+    return zipcode.zfill(5) if zipcode.isdigit() else zipcode.upper()
+
+#Build {zip: ((state, state_abbr, county), ...)} from the csv. Most zips have one entry; a zip spanning several
+#counties (or states) keeps every pair in file order.
+def buildZipIndex(csvPath=GEO_CSV):
+    zips = {}
+    with open(csvPath, newline='') as f:
+        for row in csv.DictReader(f):
+            zipcode = normalizeZip(row['zipcode'])
+            entry = (sys.intern(row['state']), sys.intern(row['state_abbr']), sys.intern(row['county']))
+            found = zips.get(zipcode, ())
+            if entry not in found:
+                zips[zipcode] = found + (entry,)
+    return zips
+
+def _signature(csvPath):
+    stat = os.stat(csvPath)
+    return (INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+
+#Load the pickled index, rebuilding it when missing or older than the csv
+def loadZipIndex(csvPath=GEO_CSV, indexPath=INDEX_PATH):
+    signature = _signature(csvPath)
+    try:
+        with open(indexPath, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('signature') == signature:
+            return cached['zips']
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+        pass
+
+    zips = buildZipIndex(csvPath)
+    try:
+        tmp = indexPath + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'signature': signature, 'zips': zips}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, indexPath)
+    except OSError as err:
+        logger.info(f"::loadZipIndex could not cache index at {indexPath}: {err}")
+    logger.info(f"::loadZipIndex built index of {len(zips)} zipcodes")
+    return zips
+
+#(state, county, alternates) for a zipcode, or None if unknown. The index is loaded on first use.
+#For a zip spanning several counties, stateAbbr (e.g. the venue address region "NY") picks the matching one,
+#otherwise the first; the other (state, county) pairs are returned as alternates.
+def lookupZip(zipcode, stateAbbr=None):
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = loadZipIndex()
+    entries = _index.get(normalizeZip(zipcode))
+    if not entries:
+        return None
+
+    best = entries[0]
+    if stateAbbr and len(entries) > 1:
+        best = next((e for e in entries if e[1] == str(stateAbbr).upper()), best)
+    alternates = tuple((e[0], e[2]) for e in entries if e is not best)
+    return best[0], best[2], alternates
+
+#Name in the form used by the DynamoDB keys: lower case, single spaces ("New_York" -> "new york")
+def normalizeName(name):
+    return " ".join(str(name).replace("_", " ").lower().split())
+
+#Build {state: (sorted normalized county names, {normalized name: county name as in the csv})}
+def buildCountyIndex(csvPath=GEO_CSV):
+    names = {}
+    with open(csvPath, newline='') as f:
+        for row in csv.DictReader(f):
+            county = row['county']
+            names.setdefault(normalizeName(row['state']), {}).setdefault(normalizeName(county), county)
+    return {state: (tuple(sorted(counties)), counties) for state, counties in names.items()}
+
+def _countyIndex():
+    global _counties
+    if _counties is None:
+        with _lock:
+            if _counties is None:
+                _counties = buildCountyIndex()
+                logger.info(f"::_countyIndex built index of {sum(len(c[0]) for c in _counties.values())} counties")
+    return _counties
+
+#Up to limit county names (as in the csv) of state starting with prefix, in alphabetical order
+def searchCounties(state, prefix, limit=10):
+    entry = _countyIndex().get(normalizeName(state))
+    if entry is None:
+        return []
+    names, display = entry
+    prefix = normalizeName(prefix)
+    matches = []
+    for i in range(bisect_left(names, prefix), len(names)):
+        if not names[i].startswith(prefix) or len(matches) >= limit:
+            break
+        matches.append(display[names[i]])
+    return matches
+
+#Table key ("state-county", normalized) of a known (state, county) pair, or None if geo_data.csv does not have it
+def stateCountyKey(state, county):
+    if not state or not county:
+        return None
+    entry = _countyIndex().get(normalizeName(state))
+    county = normalizeName(county)
+    if entry is None or county not in entry[1]:
+        return None
+    return normalizeName(state) + "-" + county
@@ -0,0 +1,75 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
+import threading
+import requests
+import logging
+import json
+
+'''
+File: httpClient.py
+Author: SonnyP
+Shared HTTP client for the external APIs. One keep-alive requests.Session per host with a bounded connection
+pool, connect/read timeouts and a small number of retries on connection errors and 429/5xx responses.
+API keys are read from keys/apikey.json once per process.
+Functions:
+    load_keys
+    get_key
+    get_session
+    get
+'''
+
+logger = logging.getLogger(__name__)
+
+KEYS_PATH = './keys/apikey.json'
+
+#(connect, read) seconds; connect is just over a multiple of 3s (the TCP retransmission window)
+TIMEOUT = (3.05, 10)
+#Sized to the callback fan-out pool so concurrent callbacks do not queue on the connection pool
+POOL_SIZE = 16
+RETRY = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD"]),
+    respect_retry_after_header=True,
+    raise_on_status=False
+    )
+
+_sessions = {}
+_lock = threading.Lock()
+
+#Contents of the api key file, read once and reused
+@lru_cache(maxsize=None)
+def load_keys(path=KEYS_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+def get_key(name, path=KEYS_PATH):
+    return load_keys(path).get(name)
+
+#Keep-alive session for a host such as "www.eventbriteapi.com", created on first use
+def get_session(host):
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=RETRY)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[host] = session
+    return session
+
+#GET url on the pooled session for its host. Returns the requests.Response (callers check status_code);
+#connection failures and timeouts that persist after the retries raise requests.RequestException.
+def get(url, params=None, headers=None, timeout=TIMEOUT):
+    host = requests.utils.urlparse(url).netloc
+    try:
+        return get_session(host).get(url, params=params, headers=headers, timeout=timeout)
+    except requests.RequestException as err:
+        logger.error("::get %s failed: %s", host, err)
+        raise
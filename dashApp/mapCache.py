@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from flask import Response, abort, request
+import threading
+import hashlib
+import logging
+import api
+import metrics
+
+'''
+File: mapCache.py
+Author: SonnyP
+Content-addressed cache of Google static map images. Images are keyed by (location, zoom, size), kept in a
+size-bounded in-memory LRU and served from /maps/<digest>.png with long-lived cache headers, so each user gets
+their own URL and repeated locations never leave the process.
+Classes:
+    MapCache
+Functions:
+    map_digest
+    get_map_url
+    register_routes
+'''
+
+logger = logging.getLogger(__name__)
+
+MAP_ROUTE = "/maps/"
+DEFAULT_IMAGE = "assets/default-image.png"
+
+#Stable digest of the map request (the API key is not part of it)
+def map_digest(location, zoom, size):
+    return hashlib.sha256(f"{location}|{zoom}|{size}".encode("utf-8")).hexdigest()[:32]
+
+#LRU of digest -> png bytes bounded by total bytes. The (location, zoom, size) of each digest is kept
+#separately (it is tiny) so an evicted image can be fetched again when its URL is requested.
+class MapCache:
+    def __init__(self, maxBytes=64 * 2**20, maxParams=100000):
+        self.maxBytes = maxBytes
+        self.maxParams = maxParams
+        self.images = OrderedDict()
+        self.params = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, digest):
+        with self.lock:
+            img = self.images.get(digest)
+            if img is None:
+                self.counts["misses"] += 1
+                return None
+            self.images.move_to_end(digest)
+            self.counts["hits"] += 1
+            return img
+
+    def put(self, digest, img, params):
+        with self.lock:
+            self.params[digest] = params
+            self.params.move_to_end(digest)
+            while len(self.params) > self.maxParams:
+                self.params.popitem(last=False)
+            if len(img) > self.maxBytes:
+                return
+            if digest in self.images:
+                self.bytes -= len(self.images.pop(digest))
+            self.images[digest] = img
+            self.bytes += len(img)
+            while self.bytes > self.maxBytes:
+                self.bytes -= len(self.images.popitem(last=False)[1])
+                self.counts["evictions"] += 1
+
+    def paramsFor(self, digest):
+        with self.lock:
+            return self.params.get(digest)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, size=len(self.images), bytes=self.bytes)
+
+mapCache = MapCache()
+metrics.add_cache("maps", lambda: mapCache.stats())
+
+#Fetch (or reuse) the map for (location, zoom, size). Returns png bytes or None if Google returned an error
+def _load(key, digest, params):
+    img = mapCache.get(digest)
+    if img is None:
+        location, zoom, size = params
+        img, status = api.get_map(key, location, zoom=zoom, size=size)
+        if status != 200 or img is None:
+            return None
+        mapCache.put(digest, img, params)
+    return img
+
+#URL of the static map for a venue dict or free text location, served by the /maps route
+def get_map_url(key, venueData, zoom="10", size="400x400"):
+    location = api.map_location(venueData)
+    digest = map_digest(location, zoom, size)
+    if _load(key, digest, (location, zoom, size)) is None:
+        return DEFAULT_IMAGE
+    return f"{MAP_ROUTE}{digest}.png"
+
+#Add the /maps/<digest>.png route to the Flask server
+def register_routes(server):
+    @server.route(MAP_ROUTE + "<digest>.png")
+    def serve_map(digest):
+        img = mapCache.get(digest)
+        if img is None:
+            params = mapCache.paramsFor(digest)
+            if params is None:
+                abort(404)
+            img = _load(api.authenticate_map(), digest, params)
+            if img is None:
+                abort(404)
+        response = Response(img, mimetype="image/png")
+        #the URL is derived from the content's request parameters, so it never changes
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        #quoted ETag, and a 304 without the body when If-None-Match already has it
+        response.set_etag(digest)
+        return response.make_conditional(request)
@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from functools import wraps
+from flask import Response
+import threading
+import logging
+import time
+
+'''
+File: metrics.py
+Author: SonnyP
+Latency histograms and error counters for the external calls on the dashboard request path (Eventbrite, DynamoDB,
+Google Maps), plus the hit/miss counts of the in-process caches, served in Prometheus text format from /metrics.
+Recording is a bisect and a few additions under a per-call lock, so it is cheap enough to leave on.
+Classes:
+    Histogram
+Functions:
+    observe
+    record_error
+    timed
+    add_cache
+    render
+    register_routes
+'''
+
+logger = logging.getLogger(__name__)
+
+METRICS_ROUTE = "/metrics"
+#Seconds. Upper bounds of the histogram buckets; +Inf is implied
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#Fixed-bucket histogram. counts[i] is the number of observations in (BUCKETS[i-1], BUCKETS[i]]
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    #(cumulative bucket counts, sum, count)
+    def snapshot(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+_histograms = {}
+_errors = {}
+_caches = {}
+_lock = threading.Lock()
+
+def _histogram(call):
+    histogram = _histograms.get(call)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(call, Histogram())
+    return histogram
+
+#Record the latency (seconds) of one call
+def observe(call, seconds):
+    _histogram(call).observe(seconds)
+
+#Count a failed call. kind is the exception class name or e.g. "http_500"
+def record_error(call, kind):
+    with _lock:
+        _errors[(call, kind)] = _errors.get((call, kind), 0) + 1
+
+#Decorator recording the latency of every call to fn, and an error for every exception it raises
+def timed(call):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as err:
+                record_error(call, type(err).__name__)
+                raise
+            finally:
+                observe(call, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+#Export a cache's stats() (hits, misses, ... counters and size/bytes gauges) under name
+def add_cache(name, stats):
+    with _lock:
+        _caches[name] = stats
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+#All metrics in Prometheus text exposition format
+def render():
+    lines = ["# HELP esl_external_call_seconds Latency of external calls made while serving the dashboard",
+             "# TYPE esl_external_call_seconds histogram"]
+    for call, histogram in sorted(_histograms.items()):
+        cumulative, total, count = histogram.snapshot()
+        for bound, n in zip(histogram.buckets + ("+Inf",), cumulative):
+            lines.append(f"esl_external_call_seconds_bucket{_labels(call=call, le=bound)} {n}")
+        lines.append(f"esl_external_call_seconds_sum{_labels(call=call)} {total}")
+        lines.append(f"esl_external_call_seconds_count{_labels(call=call)} {count}")
+
+    lines += ["# HELP esl_external_call_errors_total Failed external calls by error",
+              "# TYPE esl_external_call_errors_total counter"]
+    with _lock:
+        errors = sorted(_errors.items())
+        caches = sorted(_caches.items())
+    for (call, kind), n in errors:
+        lines.append(f"esl_external_call_errors_total{_labels(call=call, error=kind)} {n}")
+
+    counters, entries, sizes = [], [], []
+    for name, stats in caches:
+        try:
+            values = stats()
+        except Exception as err:
+            logger.info(f"::render could not read stats of cache {name}: {err}")
+            continue
+        for key, value in sorted(values.items()):
+            if key == "size":
+                entries.append(f"esl_cache_entries{_labels(cache=name)} {value}")
+            elif key == "bytes":
+                sizes.append(f"esl_cache_bytes{_labels(cache=name)} {value}")
+            else:
+                counters.append(f"esl_cache_events_total{_labels(cache=name, event=key)} {value}")
+    lines += ["# HELP esl_cache_events_total Cache hits, misses, evictions, expirations and invalidations",
+              "# TYPE esl_cache_events_total counter"] + counters
+    lines += ["# HELP esl_cache_entries Entries currently held by each cache",
+              "# TYPE esl_cache_entries gauge"] + entries
+    lines += ["# HELP esl_cache_bytes Bytes held by size-bounded caches",
+              "# TYPE esl_cache_bytes gauge"] + sizes
+    return "\n".join(lines) + "\n"
+
+#Add the /metrics route to the Flask server
+def register_routes(server):
+    @server.route(METRICS_ROUTE)
+    def serve_metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
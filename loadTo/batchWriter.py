@@ -0,0 +1,166 @@
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from decimal import Decimal
+import threading
+import logging
+import random
+import math
+import time
+
+'''
+File: batchWriter.py
+Author: SonnyP
+Capacity-aware DynamoDB writer. BatchWriteItem calls are paced by a token bucket filled at the table's
+write-capacity budget (WCU per second), charged with the ConsumedCapacity DynamoDB reports back.
+UnprocessedItems and throughput errors are retried with jittered exponential backoff.
+Classes:
+    TokenBucket
+    ThrottledWriter
+Functions:
+    tableWriteCapacity
+'''
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 25
+RETRY_CODES = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+
+#Thread-safe token bucket. rate is tokens (WCU) per second, capacity the burst size.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    #Block until amount tokens are available and take them. Requests above capacity wait for a full bucket.
+    def acquire(self, amount):
+        while True:
+            with self.lock:
+                self._refill()
+                need = min(amount, self.capacity)
+                if self.tokens >= need:
+                    self.tokens -= amount
+                    return
+                wait = (need - self.tokens) / self.rate
+            time.sleep(wait)
+
+    #Correct an earlier estimate with the capacity that was actually consumed (may leave the bucket in debt)
+    def adjust(self, amount):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+#Provisioned write capacity of a table, or None for on-demand tables
+def tableWriteCapacity(db_client, tableName):
+    table = db_client.describe_table(TableName=tableName)["Table"]
+    if table.get("BillingModeSummary", {}).get("BillingMode") == "PAY_PER_REQUEST":
+        return None
+    units = table.get("ProvisionedThroughput", {}).get("WriteCapacityUnits", 0)
+    return units or None
+
+#Batch writer that keeps each table at (not over) its write-capacity budget
+class ThrottledWriter:
+    #writeCapacity: WCU per second for every table; None looks up each table's provisioned capacity
+    #buckets: {table: bucket or None} to use instead, e.g. buckets shared with other processes (parallelLoad)
+    def __init__(self, db_client, writeCapacity=None, maxRetries=8, baseDelay=0.05, maxDelay=5.0, buckets=None):
+        self.db_client = db_client
+        self.writeCapacity = writeCapacity
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.serializer = TypeSerializer()
+        self.buckets = dict(buckets or {})
+        self.lock = threading.Lock()
+        self.stats = {"items": 0, "batches": 0, "consumed": 0.0, "retries": 0, "throttled": 0}
+
+    #Token bucket for a table (None when the table is unthrottled)
+    def bucket(self, tableName):
+        with self.lock:
+            if tableName not in self.buckets:
+                capacity = self.writeCapacity
+                if capacity is None:
+                    capacity = tableWriteCapacity(self.db_client, tableName)
+                self.buckets[tableName] = TokenBucket(capacity) if capacity else None
+                logger.info(f"::ThrottledWriter {tableName} write budget: {capacity or 'unlimited'} WCU/s")
+            return self.buckets[tableName]
+
+    def _count(self, **kwargs):
+        with self.lock:
+            for name, value in kwargs.items():
+                self.stats[name] += value
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt)))
+
+    #DynamoDB attribute value map for a row. Floats become Decimal and missing values are dropped.
+    def serialize(self, row):
+        item = {}
+        for key, value in row.items():
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            if isinstance(value, float):
+                value = Decimal(str(value))
+            item[key] = self.serializer.serialize(value)
+        return item
+
+    #Estimated WCU of a put request: 1 per started KB of attribute names and values
+    @staticmethod
+    def estimate(request):
+        size = 0
+        for name, value in request["PutRequest"]["Item"].items():
+            size += len(name) + len(str(next(iter(value.values()))))
+        return max(1, math.ceil(size / 1024))
+
+    #Write one batch (<= 25 put requests), retrying unprocessed items until all are written
+    def writeBatch(self, tableName, requests):
+        bucket = self.bucket(tableName)
+        attempt = 0
+        while requests:
+            estimate = sum(self.estimate(r) for r in requests)
+            if bucket:
+                bucket.acquire(estimate)
+            try:
+                response = self.db_client.batch_write_item(
+                    RequestItems={tableName: requests},
+                    ReturnConsumedCapacity="TOTAL",
+                )
+            except ClientError as err:
+                if err.response["Error"]["Code"] not in RETRY_CODES or attempt >= self.maxRetries:
+                    raise
+                self._count(throttled=1)
+                attempt += 1
+                self._backoff(attempt)
+                continue
+
+            consumed = sum(c.get("CapacityUnits", 0) for c in response.get("ConsumedCapacity", []))
+            if bucket and consumed:
+                bucket.adjust(consumed - estimate)
+            unprocessed = response.get("UnprocessedItems", {}).get(tableName, [])
+            self._count(items=len(requests) - len(unprocessed), batches=1, consumed=consumed)
+
+            requests = unprocessed
+            if requests:
+                if attempt >= self.maxRetries:
+                    raise RuntimeError(f"{len(requests)} items still unprocessed for {tableName} after {attempt} retries")
+                self._count(retries=1)
+                attempt += 1
+                self._backoff(attempt)
+
+    #Put every row of a list of dicts into tableName. Returns the number of items written.
+    def putItems(self, rows, tableName):
+        requests = [{"PutRequest": {"Item": self.serialize(row)}} for row in rows]
+        for i in range(0, len(requests), BATCH_SIZE):
+            self.writeBatch(tableName, requests[i:i + BATCH_SIZE])
+        logger.info(f"::ThrottledWriter {tableName} wrote {len(requests)} items, totals: {self.stats}")
+        return len(requests)
+
+    #Put every row of a dataframe into tableName
+    def putDf(self, df, tableName):
+        return self.putItems(df.to_dict("records"), tableName)
@@ -0,0 +1,46 @@
+import logging
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+'''
+File: compression.py
+Author: SonnyP
+Detection and streaming decompression of gzip and zstd compressed S3 payloads. The decompressed bytes are read
+from the S3 body as the parser asks for them, so the compressed object is never held in memory.
+zstd needs the zstandard package (listed in requirements.txt; imported only if installed).
+Functions:
+    detect
+    openStream
+'''
+
+logger = logging.getLogger(__name__)
+
+#key suffix -> compression, tried in this order after the raw key
+SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+
+#Compression of an S3 object from its Content-Encoding, else from its key suffix. None for uncompressed objects
+def detect(key, contentEncoding=None):
+    for encoding in (contentEncoding or '').lower().split(','):
+        if encoding.strip() in ENCODINGS:
+            return ENCODINGS[encoding.strip()]
+    for suffix, compression in SUFFIXES.items():
+        if key.endswith(suffix):
+            return compression
+    return None
+
+#File-like object reading the decompressed bytes of stream (stream itself when compression is None)
+def openStream(stream, compression):
+    if compression is None:
+        return stream
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd-compressed objects need the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    raise ValueError(f"unsupported compression: {compression}")
@@ -0,0 +1,68 @@
+from decimal import Decimal
+import logging
+import struct
+import os
+
+'''
+File: countySnapshot.py
+Author: SonnyP
+Writes the covid and flu monthly summaries to a compact fixed-width binary file that the dashboard memory-maps
+(dashApp/countySnapshot.py) instead of querying DynamoDB.
+Layout (little endian):
+    header   magic, format version, covid key width, flu key width, covid count, flu count, run id
+    covid    count records of key (state-county, NUL padded), cases-today, deaths-today, monthly-case-rate,
+             monthly-death-rate, sorted by key
+    flu      count records of key (region), today-case-rate, week3-case-rate, sorted by key
+The format must match dashApp/countySnapshot.py.
+Functions:
+    covidRecords
+    fluRecords
+    writeSnapshot
+'''
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = './assets/county_snapshot.bin'
+MAGIC = b'ESLSNAP\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIII36s')
+COVID_VALUES = '<qqdd'
+FLU_VALUES = '<dd'
+
+def _number(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+#Sorted (key bytes, values) for each row of the covidmonthly frame from rateEngine.computeCovidRates
+def covidRecords(ds):
+    cols = ['cases-today', 'deaths-today', 'monthly-case-rate', 'monthly-death-rate']
+    rows = zip(ds['state-county'], *(ds[c] for c in cols))
+    return sorted((key.encode('utf-8'), (int(cases), int(deaths), _number(caseRate), _number(deathRate)))
+                  for key, cases, deaths, caseRate, deathRate in rows)
+
+#Sorted (key bytes, values) for each row of the flumonthly frame from rateEngine.computeFluRates
+def fluRecords(ds):
+    rows = zip(ds['region'], ds['today-case-rate'], ds['week3-case-rate'])
+    return sorted((region.encode('utf-8'), (_number(today), _number(week3))) for region, today, week3 in rows)
+
+def _pack(records, valueFormat):
+    width = max((len(key) for key, _ in records), default=1)
+    record = struct.Struct(f'{valueFormat[0]}{width}s{valueFormat[1:]}')
+    return width, b''.join(record.pack(key, *values) for key, values in records)
+
+#Write both tables to path. The file is written next to path and renamed over it, so a reader sees either the
+#old or the new snapshot, never a partial one.
+def writeSnapshot(covidDs, fluDs, runId, path=SNAPSHOT_PATH):
+    covid = covidRecords(covidDs)
+    flu = fluRecords(fluDs)
+    covidWidth, covidBytes = _pack(covid, COVID_VALUES)
+    fluWidth, fluBytes = _pack(flu, FLU_VALUES)
+    header = HEADER.pack(MAGIC, VERSION, covidWidth, fluWidth, len(covid), len(flu), runId.encode('utf-8'))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(covidBytes)
+        f.write(fluBytes)
+    os.replace(tmp, path)
+    logger.info(f"::writeSnapshot {path} run-id: {runId}, counties: {len(covid)}, regions: {len(flu)}")
+    return len(covid), len(flu)
@@ -0,0 +1,74 @@
+import threading
+import logging
+import json
+import os
+import pandas as pd
+
+'''
+File: deltaStore.py
+Author: SonnyP
+Content fingerprints of the rows written by the previous run, persisted locally, so a load can skip rows that did not change.
+Classes:
+    DeltaStore
+'''
+
+logger = logging.getLogger(__name__)
+
+DELTA_DIR = './loadTo/.delta'
+
+#Fingerprint set for one DynamoDB table, stored as {row key: fingerprint} in <deltaDir>/<tableName>.json
+class DeltaStore:
+    #keyCols identify a row, ignoreCols are left out of the fingerprint (e.g. the load date)
+    def __init__(self, tableName, keyCols, ignoreCols=('date',), deltaDir=DELTA_DIR):
+        self.path = os.path.join(deltaDir, tableName + '.json')
+        self.keyCols = list(keyCols)
+        self.ignoreCols = set(ignoreCols) - set(self.keyCols)
+        self.lock = threading.Lock()
+        self.stats = {'written': 0, 'skipped': 0}
+        self.fingerprints = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.fingerprints = json.load(f)
+        logger.info(f"::DeltaStore {self.path} loaded {len(self.fingerprints)} fingerprints")
+
+    def _keys(self, df):
+        return df[self.keyCols].astype(str).agg('|'.join, axis=1) if len(df) else pd.Series([], dtype=str)
+
+    #Stable 64-bit hash of every non-key, non-ignored column of each row
+    def _fingerprints(self, df):
+        cols = sorted(c for c in df.columns if c not in self.ignoreCols and c not in self.keyCols)
+        return pd.util.hash_pandas_object(df[cols].astype(str), index=False).map('{:016x}'.format)
+
+    #Rows of df that are new or changed since the last recorded write, and the number skipped
+    def filterChanged(self, df):
+        if len(df) == 0:
+            return df, 0
+        keys = self._keys(df)
+        prints = self._fingerprints(df)
+        with self.lock:
+            previous = keys.map(self.fingerprints)
+        changed = (previous != prints).to_numpy()
+        skipped = int(len(df) - changed.sum())
+        with self.lock:
+            self.stats['skipped'] += skipped
+        return df[changed], skipped
+
+    #Record rows as written (call only after the DynamoDB write succeeded)
+    def update(self, df):
+        if len(df) == 0:
+            return
+        keys = self._keys(df)
+        prints = self._fingerprints(df)
+        with self.lock:
+            self.fingerprints.update(zip(keys, prints))
+            self.stats['written'] += len(df)
+
+    #Persist the fingerprints for the next run (written to a temp file and swapped in)
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with self.lock:
+            with open(tmp, 'w') as f:
+                json.dump(self.fingerprints, f)
+            os.replace(tmp, self.path)
+        logger.info(f"::DeltaStore {self.path} saved, written: {self.stats['written']}, skipped: {self.stats['skipped']}")
@@ -0,0 +1,104 @@
+import pyarrow as pa
+import pyarrow.dataset as ds
+import logging
+import time
+import uuid
+import os
+
+'''
+File: historyStore.py
+Author: SonnyP
+Append-only local Parquet history of the daily Covid and Flu rows, written by the ETL alongside DynamoDB and
+partitioned by date and state (region for Flu) in hive layout (<root>/date=<d>/state=<s>/<file>.parquet).
+Reads push the date/state predicates down to partition pruning and only decode the requested columns, so a
+multi-month trend for one county is a local read of a few small files instead of one DynamoDB query per day.
+Classes:
+    HistoryStore
+Functions:
+    covidHistory
+    fluHistory
+'''
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = './loadTo/.history'
+
+COVID_SCHEMA = pa.schema([('date', pa.string()), ('state-county', pa.string()), ('state', pa.string()),
+                          ('county', pa.string()), ('cases', pa.int64()), ('deaths', pa.int64())])
+FLU_SCHEMA = pa.schema([('date', pa.string()), ('region', pa.string()), ('release_date', pa.string()),
+                        ('num_ili', pa.int64()), ('num_patients', pa.int64()), ('ili', pa.string())])
+
+#History of one daily table in <historyDir>/<name>. Every append writes new files named
+#<append time ns>-<uuid>-<i>.parquet, so a re-loaded (date, key) is kept once in reads: the latest write wins.
+class HistoryStore:
+    #schema: columns kept (others are dropped), partitionCols: hive partition columns, keyCols: identify a row per date
+    def __init__(self, name, schema, partitionCols, keyCols, historyDir=HISTORY_DIR):
+        self.root = os.path.join(historyDir, name)
+        self.schema = schema
+        self.partitionCols = list(partitionCols)
+        self.keyCols = list(keyCols)
+        self.partitioning = ds.partitioning(pa.schema([schema.field(col) for col in self.partitionCols]),
+                                            flavor='hive')
+        self.stats = {'appended': 0, 'files': 0}
+
+    #Write the rows of a loaded dataframe (must have every schema column). Returns rows appended
+    def append(self, df):
+        if len(df) == 0:
+            return 0
+        table = pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+        files = []
+        ds.write_dataset(table, self.root, format='parquet', partitioning=self.partitioning,
+                         basename_template=f"{time.time_ns():020d}-{uuid.uuid4().hex}-{{i}}.parquet",
+                         existing_data_behavior='overwrite_or_ignore',
+                         file_visitor=lambda written: files.append(written.path))
+        self.stats['appended'] += len(df)
+        self.stats['files'] += len(files)
+        logger.info(f"::HistoryStore {self.root} appended {len(df)} rows in {len(files)} files")
+        return len(df)
+
+    #Rows between start and end dates (inclusive, '%Y-%m-%d') where each equals column matches its value
+    #(or any value of a list). Only the columns asked for are read (all when None). Returns a dataframe sorted by date
+    def read(self, columns=None, start=None, end=None, **equals):
+        wanted = self.schema.names if columns is None else list(columns)
+        if not os.path.isdir(self.root):
+            return self.schema.empty_table().select(wanted).to_pandas()
+        dataset = ds.dataset(self.root, schema=self.schema, format='parquet', partitioning=self.partitioning)
+        predicate = None
+        conditions = []
+        if start is not None:
+            conditions.append(ds.field('date') >= start)
+        if end is not None:
+            conditions.append(ds.field('date') <= end)
+        for col, value in equals.items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(ds.field(col).isin(list(value)))
+            else:
+                conditions.append(ds.field(col) == value)
+        for condition in conditions:
+            predicate = condition if predicate is None else predicate & condition
+
+        #key columns are needed to drop rows superseded by a later load
+        scanned = list(dict.fromkeys(['date'] + self.keyCols + wanted))
+        fragments = dataset.get_fragments(filter=predicate)
+        #files sorted by name are in append order
+        fragments = sorted(fragments, key=lambda fragment: fragment.path)
+        if not fragments:
+            return self.schema.empty_table().select(wanted).to_pandas()
+        table = ds.FileSystemDataset(fragments, self.schema, ds.ParquetFileFormat(), dataset.filesystem) \
+            .to_table(columns=scanned, filter=predicate)
+        df = table.to_pandas()
+        df = df.drop_duplicates(subset=['date'] + self.keyCols, keep='last')
+        return df.sort_values(['date'] + self.keyCols, kind='stable')[wanted].reset_index(drop=True)
+
+    #Daily rows of one county (key as in the table, e.g. 'new york-albany') between start and end
+    def countyTrend(self, stateCounty, start=None, end=None, columns=('date', 'cases', 'deaths')):
+        state = stateCounty.split('-', 1)[0]
+        return self.read(columns=list(columns), start=start, end=end, state=state, **{'state-county': stateCounty})
+
+#History of covidtable rows, partitioned by date and state
+def covidHistory(historyDir=HISTORY_DIR):
+    return HistoryStore('covid', COVID_SCHEMA, ['date', 'state'], ['state-county'], historyDir)
+
+#History of flutable rows, partitioned by date and region
+def fluHistory(historyDir=HISTORY_DIR):
+    return HistoryStore('flu', FLU_SCHEMA, ['date', 'region'], ['region'], historyDir)
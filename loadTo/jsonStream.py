@@ -0,0 +1,123 @@
+from datetime import datetime
+import codecs
+import json
+import pandas as pd
+
+'''
+File: jsonStream.py
+Author: SonnyP
+Incremental parsing of the disease.sh county array so large S3 bodies (_last30, full history) are never held in memory whole.
+Functions:
+    iterJsonArray
+    iterCovidRows
+    iterFrames
+'''
+
+COVID_COLUMNS = ['date', 'state-county', 'state', 'county', 'cases', 'deaths']
+
+#Yield each element of a top-level JSON array read from a file-like stream (anything with read(n)),
+#holding roughly one element plus one chunk in memory
+def iterJsonArray(stream, chunkSize=1 << 16):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    readSize = chunkSize
+
+    def more():
+        nonlocal buf, pos, eof
+        data = stream.read(readSize)
+        if not data:
+            eof = True
+            buf = buf[pos:] + utf8.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(data)
+        pos = 0
+
+    while True:
+        #skip whitespace (and separators once inside the array)
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            more()
+
+        if not started:
+            if pos >= len(buf) or buf[pos] != '[':
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if pos >= len(buf):
+            raise ValueError("Unterminated JSON array")
+        if buf[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            #element spans the chunk boundary; read more (growing reads so huge elements stay linear)
+            more()
+            readSize = min(readSize * 2, 1 << 24)
+            continue
+        if end == len(buf) and not eof:
+            #a bare number at the end of the buffer may be truncated
+            more()
+            continue
+        readSize = chunkSize
+        pos = end
+        yield value
+
+#Turn disease.sh county objects into covidtable rows, one per county per timeline day.
+#The newest timeline day is stored under today (the load date, as the daily _last1 load does) and older days
+#under the matching earlier dates.
+def iterCovidRows(counties, today):
+    loadDate = datetime.strptime(today, '%Y-%m-%d')
+    parsed = {}  #every county shares the same timeline days, so parse/format each one once
+    loadDates = {}
+
+    def parse(day):
+        if day not in parsed:
+            parsed[day] = datetime.strptime(day, '%m/%d/%y')
+        return parsed[day]
+
+    def dateFor(newest, day):
+        if (newest, day) not in loadDates:
+            loadDates[(newest, day)] = (loadDate - (parse(newest) - parse(day))).strftime('%Y-%m-%d')
+        return loadDates[(newest, day)]
+
+    for county in counties:
+        name = county.get('county') or ''
+        if 'out of' in name or name == 'unassigned':
+            continue
+        state = county['province']
+        cases = county['timeline']['cases']
+        deaths = county['timeline']['deaths']
+        days = sorted(cases, key=parse)
+        if not days:
+            continue
+        for day in days:
+            yield {
+                'date': dateFor(days[-1], day),
+                'state-county': state + "-" + name,
+                'state': state,
+                'county': name,
+                'cases': cases[day],
+                'deaths': deaths.get(day, 0),
+            }
+
+#Group rows into dataframes of at most chunkRows rows
+def iterFrames(rows, chunkRows=5000, columns=COVID_COLUMNS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunkRows:
+            yield pd.DataFrame(chunk, columns=columns)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=columns)
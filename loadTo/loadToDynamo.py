@@ -1,13 +1,30 @@
 import boto3
-from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
 import json
 from datetime import datetime, timedelta
 import pandas as pd
 import awswrangler as wr
 import logging
 import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from loadTo import rateEngine, partitionReader, pipeline, batchWriter, jsonStream, deltaStore, countySnapshot
+    from loadTo import rollingWindow, historyStore, runManifest, compression
+except ImportError:
+    import rateEngine
+    import partitionReader
+    import pipeline
+    import batchWriter
+    import jsonStream
+    import deltaStore
+    import countySnapshot
+    import rollingWindow
+    import historyStore
+    import runManifest
+    import compression
 
 '''
 File: loadToDynamo.py
@@ -17,10 +34,26 @@ Functions:
     connectAWS
     checkDynamoTable
         checkAllTables
+    checkTableIndexes
+    covidKey
+    getObject
+    fetchCovid
+    transformCovid
+    writeDynamo
     putDynamoCovid
+    streamDynamoCovid
+    pipelineDynamoCovid
+    partitionClient
+    readWeekSnapshots
+    windowSnapshots
     updateDynamoCovidRates
+    fluKey
+    fetchFlu
+    epiweekStart
+    parseFlu
     putDynamoFlu
     updateDynamoFluRates
+    putRunMarker
 '''
 
 logger = logging.getLogger(__name__)
@@ -35,6 +68,13 @@ flubucket = awsNames.get('flubucket')
 flutable = awsNames.get('flutable')
 flumonthly = awsNames.get('flumonthlytable')
 
+#HHS regions loaded by putDynamoFlu and the epidata columns kept for flutable
+FLU_REGIONS = 10
+FLU_COLUMNS = ['release_date', 'region', 'num_ili', 'num_patients', 'ili']
+
+#Key of the run marker item written to the monthly tables at the end of each run (read by dashApp/awsdb.py)
+ETL_RUN_KEY = 'etl-run'
+
 #Creates connection to AWS and creates S3 and DynamoDB resources
 def connectAWS(region):
     
@@ -54,7 +94,8 @@ def connectAWS(region):
     return (s3_client, db_client, db_resource)
 
 #Check if the table name already exists in DynamoDB. If not, create the table.
-def checkDynamoTable(tableName, keySchema, attrDef, db_client, db_resource):
+#indexes: global secondary indexes of the table (created with it, or added to an existing table)
+def checkDynamoTable(tableName, keySchema, attrDef, db_client, db_resource, indexes=None):
     
     logging.info("::checkDynamoTable - Checking/Creating DynamoDB table {}".format(tableName))
 
@@ -67,17 +108,21 @@ def checkDynamoTable(tableName, keySchema, attrDef, db_client, db_resource):
             #if found, return True
             tableFound = True
             logging.info("::Table {} Exists".format(tableName))
+            if indexes:
+                checkTableIndexes(tableName, attrDef, indexes, db_client)
         else:
             tableFound = False
             #else create table with input schema
+            throughput = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            extra = {}
+            if indexes:
+                extra['GlobalSecondaryIndexes'] = [dict(index, ProvisionedThroughput=throughput) for index in indexes]
             table = db_resource.create_table(
                 TableName = tableName,
                 KeySchema = keySchema,
                 AttributeDefinitions = attrDef,
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': 5,
-                    'WriteCapacityUnits': 5
-                    }
+                ProvisionedThroughput=throughput,
+                **extra
             )
 
             # Wait until the table exists.
@@ -100,139 +145,296 @@ def checkAllTables(db_client, db_resource):
     checkDynamoTable("testtable", data['fluKey'], data['fluAttr'], db_client, db_resource)
     checkDynamoTable("flumonthly", data['fluMonthKey'], data['fluMonthAttr'], db_client, db_resource)
     checkDynamoTable("covidtable", data['covidKey'], data['covidAttr'], db_client, db_resource)
-    checkDynamoTable("covidmonthly", data['covidMonthKey'], data['covidMonthAttr'], db_client, db_resource)
+    checkDynamoTable("covidmonthly", data['covidMonthKey'], data['covidMonthAttr'], db_client, db_resource,
+                     indexes=data['covidMonthIndexes'])
 
-# Reads from S3 bucket (from today) and transforms/puts data into DynamoDB Covid table
-def putDynamoCovid(state, s3_client, tableName, bucketName):
-    logger.info("::putDynamoCovid for {}".format(state))
+#Add the global secondary indexes an existing table is missing (DynamoDB backfills them in the background)
+def checkTableIndexes(tableName, attrDef, indexes, db_client):
+    try:
+        table = db_client.describe_table(TableName=tableName)["Table"]
+        existing = {index["IndexName"] for index in table.get("GlobalSecondaryIndexes", [])}
+        provisioned = table.get("BillingModeSummary", {}).get("BillingMode") != "PAY_PER_REQUEST"
+        for index in indexes:
+            if index["IndexName"] in existing:
+                continue
+            create = dict(index)
+            if provisioned:
+                create["ProvisionedThroughput"] = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            db_client.update_table(TableName=tableName, AttributeDefinitions=attrDef,
+                                   GlobalSecondaryIndexUpdates=[{"Create": create}])
+            logger.info(f"::checkTableIndexes {tableName} creating index {index['IndexName']}")
+    except ClientError as err:
+        logger.error("::checkTableIndexes Error occured with Boto3 or DynamoDB... %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"]
+                    )
+        raise
 
-    # read S3 objects put today
-    today = datetime.today().strftime('%Y-%m-%d')
-    lastDays = "1"
+#S3 object key of a state's Covid payload for a day
+def covidKey(state, today, lastDays="1"):
     state = state.replace("_", "%20")
     covidPrefix = 'covid/' + state + '/'
-    key = covidPrefix + today + "_last" + lastDays
-    logger.info("::putDynamoCovid object key {key}")
+    return covidPrefix + today + "_last" + lastDays
+
+#get_object of an S3 key. When key does not exist, its compressed copies (key.gz, key.zst) are tried.
+#The response's Body is replaced by a stream of the decompressed bytes (format from Content-Encoding or the key
+#suffix) and its Key set to the key read. etag is the ETag of the copy already loaded: S3 then only sends the
+#object if it changed, and None is returned when it did not. ClientErrors are raised to the caller
+def getObject(s3_client, bucketName, key, etag=None):
+    candidates = [key] + [key + suffix for suffix in compression.SUFFIXES]
+    for i, candidate in enumerate(candidates):
+        try:
+            if etag is None:
+                response = s3_client.get_object(Bucket=bucketName, Key=candidate)
+            else:
+                response = s3_client.get_object(Bucket=bucketName, Key=candidate, IfNoneMatch=etag)
+        except ClientError as err:
+            code = err.response["Error"]["Code"]
+            if etag is not None and code in ("304", "NotModified"):
+                return None
+            if code == "NoSuchKey" and i < len(candidates) - 1:
+                continue
+            raise
+        break
+    encoding = compression.detect(candidate, response.get('ContentEncoding'))
+    if encoding is not None:
+        logger.info(f"::getObject {candidate} is {encoding} compressed")
+    response['Body'] = compression.openStream(response['Body'], encoding)
+    response['Key'] = candidate
+    return response
+
+#Download a state's Covid payload put in S3 today. Returns the raw bytes and HTTP status
+#With a runManifest.RunManifest an object already loaded and unchanged is not downloaded: (None, 304) is returned
+def fetchCovid(state, s3_client, bucketName, manifest=None):
+    today = datetime.today().strftime('%Y-%m-%d')
+    key = covidKey(state, today)
+    logger.info(f"::fetchCovid object key {key}")
 
     try:
-        response = s3_client.get_object(Bucket=bucketName, Key=key)
+        response = getObject(s3_client, bucketName, key, manifest.loadedEtag(key) if manifest else None)
+        if response is None:
+            manifest.skipped(key)
+            return None, 304
         bytes = response['Body'].read()
         status = response["ResponseMetadata"]["HTTPStatusCode"]
-        logging.info(f"::DynamoDB get_object status: {status}")
-
-        # convert to dataframe, format, re-index, and clean
-        data = json.loads(bytes)
-        df = pd.json_normalize(data)
-        df = df.drop(df[df['county'].str.contains('out of')].index)
-        df = df.drop(df[df['county'] == 'unassigned'].index)
-        df['state-county'] = df['province'] + "-" + df['county']
-        df['date'] = today
-        # df.set_index('date', inplace=True)
-        datedrop = df.columns[2].split('timeline.cases.', 1)[1]
-        df.rename(columns={'province': 'state', 'timeline.cases.'+datedrop : 'cases', 'timeline.deaths.'+datedrop : 'deaths'}, inplace=True)
-        col = df.pop('date')
-        df.insert(0, col.name, col)
-        col = df.pop('state-county')
-        df.insert(1, col.name, col)
-
-        # put dataframe to DynamoDB using awswrangler
-        wr.dynamodb.put_df(df=df, table_name=tableName)
+        logging.info(f"::S3 get_object status: {status}")
     except ClientError as err:
-        logger.error("::Error occured with Boto3 or S3...\n",
-                    err.response["Error"]["Code"], \
+        logger.error("::Error occured with Boto3 or S3... %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"]
+                    )
+        if manifest is not None:
+            manifest.failed(key, err.response["Error"]["Code"])
+        raise
+
+    if manifest is not None:
+        manifest.fetched(key, response.get('ETag'))
+    return bytes, status
+
+#Convert a disease.sh county payload into the covidtable dataframe (date, state-county, state, county, cases, deaths)
+def transformCovid(payload, today):
+    # convert to dataframe, format, re-index, and clean
+    data = json.loads(payload)
+    df = pd.json_normalize(data)
+    df = df.drop(df[df['county'].str.contains('out of')].index)
+    df = df.drop(df[df['county'] == 'unassigned'].index)
+    df['state-county'] = df['province'] + "-" + df['county']
+    df['date'] = today
+    # df.set_index('date', inplace=True)
+    datedrop = df.columns[2].split('timeline.cases.', 1)[1]
+    df.rename(columns={'province': 'state', 'timeline.cases.'+datedrop : 'cases', 'timeline.deaths.'+datedrop : 'deaths'}, inplace=True)
+    col = df.pop('date')
+    df.insert(0, col.name, col)
+    col = df.pop('state-county')
+    df.insert(1, col.name, col)
+
+    return df
+
+#Put a dataframe into a DynamoDB table. With a batchWriter.ThrottledWriter writes are paced to the table's
+#write-capacity budget, otherwise the dataframe is put as fast as awswrangler can.
+#With a deltaStore.DeltaStore only rows that changed since the previous run are written. With a
+#rollingWindow.RollingWindow every loaded row (written or skipped) is recorded in it, and with a
+#historyStore.HistoryStore appended to the local Parquet history. Returns rows written
+def writeDynamo(df, tableName, writer=None, delta=None, window=None, history=None):
+    loaded = df
+    if delta is not None:
+        df, skipped = delta.filterChanged(df)
+        logger.info(f"::writeDynamo {tableName} delta skipped {skipped} unchanged rows, writing {len(df)}")
+        if len(df) == 0:
+            if window is not None:
+                window.update(loaded)
+            if history is not None:
+                history.append(loaded)
+            return 0
+    try:
+        if writer is not None:
+            writer.putDf(df, tableName)
+        else:
+            # put dataframe to DynamoDB using awswrangler
+            wr.dynamodb.put_df(df=df, table_name=tableName)
+    except ClientError as err:
+        logger.error("::Error occured with Boto3 or DynamoDB... %s: %s",
+                    err.response["Error"]["Code"],
                     err.response["Error"]["Message"]
                     )
+        raise
+
+    if delta is not None:
+        delta.update(df)
+    if window is not None:
+        window.update(loaded)
+    if history is not None:
+        history.append(loaded)
+    return len(df)
 
+# Reads from S3 bucket (from today) and transforms/puts data into DynamoDB Covid table
+def putDynamoCovid(state, s3_client, tableName, bucketName, writer=None, delta=None, window=None, history=None,
+                   manifest=None):
+    logger.info("::putDynamoCovid for {}".format(state))
+
+    # read S3 objects put today
+    today = datetime.today().strftime('%Y-%m-%d')
+    bytes, status = fetchCovid(state, s3_client, bucketName, manifest)
+    if bytes is None:
+        return status
+    try:
+        df = transformCovid(bytes, today)
+        writeDynamo(df, tableName, writer, delta, window, history)
+    except Exception as err:
+        if manifest is not None:
+            manifest.failed(covidKey(state, today), f"{type(err).__name__}: {err}")
         raise
+    if manifest is not None:
+        manifest.loaded(covidKey(state, today), len(df))
     
     return status
 
+#Stream a state's Covid payload from S3 and write it in chunks of chunkRows rows (one row per county per day),
+#so memory stays bounded for _last30 and full-history objects. Returns the HTTP status and rows written
+def streamDynamoCovid(state, s3_client, tableName, bucketName, lastDays="30", chunkRows=5000, writer=None, delta=None,
+                      window=None, history=None, manifest=None):
+    logger.info(f"::streamDynamoCovid for {state}, last {lastDays} days")
+    today = datetime.today().strftime('%Y-%m-%d')
+    key = covidKey(state, today, lastDays)
+
+    try:
+        response = getObject(s3_client, bucketName, key, manifest.loadedEtag(key) if manifest else None)
+        if response is None:
+            manifest.skipped(key)
+            return 304, 0
+        status = response["ResponseMetadata"]["HTTPStatusCode"]
+        logging.info(f"::S3 get_object status: {status}")
+        if manifest is not None:
+            manifest.fetched(key, response.get('ETag'))
+
+        rows = 0
+        loaded = 0
+        counties = jsonStream.iterJsonArray(response['Body'])
+        for df in jsonStream.iterFrames(jsonStream.iterCovidRows(counties, today), chunkRows=chunkRows):
+            rows += writeDynamo(df, tableName, writer, delta, window, history)
+            loaded += len(df)
+    except ClientError as err:
+        logger.error("::Error occured with Boto3 or S3... %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"]
+                    )
+        if manifest is not None:
+            manifest.failed(key, err.response["Error"]["Code"])
+        raise
+    if manifest is not None:
+        manifest.loaded(key, loaded)
+    logger.info(f"::streamDynamoCovid {key} rows written: {rows}")
+
+    return status, rows
+
+#Load every state's Covid payload with S3 download, transform and DynamoDB write running as overlapping stages
+#Each stage has its own number of worker threads; queueSize bounds how many states wait between stages
+def pipelineDynamoCovid(states, s3_client, tableName, bucketName,
+                        fetchWorkers=2, transformWorkers=1, writeWorkers=1, queueSize=2, writer=None, delta=None,
+                        window=None, history=None, manifest=None):
+    logger.info(f"::pipelineDynamoCovid for {len(states)} states, workers fetch/transform/write: "
+                f"{fetchWorkers}/{transformWorkers}/{writeWorkers}")
+    today = datetime.today().strftime('%Y-%m-%d')
+
+    #objects skipped by the manifest pass through the later stages as None
+    def write(state, df):
+        if df is None:
+            return 0
+        rows = writeDynamo(df, tableName, writer, delta, window, history)
+        if manifest is not None:
+            manifest.loaded(covidKey(state, today), len(df))
+        return rows
+
+    stages = [
+        ("fetch", lambda state: (state, fetchCovid(state, s3_client, bucketName, manifest)[0]), fetchWorkers),
+        ("transform", lambda fetched: (fetched[0], None if fetched[1] is None else transformCovid(fetched[1], today)),
+         transformWorkers),
+        ("write", lambda transformed: write(*transformed), writeWorkers),
+    ]
+    #returns state -> rows written
+    return pipeline.runPipeline(states, stages, queueSize=queueSize)
+
+#Low level DynamoDB client with the region, endpoint and botocore config of db_resource. Not
+#db_resource.meta.client, so items come back as raw typed strings, not Decimals
+def partitionClient(db_resource):
+    meta = db_resource.meta.client.meta
+    return boto3.client('dynamodb', region_name=meta.region_name, endpoint_url=meta.endpoint_url, config=meta.config)
+
+#Read today, 1-week ago, 2-week ago and 3-week ago (weeks points in all) date partitions concurrently (all pages)
+#db_client: low level client reading the partitions (partitionClient(db_resource) when None)
+#Returns a dict of week name -> columnar snapshot for rateEngine
+def readWeekSnapshots(db_resource, tableName, keyCols, numCols, maxWorkers=4, weeks=4, db_client=None):
+    pastWeeks = [(datetime.today() - timedelta(days = 7 * t)).strftime('%Y-%m-%d') for t in range(weeks)]
+    if db_client is None:
+        db_client = partitionClient(db_resource)
+    partitions = partitionReader.readPartitions(db_client, tableName, pastWeeks,
+                                                keyCols, numCols, maxWorkers=maxWorkers)
+
+    names = rateEngine.weekNames(weeks)
+    snapshots = {}
+    for t in range(weeks):
+        columns = partitions[pastWeeks[t]]
+        #For testing purposes, if there is no data for iterated date, use today's instead
+        if len(columns[keyCols[0]]) == 0:
+            columns = partitions[pastWeeks[0]]
+        logging.info(f"::readWeekSnapshots {tableName} past week: {pastWeeks[t]}, items: {len(columns[keyCols[0]])}")
+        snapshots[names[t]] = columns
+
+    return snapshots
+
+#Week snapshots from a rollingWindow.RollingWindow already fed with today's load. A window without history
+#(first incremental run) is seeded once from the date partitions.
+def windowSnapshots(window, db_resource, tableName, keyCols, numCols, db_client=None):
+    today = datetime.today()
+    if not window.seeded:
+        window.seed(readWeekSnapshots(db_resource, tableName, keyCols, numCols, weeks=window.weeks,
+                                      db_client=db_client), today)
+    return window.snapshots(today)
+
 #Read DynamoDB for today, 1-week ago, 2-week ago, 3-week ago
-#Update covidmonthly table for each county with covid rate data
-def updateDynamoCovidRates(db_resource, tableName, tableNameMonthly):
+#Update covidmonthly table for each county with covid rate data. Returns the rates dataframe
+#With a rolling window the weeks come from it instead of DynamoDB; with a delta only changed rates are written
+#db_client: low level client the partitions are read with (see readWeekSnapshots)
+def updateDynamoCovidRates(db_resource, tableName, tableNameMonthly, writer=None, window=None, delta=None, weeks=4,
+                           db_client=None):
     logger.info(f"::updateDynamoCovidRates Table1:{tableName}, Table2:{tableNameMonthly}")
+    keyCols = ['state-county', 'state']
+    numCols = ['cases', 'deaths']
 
     try:
-        table = db_resource.Table(tableName)
-
-        cols = ['state-county', 'state', 'cases-today', 'deaths-today',
-                'cases-week1', 'deaths-week1',
-                'cases-week2', 'deaths-week2',
-                'cases-week3', 'deaths-week3']
-
-        today = datetime.today().strftime('%Y-%m-%d')
-        week1 = (datetime.today() - timedelta(days = 7)).strftime('%Y-%m-%d')
-        week2 = (datetime.today() - timedelta(days = 14)).strftime('%Y-%m-%d')
-        week3 = (datetime.today() - timedelta(days = 21)).strftime('%Y-%m-%d')
-        pastWeeks = [today, week1, week2, week3]
-
-        data = []
-        dataList0 = []
-        dataList1 = []
-        dataList2 = []
-        dataList3 = []
-        for t in range(4):
-            #Query tables with each date key. Includes all states/countries
-            response = table.query(
-                TableName=tableName,
-                KeyConditionExpression=Key('date').eq(pastWeeks[t])
-            )
-            #For testing purposes, if there is no data for iterated date, use today's instead
-            if response['Count'] == 0:
-                response = table.query(
-                TableName=tableName,
-                KeyConditionExpression=Key('date').eq(today)
-            )
-            status = response["ResponseMetadata"]["HTTPStatusCode"]
-            logging.info(f"::DynamoDB updateDynamoCovidDates past week: {pastWeeks[t]}, status: {status}")
-
-            #append to new array to be converted to dataframe then added to DB table
-            for ln in response['Items']:
-                if t == 0:
-                    dataTemp = [
-                        {cols[0]: ln['state-county'],
-                        cols[1]: ln['state'], 
-                        cols[2]: ln['cases'], 
-                        cols[3]: ln['deaths']
-                        }]
-                    dataList0.append(dataTemp)
-
-                else:
-                    dataTemp = [ 
-                        {cols[2+2*t]: ln['cases'], 
-                        cols[3+2*t]: ln['deaths']}
-                        ]
-                    if t == 1:
-                        dataList1.append(dataTemp)
-                    elif t == 2:
-                        dataList2.append(dataTemp)
-                    elif t == 3:
-                        dataList3.append(dataTemp)
-    
-        for i in range(len(dataList0)):
-            dataTemp = dataList0[i][0]
-            dicts = [dataList1, dataList2, dataList3]
-            for d in dicts:
-                # print(d)
-                for dd in d[i]:
-                    # print(dd)
-                    dataTemp.update(dd)
-            data.append(dataTemp)
-
-        ds = pd.DataFrame(data, columns=cols)
-        ds['monthly-case-rate'] = 0
-        ds['monthly-death-rate'] = 0
-
-        # perform calculations to create case/death rates for each country
-        for index, row in ds.iterrows():
-            if row['cases-week3'] != 0:
-                ds.at[index, 'monthly-case-rate'] = round((row['cases-today'] - row['cases-week3']) / row['cases-week3'], 2) * 100
-            if row['deaths-week3'] != 0:
-                ds.at[index, 'monthly-death-rate'] = round((row['deaths-today'] - row['deaths-week3']) / row['deaths-week3'], 2) * 100
-        
+        if window is None:
+            #Query today's and past weeks' partitions at the same time. Includes all states/countries
+            snapshots = readWeekSnapshots(db_resource, tableName, keyCols, numCols, weeks=weeks, db_client=db_client)
+        else:
+            weeks = window.weeks
+            snapshots = windowSnapshots(window, db_resource, tableName, keyCols, numCols, db_client)
+
+        # join weeks on state-county and compute case/death rates for each county in one pass
+        ds = rateEngine.computeCovidRates(snapshots, rateEngine.weekNames(weeks))
+        ds = rateEngine.toDecimalColumns(ds, ['monthly-case-rate', 'monthly-death-rate'])
+
         #Put data into Monthly Covid Rate table
-        ds.to_csv("test_write_size.csv")
-        wr.dynamodb.put_df(df=ds, table_name=tableNameMonthly)
+        writeDynamo(ds, tableNameMonthly, writer, delta)
 
     except ClientError as err:
         logger.error("::Error occured with Boto3 or DynamoDB...\n",
@@ -241,138 +443,120 @@ def updateDynamoCovidRates(db_resource, tableName, tableNameMonthly):
                     )
         raise
     
-    return
+    return ds
+
+#S3 object key of an HHS region's flu payload for a day
+def fluKey(region, today):
+    return "flu/hhs" + str(region) + "/" + today
+
+#Download one HHS region's flu payload put in S3 today. Returns the raw bytes and HTTP status
+#With a manifest an object already loaded and unchanged is not downloaded: (None, 304) is returned
+def fetchFlu(region, s3_client, bucketName, today, manifest=None):
+    logger.info("::fetchFlu for Region{}".format(region))
+    key = fluKey(region, today)
+    try:
+        fluResponse = getObject(s3_client, bucketName, key, manifest.loadedEtag(key) if manifest else None)
+        if fluResponse is None:
+            manifest.skipped(key)
+            return None, 304
+        fluBytes = fluResponse['Body'].read()
+        status = fluResponse["ResponseMetadata"]["HTTPStatusCode"]
+    except ClientError as err:
+        logger.error("::fetchFlu Error occured with Boto3 or S3 for Region%s... %s: %s", region,
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"]
+                    )
+        if manifest is not None:
+            manifest.failed(key, err.response["Error"]["Code"])
+        raise
+    if manifest is not None:
+        manifest.fetched(key, fluResponse.get('ETag'))
+    return fluBytes, status
+
+#Sunday starting an MMWR epiweek (YYYYWW): week 1 is the first Sunday-Saturday week with four days in the year
+def epiweekStart(epiweek):
+    year, week = divmod(int(epiweek), 100)
+    jan4 = datetime(year, 1, 4)
+    return jan4 - timedelta(days=(jan4.weekday() + 1) % 7) + timedelta(weeks=week - 1)
+
+#Append a region's epidata rows to the column buffers (lists keyed by FLU_COLUMNS + 'date'). Rows are dated like
+#the covid history: newest (the region's newest epiweek) is today, as the current payload always was, and every
+#other epiweek is dated back from today by its distance to newest, so a payload skipping a week stays aligned.
+def parseFlu(rows, columns, today, newest):
+    for row in rows:
+        for col in FLU_COLUMNS:
+            columns[col].append(row[col])
+        week = row.get('epiweek', newest)
+        date = today if week is None else today - (epiweekStart(newest) - epiweekStart(week))
+        columns['date'].append(date.strftime('%Y-%m-%d'))
+    return len(rows)
 
 #Read S3 objects for each US region and put into DynamoDB Table
-#Regions are listed as hhs1 through hhs10
-def putDynamoFlu(s3_client, fromBucket, toTable):
+#Regions are listed as hhs1 through hhs10. All regions are downloaded at the same time (maxWorkers)
+#and their rows collected into column lists, so the dataframe is built once
+def putDynamoFlu(s3_client, fromBucket, toTable, writer=None, delta=None, maxWorkers=10, window=None, history=None,
+                 manifest=None):
     logger.info(f"::putDynamoFlu from S3 bucket: {fromBucket} to AWS table: {toTable}")
 
     # read S3 objects put today
-    today = datetime.today().strftime('%Y-%m-%d')
-    schema = {'release_date': 'object', 'region': 'object', 'num_ili': 'int64', 'num_patients': 'int64', 'ili': 'object'}
-    dfAllRegion = pd.DataFrame(columns=schema.keys()).astype(schema)
-
-    for i in range(1, 11):
-        logger.info("::putDynamoFlu for Region{}".format(i))
-        try:    
-            logger.info("::putDynamoFlu for Region{}".format(i))
-            key = "flu/hhs" + str(i) + "/" + today
-            fluResponse = s3_client.get_object(Bucket=fromBucket, Key=key)
-            fluBytes = fluResponse['Body'].read()
-            status = fluResponse["ResponseMetadata"]["HTTPStatusCode"]
-            
-            # convert to dataframe, format, re-index
-            data = json.loads(fluBytes)
-            df = pd.json_normalize(data['epidata'])
-            df['ili'] = df['ili'].round(2).astype(str)
-            colsKeep = ['release_date', 'region', 'num_ili', 'num_patients', 'ili']
-            for col in df:
-                if col not in colsKeep:
-                    df.pop(col)
-            dfAllRegion = dfAllRegion._append(df)
-            dfAllRegion['date'] = today
-        except ClientError as err:
-            logger.error("::Error occured with Boto3, S3, or DynamoDB...\n",
-                        err.response["Error"]["Code"], \
-                        err.response["Error"]["Message"]
-                        )
-            raise
-
-    # put dataframe to DynamoDB using awswrangler
-    wr.dynamodb.put_df(df=dfAllRegion, table_name=toTable)
+    today = datetime.today()
+    todayKey = today.strftime('%Y-%m-%d')
+    regions = range(1, FLU_REGIONS + 1)
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        responses = list(executor.map(lambda i: fetchFlu(i, s3_client, fromBucket, todayKey, manifest), regions))
+
+    # parse every region into column buffers, then build the dataframe once
+    columns = {col: [] for col in FLU_COLUMNS + ['date']}
+    epidata = {}
+    for region, (fluBytes, status) in zip(regions, responses):
+        if fluBytes is not None:
+            epidata[fluKey(region, todayKey)] = json.loads(fluBytes)['epidata']
+    newest = {key: max((row['epiweek'] for row in rows if 'epiweek' in row), default=None)
+              for key, rows in epidata.items()}
+    #a region whose release lags the others is still dated today, so its monthly rates are updated
+    latest = max((week for week in newest.values() if week is not None), default=None)
+    for key, week in newest.items():
+        if week is not None and week < latest:
+            logger.info(f"::putDynamoFlu {key} newest epiweek {week} lags {latest}, loaded as today")
+    parsed = {key: parseFlu(rows, columns, today, newest[key]) for key, rows in epidata.items()}
+    if not parsed:
+        logger.info(f"::putDynamoFlu every region already loaded and unchanged")
+        return status
+    schema = {'release_date': 'object', 'region': 'object', 'num_ili': 'int64', 'num_patients': 'int64'}
+    dfAllRegion = pd.DataFrame(columns).astype(schema)
+    dfAllRegion['ili'] = np.round(np.asarray(columns['ili'], dtype=np.float64), 2).astype(str)
+    logger.info(f"::putDynamoFlu parsed {len(dfAllRegion)} rows from {FLU_REGIONS} regions")
+
+    # put dataframe to DynamoDB
+    writeDynamo(dfAllRegion, toTable, writer, delta, window, history)
+    if manifest is not None:
+        for key, rows in parsed.items():
+            manifest.loaded(key, rows)
 
     return status
 
 #Read DynamoDB for today, 1-week ago, 2-week ago, 3-week ago
-#Update covidmonthly table for each county
-def updateDynamoFluRates(db_resource, tableName, tableNameMonthly):
-    
-    table = db_resource.Table(tableName)
-
-    cols = ['region',
-            'today-num_ili',
-            'today-num_patients',
-            'week1-num_ili',
-            'week1-num_patients',
-            'week2-num_ili',
-            'week2-num_patients',
-            'week3-num_ili',
-            'week3-num_patients',
-            ]
-
-    today = datetime.today().strftime('%Y-%m-%d')
-    week1 = (datetime.today() - timedelta(days = 7)).strftime('%Y-%m-%d')
-    week2 = (datetime.today() - timedelta(days = 14)).strftime('%Y-%m-%d')
-    week3 = (datetime.today() - timedelta(days = 21)).strftime('%Y-%m-%d')
-    pastWeeks = [today, week1, week2, week3]
-
-    data = []
-    dataList0 = []
-    dataList1 = []
-    dataList2 = []
-    dataList3 = []
+#Update flumonthly table for each region. Returns the rates dataframe
+#window, delta, weeks and db_client as for updateDynamoCovidRates
+def updateDynamoFluRates(db_resource, tableName, tableNameMonthly, writer=None, window=None, delta=None, weeks=4,
+                         db_client=None):
+    keyCols = ['region']
+    numCols = ['num_ili', 'num_patients']
 
     try:
-        for t in range(4):
-            #Query tables with each date key. Includes all states/countries
-            response = table.query(
-                TableName=tableName,
-                KeyConditionExpression=Key('date').eq(pastWeeks[t])
-            )
-            #For testing purposes, if there is no data for iterated date, use today's instead
-            if response['Count'] == 0:
-                    response = table.query(
-                    TableName=tableName,
-                    KeyConditionExpression=Key('date').eq(today)
-                )
-            status = response["ResponseMetadata"]["HTTPStatusCode"]
-            logging.info(f"::DynamoDB updateDynamoCovidDates past week: {pastWeeks[t]}, status: {status}")
-
-            #append to new array to be converted to dataframe then added to DB table
-            for ln in response['Items']:
-                if t == 0:
-                    dataTemp = [
-                        {cols[0]: ln['region'],
-                        cols[1]: ln['num_ili'], 
-                        cols[2]: ln['num_patients']
-                        }]
-                    dataList0.append(dataTemp)
-
-                else:
-                    dataTemp = [ 
-                        {cols[2+(2*t-1)]: ln['num_ili'], 
-                        cols[3+(2*t-1)]: ln['num_patients']}
-                        ]
-                    if t == 1:
-                        dataList1.append(dataTemp)
-                    elif t == 2:
-                        dataList2.append(dataTemp)
-                    elif t == 3:
-                        dataList3.append(dataTemp)
-    
-        for i in range(len(dataList0)):
-            dataTemp = dataList0[i][0]
-            dicts = [dataList1, dataList2, dataList3]
-            for d in dicts:
-                for dd in d[i]:
-                    # print(dd)
-                    dataTemp.update(dd)
-            data.append(dataTemp)
-
-        ds = pd.DataFrame(data, columns=cols)
-        ds['today-case-rate'] = 0
-        ds['week3-case-rate'] = 0
-
-        # perform calculations to determine case rates
-        for index, row in ds.iterrows():
-            if row['week3-case-rate'] != 0:
-                ds.at[index, 'week3-case-rate'] = row['week3-num_ili'] / row['week3-num_patients']
-            if row['today-case-rate'] != 0:
-                ds.at[index, 'today-case-rate'] = row['today-num_ili'] / row['today-num_patients']
+        if window is None:
+            #Query today's and past weeks' partitions at the same time. Includes all regions
+            snapshots = readWeekSnapshots(db_resource, tableName, keyCols, numCols, weeks=weeks, db_client=db_client)
+        else:
+            weeks = window.weeks
+            snapshots = windowSnapshots(window, db_resource, tableName, keyCols, numCols, db_client)
+
+        # join weeks on region and compute case rates in one pass
+        ds = rateEngine.computeFluRates(snapshots, rateEngine.weekNames(weeks))
+        ds = rateEngine.toDecimalColumns(ds, ['today-case-rate', 'week3-case-rate'])
         
         # put new dataframe into flu rate DB table
-        wr.dynamodb.put_df(df=ds, table_name=tableNameMonthly)
+        writeDynamo(ds, tableNameMonthly, writer, delta)
 
     except ClientError as err:
         logger.error("::Error occured with Boto3 or DynamoDB...\n",
@@ -381,25 +565,179 @@ def updateDynamoFluRates(db_resource, tableName, tableNameMonthly):
                     )
         raise
 
-    return
+    return ds
 
 
-def main():
+#Write the run marker item to a monthly table so dashboard caches know the data changed
+#key: the table's key attributes set to ETL_RUN_KEY
+def putRunMarker(db_resource, tableName, key, runId):
+    try:
+        item = dict(key)
+        item['run-id'] = runId
+        db_resource.Table(tableName).put_item(Item=item)
+    except ClientError as err:
+        logger.error("::putRunMarker Error occured with Boto3 or DynamoDB... %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"]
+                    )
+        raise
+    logger.info(f"::putRunMarker {tableName} run-id: {runId}")
+
+#writeCapacity: WCU/s budget for every table, None to use each table's provisioned write capacity
+#stream: parse each state's _last<lastDays> object incrementally instead of loading it whole
+#useDelta: only write rows whose content changed since the previous run (fingerprints kept in loadTo/.delta).
+#Needs incremental: unchanged rows are not written to today's date partitions, so the rates must come from the window
+#snapshotPath: also write the monthly rates to a county snapshot file for the dashboard (None to skip)
+#reload: load every object again instead of skipping those the run manifest (loadTo/.manifest) has as loaded
+def main(usePipeline=False, fetchWorkers=2, transformWorkers=1, writeWorkers=1, queueSize=2, writeCapacity=None,
+         stream=False, lastDays="30", chunkRows=5000, useDelta=False, snapshotPath=None, incremental=False,
+         windowWeeks=4, keepHistory=False, processes=1, statesFile="./assets/statesPartial.csv", deadline=None,
+         reload=False):
+    if useDelta and not incremental:
+        raise ValueError("useDelta needs incremental: rates read from the date partitions would miss unchanged rows")
     # connect S3 and dynamoDB, check dynamoDB table exists or create
     s3_client, db_client, db_resource = connectAWS(region="us-east-2")
     # checkAllTables(db_client, db_resource)
 
-    csv = pd.read_csv("./assets/statesPartial.csv") #only a few states are used for demonstration. Full list would cost too much.
+    #with a process pool, every process writes against the same per-table budget held by a manager process
+    manager = buckets = None
+    if processes > 1:
+        try:
+            from loadTo import parallelLoad
+        except ImportError:
+            import parallelLoad
+        manager = parallelLoad.BudgetManager()
+        manager.start()
+        buckets = parallelLoad.sharedBuckets(manager, db_client, [covidtable, flutable, covidmonthly, flumonthly],
+                                             writeCapacity)
+
+    #pace all writes to the tables' write capacity instead of sleeping between steps
+    writer = batchWriter.ThrottledWriter(db_client, writeCapacity=writeCapacity, buckets=buckets)
+
+    #unchanged counties/regions are not re-written to today's partition of the daily tables, the rolling window
+    #still records them so the rates carry their last value forward
+    covidDelta = fluDelta = None
+    if useDelta:
+        if stream:
+            covidDelta = deltaStore.DeltaStore(covidtable + '-history', keyCols=['date', 'state-county'], ignoreCols=())
+        else:
+            covidDelta = deltaStore.DeltaStore(covidtable, keyCols=['state-county'])
+        fluDelta = deltaStore.DeltaStore(flutable, keyCols=['region'])
+
+    #Incremental mode keeps the last windowWeeks weeks of daily values locally, so the rates are computed from
+    #today's load instead of re-reading the past partitions, and only the monthly rows whose rates changed are written
+    covidWindow = fluWindow = covidMonthlyDelta = fluMonthlyDelta = None
+    if incremental:
+        covidWindow = rollingWindow.RollingWindow(covidtable, ['state-county', 'state'], ['cases', 'deaths'], windowWeeks)
+        fluWindow = rollingWindow.RollingWindow(flutable, ['region'], ['num_ili', 'num_patients'], windowWeeks)
+        covidMonthlyDelta = deltaStore.DeltaStore(covidmonthly, keyCols=['state-county'], ignoreCols=())
+        fluMonthlyDelta = deltaStore.DeltaStore(flumonthly, keyCols=['region'], ignoreCols=())
+
+    #every loaded daily row is also appended to the local Parquet history (historyStore.HISTORY_DIR)
+    covidHistory = fluHistory = None
+    if keepHistory:
+        covidHistory = historyStore.covidHistory()
+        fluHistory = historyStore.fluHistory()
+
+    #objects loaded by an earlier run (e.g. one that failed part way) and unchanged since are not read again
+    manifest = None if reload else runManifest.RunManifest()
+
+    csv = pd.read_csv(statesFile) #statesPartial.csv: only a few states are used for demonstration. Full list would cost too much.
     listStates = csv['State']
-    for st in listStates:
-        putDynamoCovid(state=st, s3_client=s3_client, tableName = covidtable, bucketName = covidbucket)
-        time.sleep(5) #workaround to minimize having to increase DynamoDB privisioned units
-    time.sleep(10) #Workaround to minimize having to increase DynamoDB cost and provisioned units
-    updateDynamoCovidRates(db_resource=db_resource, tableName = covidtable, tableNameMonthly = covidmonthly)
-    time.sleep(10) #Workaround to minimize having to increase DynamoDB cost and provisioned units
-    putDynamoFlu(s3_client = s3_client, fromBucket = flubucket, toTable = flutable)
-    time.sleep(10) #Workaround to minimize having to increase DynamoDB cost and provisioned units
-    updateDynamoFluRates(db_resource, tableName = flutable, tableNameMonthly = flumonthly)
+    failures = []
+    #one client reads the date partitions for both rate updates, on the same endpoint as db_resource
+    readClient = partitionClient(db_resource)
+    try:
+        if processes > 1:
+            workers, failures = parallelLoad.loadStates(list(listStates), covidtable, covidbucket, buckets, processes,
+                                                        deadline=deadline, keepHistory=keepHistory, manifest=manifest)
+        elif stream:
+            for st in listStates:
+                streamDynamoCovid(state=st, s3_client=s3_client, tableName = covidtable, bucketName = covidbucket,
+                                  lastDays=lastDays, chunkRows=chunkRows, writer=writer, delta=covidDelta,
+                                  window=covidWindow, history=covidHistory, manifest=manifest)
+        elif usePipeline:
+            pipelineDynamoCovid(list(listStates), s3_client=s3_client, tableName = covidtable, bucketName = covidbucket,
+                                fetchWorkers=fetchWorkers, transformWorkers=transformWorkers,
+                                writeWorkers=writeWorkers, queueSize=queueSize, writer=writer, delta=covidDelta,
+                                window=covidWindow, history=covidHistory, manifest=manifest)
+        else:
+            for st in listStates:
+                putDynamoCovid(state=st, s3_client=s3_client, tableName = covidtable, bucketName = covidbucket,
+                               writer=writer, delta=covidDelta, window=covidWindow, history=covidHistory,
+                               manifest=manifest)
+        covidRates = updateDynamoCovidRates(db_resource=db_resource, tableName = covidtable, tableNameMonthly = covidmonthly,
+                                            writer=writer, window=covidWindow, delta=covidMonthlyDelta, weeks=windowWeeks,
+                                            db_client=readClient)
+        putDynamoFlu(s3_client = s3_client, fromBucket = flubucket, toTable = flutable, writer=writer, delta=fluDelta,
+                     window=fluWindow, history=fluHistory, manifest=manifest)
+        fluRates = updateDynamoFluRates(db_resource, tableName = flutable, tableNameMonthly = flumonthly, writer=writer,
+                                        window=fluWindow, delta=fluMonthlyDelta, weeks=windowWeeks, db_client=readClient)
+
+        runId = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        if snapshotPath:
+            countySnapshot.writeSnapshot(covidRates, fluRates, runId, snapshotPath)
+        putRunMarker(db_resource, covidmonthly, {'state-county': ETL_RUN_KEY, 'state': ETL_RUN_KEY}, runId)
+        putRunMarker(db_resource, flumonthly, {'region': ETL_RUN_KEY}, runId)
+    finally:
+        #local state only records rows that were written, so it is kept even when the run failed part way
+        logger.info(f"::main write totals: {writer.stats}")
+        if manifest is not None:
+            logger.info(f"::main manifest objects: {manifest.stats}")
+        if manager is not None:
+            manager.shutdown()
+        if useDelta:
+            covidDelta.save()
+            fluDelta.save()
+            logger.info(f"::main delta skipped writes, covid: {covidDelta.stats['skipped']}, flu: {fluDelta.stats['skipped']}")
+        if incremental:
+            covidWindow.save()
+            fluWindow.save()
+            covidMonthlyDelta.save()
+            fluMonthlyDelta.save()
+            logger.info(f"::main unchanged rates not written, covid: {covidMonthlyDelta.stats['skipped']}, "
+                        f"flu: {fluMonthlyDelta.stats['skipped']}")
+    if failures:
+        raise RuntimeError(f"{len(failures)} states not loaded: {', '.join(f['state'] for f in failures)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load today's Covid and Flu S3 objects into DynamoDB")
+    parser.add_argument("--pipeline", action="store_true", help="overlap S3 fetch, transform and DynamoDB write per state")
+    parser.add_argument("--fetch-workers", type=int, default=2)
+    parser.add_argument("--transform-workers", type=int, default=1)
+    parser.add_argument("--write-workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument("--write-capacity", type=float, default=None,
+                        help="WCU per second for each table (default: the table's provisioned write capacity)")
+    parser.add_argument("--stream", action="store_true", help="stream-parse multi-day Covid objects in row chunks")
+    parser.add_argument("--last-days", default="30", help="Covid object suffix read in --stream mode (_last<N>)")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--delta", action="store_true",
+                        help="skip rows unchanged since the previous run (needs --incremental)")
+    parser.add_argument("--snapshot", nargs="?", const=countySnapshot.SNAPSHOT_PATH, default=None,
+                        help=f"write the monthly rates to a county snapshot file (default {countySnapshot.SNAPSHOT_PATH})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="compute rates from a local rolling window of past weeks instead of re-reading DynamoDB")
+    parser.add_argument("--window-weeks", type=int, default=4, help="weekly points used for the monthly rates")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="load the Covid states across this many processes sharing one write budget")
+    parser.add_argument("--states-file", default="./assets/statesPartial.csv",
+                        help="csv with a State column, e.g. ./assets/states.csv for every state")
+    parser.add_argument("--deadline-minutes", type=float, default=None,
+                        help="with --processes, states not started within this many minutes are reported, not loaded")
+    parser.add_argument("--reload", action="store_true",
+                        help="load every S3 object again, even those already loaded and unchanged")
+    parser.add_argument("--history", action="store_true",
+                        help=f"also append the daily rows to the local Parquet history ({historyStore.HISTORY_DIR})")
+    args = parser.parse_args()
+    if args.delta and not args.incremental:
+        parser.error("--delta needs --incremental: the rates would be computed from date partitions missing unchanged rows")
+    if args.processes > 1 and (args.stream or args.pipeline or args.delta or args.incremental):
+        parser.error("--processes cannot be combined with --stream, --pipeline, --delta or --incremental")
+    deadline = None if args.deadline_minutes is None else time.time() + args.deadline_minutes * 60
+    main(usePipeline=args.pipeline, fetchWorkers=args.fetch_workers, transformWorkers=args.transform_workers,
+         writeWorkers=args.write_workers, queueSize=args.queue_size, writeCapacity=args.write_capacity,
+         stream=args.stream, lastDays=args.last_days, chunkRows=args.chunk_rows, useDelta=args.delta,
+         snapshotPath=args.snapshot, incremental=args.incremental, windowWeeks=args.window_weeks,
+         keepHistory=args.history, processes=args.processes, statesFile=args.states_file, deadline=deadline,
+         reload=args.reload)
@@ -0,0 +1,137 @@
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing.managers import BaseManager
+import logging
+import time
+import os
+
+try:
+    from loadTo import loadToDynamo, batchWriter, historyStore, runManifest
+except ImportError:
+    import loadToDynamo
+    import batchWriter
+    import historyStore
+    import runManifest
+
+'''
+File: parallelLoad.py
+Author: SonnyP
+Multi-process Covid load. The state list is split across a process pool; each worker creates its own S3/DynamoDB
+clients once, and every worker's writes draw on the same per-table token buckets, held by a manager process the
+parent starts, so the pool as a whole stays within each table's write-capacity budget. The parent collects
+per-worker totals and per-state failures, and states not started by the deadline are reported instead of loaded.
+Workers check objects against a copy of the run manifest and the parent records their manifest entries.
+Classes:
+    BudgetManager
+Functions:
+    sharedBuckets
+    initWorker
+    loadState
+    loadStates
+'''
+
+logger = logging.getLogger(__name__)
+
+#Manager process serving batchWriter.TokenBucket objects to every worker
+class BudgetManager(BaseManager):
+    pass
+
+BudgetManager.register('TokenBucket', batchWriter.TokenBucket)
+
+#{table: shared token bucket proxy} for tableNames, created in a started BudgetManager. Tables without a write
+#budget (on-demand, and writeCapacity not given) map to None and are not throttled
+def sharedBuckets(manager, db_client, tableNames, writeCapacity=None):
+    buckets = {}
+    for name in tableNames:
+        capacity = writeCapacity if writeCapacity is not None else batchWriter.tableWriteCapacity(db_client, name)
+        buckets[name] = manager.TokenBucket(capacity) if capacity else None
+        logger.info(f"::sharedBuckets {name} write budget: {capacity or 'unlimited'} WCU/s shared by all workers")
+    return buckets
+
+#Clients and writer of this worker process, set by initWorker
+_worker = {}
+
+#Pool initializer: runs once in each worker process. manifestEntries: copy of the parent's run manifest, or None
+def initWorker(buckets, region, keepHistory, manifestEntries=None):
+    s3_client, db_client, db_resource = loadToDynamo.connectAWS(region=region)
+    _worker['s3_client'] = s3_client
+    _worker['writer'] = batchWriter.ThrottledWriter(db_client, buckets=buckets)
+    _worker['history'] = historyStore.covidHistory() if keepHistory else None
+    _worker['manifest'] = None
+    if manifestEntries is not None:
+        _worker['manifest'] = runManifest.RunManifest(manifestDir=None, entries=manifestEntries)
+
+#Load one state in a worker. Failures are returned in the result (not raised) so one state cannot stop the run
+def loadState(state, tableName, bucketName, deadline=None):
+    result = {'state': state, 'pid': os.getpid(), 'status': None, 'rows': 0, 'seconds': 0.0, 'error': None,
+              'key': loadToDynamo.covidKey(state, time.strftime('%Y-%m-%d')), 'manifest': None}
+    if deadline is not None and time.time() >= deadline:
+        result['error'] = "deadline passed before the state was started"
+        return result
+    writer = _worker['writer']
+    before = writer.stats['items']
+    start = time.perf_counter()
+    try:
+        result['status'] = loadToDynamo.putDynamoCovid(state, _worker['s3_client'], tableName, bucketName,
+                                                       writer=writer, history=_worker['history'],
+                                                       manifest=_worker['manifest'])
+    except Exception as err:
+        logger.error("::loadState %s failed... %s: %s", state, type(err).__name__, err)
+        result['error'] = f"{type(err).__name__}: {err}"
+    result['rows'] = writer.stats['items'] - before
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    if _worker['manifest'] is not None and result['status'] != 304:
+        result['manifest'] = _worker['manifest'].entries.get(result['key'])
+    return result
+
+#Load every state's Covid payload across processes worker processes. deadline is an epoch time: states still
+#queued then are cancelled (states already running finish). With a runManifest.RunManifest objects already loaded
+#and unchanged are skipped. mpContext: multiprocessing context starting the workers (None for the platform default)
+#Returns ({pid: worker totals}, [failed results])
+def loadStates(states, tableName, bucketName, buckets, processes=4, region="us-east-2", deadline=None,
+               keepHistory=False, manifest=None, mpContext=None):
+    logger.info(f"::loadStates {len(states)} states across {processes} processes")
+    results = []
+    failures = []
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=mpContext, initializer=initWorker,
+                                   initargs=(buckets, region, keepHistory,
+                                             None if manifest is None else dict(manifest.entries)))
+    try:
+        futures = {executor.submit(loadState, state, tableName, bucketName, deadline): state for state in states}
+        timeout = None if deadline is None else max(0, deadline - time.time())
+        done, pending = wait(futures, timeout=timeout)
+        for future in pending:
+            if future.cancel():
+                failures.append({'state': futures[future], 'pid': None, 'status': None, 'rows': 0, 'seconds': 0.0,
+                                 'error': "not started before the deadline"})
+        #states already running when the deadline passed are allowed to finish
+        wait([future for future in pending if not future.cancelled()])
+        for future, state in futures.items():
+            if future.cancelled():
+                continue
+            try:
+                results.append(future.result())
+            except Exception as err:  #the worker process itself died
+                failures.append({'state': state, 'pid': None, 'status': None, 'rows': 0, 'seconds': 0.0,
+                                 'error': f"{type(err).__name__}: {err}"})
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    workers = {}
+    for result in results:
+        if manifest is not None:
+            if result['status'] == 304:
+                manifest.skipped(result['key'])
+            elif result['manifest'] is not None:
+                manifest.record(result['key'], result['manifest'])
+        if result['error'] is not None:
+            failures.append(result)
+            continue
+        totals = workers.setdefault(result['pid'], {'states': 0, 'rows': 0, 'seconds': 0.0})
+        totals['states'] += 1
+        totals['rows'] += result['rows']
+        totals['seconds'] = round(totals['seconds'] + result['seconds'], 3)
+    for pid, totals in workers.items():
+        logger.info(f"::loadStates worker {pid}: {totals}")
+    for failure in failures:
+        logger.error("::loadStates %s not loaded: %s", failure['state'], failure['error'])
+    return workers, failures
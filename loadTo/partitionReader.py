@@ -0,0 +1,67 @@
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import logging
+
+'''
+File: partitionReader.py
+Author: SonnyP
+Reads whole DynamoDB date partitions (following LastEvaluatedKey) into typed column arrays.
+Several dates are queried at the same time on a bounded thread pool using the thread-safe low level client.
+db_client must be boto3.client('dynamodb'); db_resource.meta.client re-serializes the typed attribute values.
+Functions:
+    queryPartition
+    readPartitions
+'''
+
+logger = logging.getLogger(__name__)
+
+#Query every page of one date partition. Returns a dict of column -> numpy array.
+#keyCols are returned as object arrays of str, numCols as float64 (missing attributes are 0).
+def queryPartition(db_client, tableName, date, keyCols, numCols):
+    cols = list(keyCols) + list(numCols)
+    names = {f"#c{i}": col for i, col in enumerate(cols)}
+    names["#d"] = "date"
+    request = {
+        "TableName": tableName,
+        "KeyConditionExpression": "#d = :d",
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": {":d": {"S": date}},
+        "ProjectionExpression": ", ".join(f"#c{i}" for i in range(len(cols))),
+    }
+
+    raw = {col: [] for col in cols}
+    pages = 0
+    try:
+        while True:
+            response = db_client.query(**request)
+            pages += 1
+            for item in response["Items"]:
+                for col in keyCols:
+                    raw[col].append(item[col]["S"])
+                for col in numCols:
+                    raw[col].append(item[col]["N"] if col in item else "0")
+            if "LastEvaluatedKey" not in response:
+                break
+            request["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as err:
+        logger.error("::queryPartition Error occured with Boto3 or DynamoDB... %s: %s",
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"]
+                    )
+        raise
+    logger.info(f"::queryPartition {tableName} date: {date}, items: {len(raw[cols[0]])}, pages: {pages}")
+
+    columns = {}
+    for col in keyCols:
+        columns[col] = np.array(raw[col], dtype=object)
+    for col in numCols:
+        columns[col] = np.array(raw[col], dtype=str).astype(np.float64)
+    return columns
+
+#Query several date partitions concurrently. Returns a dict of date -> columns (see queryPartition).
+def readPartitions(db_client, tableName, dates, keyCols, numCols, maxWorkers=4):
+    dates = list(dict.fromkeys(dates))
+    with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(dates)))) as pool:
+        futures = {date: pool.submit(queryPartition, db_client, tableName, date, keyCols, numCols) for date in dates}
+        return {date: future.result() for date, future in futures.items()}
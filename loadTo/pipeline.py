@@ -0,0 +1,103 @@
+import threading
+import queue
+import logging
+import time
+
+'''
+File: pipeline.py
+Author: SonnyP
+Producer/consumer pipeline for running ETL stages (fetch -> transform -> write) at the same time.
+Stages are joined by bounded queues so a slow stage applies back-pressure instead of buffering every state in memory.
+Functions:
+    runPipeline
+'''
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+_POLL = 0.1
+
+#put/get that give up once the pipeline has been stopped by an error
+def _put(q, value, stop):
+    while not stop.is_set():
+        try:
+            q.put(value, timeout=_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL)
+        except queue.Empty:
+            pass
+    return _DONE
+
+#Run every item through stages. stages is a list of (name, fn, workers); the first fn gets the item,
+#each later fn gets the previous stage's return value. Queues between stages hold at most queueSize values.
+#Returns a dict of item -> last stage result. The first stage error stops the pipeline and is re-raised.
+def runPipeline(items, stages, queueSize=2):
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queueSize) for _ in stages]
+    results = {}
+    errors = []
+    lock = threading.Lock()
+    remaining = [workers for _, _, workers in stages]
+    timings = {name: 0.0 for name, _, _ in stages}
+
+    def feed():
+        for item in items:
+            if not _put(queues[0], (item, item), stop):
+                return
+        for _ in range(stages[0][2]):
+            _put(queues[0], _DONE, stop)
+
+    def work(i):
+        name, fn, _ = stages[i]
+        last = i == len(stages) - 1
+        while True:
+            entry = _get(queues[i], stop)
+            if entry is _DONE:
+                break
+            item, value = entry
+            try:
+                start = time.perf_counter()
+                value = fn(value)
+                with lock:
+                    timings[name] += time.perf_counter() - start
+            except Exception as err:
+                logger.error(f"::runPipeline stage {name} failed for {item}: {err}")
+                with lock:
+                    errors.append((item, name, err))
+                stop.set()
+                break
+            if last:
+                with lock:
+                    results[item] = value
+            elif not _put(queues[i + 1], (item, value), stop):
+                break
+
+        #last worker out of a stage closes the next stage
+        with lock:
+            remaining[i] -= 1
+            closeNext = remaining[i] == 0 and not last
+        if closeNext:
+            for _ in range(stages[i + 1][2]):
+                _put(queues[i + 1], _DONE, stop)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, (name, _, workers) in enumerate(stages):
+        for w in range(workers):
+            threads.append(threading.Thread(target=work, args=(i,), name=f"{name}-{w}", daemon=True))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    logger.info(f"::runPipeline busy seconds per stage: {timings}")
+    if errors:
+        raise errors[0][2]
+
+    return results
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from decimal import Decimal
+
+'''
+File: rateEngine.py
+Author: SonnyP
+Columnar helpers for joining the weekly DynamoDB snapshots by key and computing Covid/Flu rates in NumPy.
+A snapshot is a dict of column name -> numpy array (one entry per item in the date partition).
+Functions:
+    weekNames
+    itemsToColumns
+    alignToKeys
+    pctChange
+    safeRatio
+    computeCovidRates
+    computeFluRates
+    toDecimalColumns
+'''
+
+#Snapshot names for a window of n weekly points: today, week1 (7 days ago), ... week<n-1>
+def weekNames(n=4):
+    return ['today'] + [f'week{t}' for t in range(1, n)]
+
+WEEKS = weekNames(4)
+
+#Convert a list of DynamoDB items (boto3 Decimal dicts) into a snapshot of typed column arrays
+def itemsToColumns(items, keyCols, numCols):
+    columns = {}
+    for col in keyCols:
+        columns[col] = np.array([item[col] for item in items], dtype=object)
+    for col in numCols:
+        columns[col] = np.array([float(item.get(col, 0)) for item in items], dtype=np.float64)
+    return columns
+
+#Return the values of valueCol in snapshot re-ordered to match keys. Keys missing from the snapshot get fill.
+#Duplicate keys in the snapshot keep the last occurrence.
+def alignToKeys(keys, snapshot, keyCol, valueCol, fill=0):
+    if snapshot is None or len(snapshot[keyCol]) == 0:
+        return np.full(len(keys), fill, dtype=np.float64)
+
+    index = pd.Index(snapshot[keyCol])
+    values = np.asarray(snapshot[valueCol], dtype=np.float64)
+    if not index.is_unique:
+        keep = ~index.duplicated(keep='last')
+        index = index[keep]
+        values = values[keep]
+
+    position = index.get_indexer(keys)
+    return np.where(position >= 0, values[position], fill)
+
+#Percent change from base to current, rounded like the original loop. Zero denominators give 0.
+def pctChange(current, base):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.round((current - base) / base, 2) * 100
+    return np.where(base != 0, rate, 0.0)
+
+#numerator / denominator with zero denominators giving 0
+def safeRatio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / denominator
+    return np.where(denominator != 0, ratio, 0.0)
+
+#Join the weekly covid snapshots on state-county (left join on today's keys) and compute monthly rates
+#snapshots: dict of week name ('today', 'week1', 'week2', 'week3') -> snapshot with state-county, state, cases, deaths
+#weeks: window of week names; the rates compare today against the oldest one
+def computeCovidRates(snapshots, weeks=WEEKS):
+    today = snapshots['today']
+    keys = today['state-county']
+    base = weeks[-1]
+
+    ds = pd.DataFrame({'state-county': keys, 'state': today['state']})
+    for week in weeks:
+        for measure in ['cases', 'deaths']:
+            values = alignToKeys(keys, snapshots.get(week), 'state-county', measure)
+            ds[f'{measure}-{week}'] = values.astype(np.int64)
+
+    ds['monthly-case-rate'] = pctChange(ds['cases-today'].to_numpy(np.float64), ds[f'cases-{base}'].to_numpy(np.float64))
+    ds['monthly-death-rate'] = pctChange(ds['deaths-today'].to_numpy(np.float64), ds[f'deaths-{base}'].to_numpy(np.float64))
+
+    return ds
+
+#Join the weekly flu snapshots on region (left join on today's keys) and compute ILI case rates
+#snapshots: dict of week name -> snapshot with region, num_ili, num_patients
+#weeks: window of week names. week3-case-rate (the name the dashboard reads) is the rate of the oldest week
+def computeFluRates(snapshots, weeks=WEEKS):
+    today = snapshots['today']
+    keys = today['region']
+    base = weeks[-1]
+
+    ds = pd.DataFrame({'region': keys})
+    for week in weeks:
+        for measure in ['num_ili', 'num_patients']:
+            values = alignToKeys(keys, snapshots.get(week), 'region', measure)
+            ds[f'{week}-{measure}'] = values.astype(np.int64)
+
+    ds['today-case-rate'] = safeRatio(ds['today-num_ili'].to_numpy(np.float64), ds['today-num_patients'].to_numpy(np.float64))
+    ds['week3-case-rate'] = safeRatio(ds[f'{base}-num_ili'].to_numpy(np.float64), ds[f'{base}-num_patients'].to_numpy(np.float64))
+
+    return ds
+
+#DynamoDB (TypeSerializer) rejects floats, so convert float rate columns to Decimal before put_df
+def toDecimalColumns(ds, cols, places=6):
+    for col in cols:
+        ds[col] = [Decimal(str(round(float(v), places))) for v in ds[col].to_numpy()]
+    return ds
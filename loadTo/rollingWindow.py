@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from bisect import bisect_right
+import numpy as np
+import threading
+import logging
+import json
+import os
+
+try:
+    from loadTo import rateEngine
+except ImportError:
+    import rateEngine
+
+'''
+File: rollingWindow.py
+Author: SonnyP
+Per-key history of the last few weeks of daily values (cases/deaths per county, ILI counts per region), persisted
+locally and fed with each run's load, so the monthly rates can be recomputed without re-reading the date
+partitions from DynamoDB.
+Classes:
+    RollingWindow
+'''
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DIR = './loadTo/.window'
+
+#Rolling window for one daily table, stored in <windowDir>/<tableName>.json as
+#{"weeks": n, "rows": {key: {"attrs": {keyCol: value}, "obs": [[date, value, ...], ...]}}} with obs sorted by date.
+#The value of a key for a target date is its latest observation at or before that date, so a key that was not
+#re-loaded (e.g. skipped by delta mode) keeps its last value.
+class RollingWindow:
+    #keyCols: columns kept for each key (the first identifies it), numCols: values tracked, weeks: weekly points
+    def __init__(self, tableName, keyCols, numCols, weeks=4, windowDir=WINDOW_DIR):
+        self.path = os.path.join(windowDir, tableName + '.json')
+        self.keyCols = list(keyCols)
+        self.numCols = list(numCols)
+        self.weeks = weeks
+        self.names = rateEngine.weekNames(weeks)
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.stats = {'observed': 0, 'pruned': 0}
+        #False until the window holds history from a previous run or from seed()
+        self.seeded = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.rows = saved.get('rows', {})
+            #a window saved with fewer weeks does not hold enough history for this one
+            if saved.get('weeks', 0) < weeks:
+                self.rows = {}
+            self.seeded = bool(self.rows)
+        logger.info(f"::RollingWindow {self.path} loaded {len(self.rows)} keys")
+
+    #Dates ('%Y-%m-%d') of the weekly points, newest first
+    def targetDates(self, today):
+        return [(today - timedelta(days=7 * t)).strftime('%Y-%m-%d') for t in range(self.weeks)]
+
+    def _observe(self, attrs, date, values):
+        key = str(attrs[self.keyCols[0]])
+        row = self.rows.setdefault(key, {'attrs': attrs, 'obs': []})
+        row['attrs'] = attrs
+        obs = row['obs']
+        dates = [o[0] for o in obs]
+        i = bisect_right(dates, date)
+        if i > 0 and dates[i - 1] == date:
+            obs[i - 1] = [date] + values
+        else:
+            obs.insert(i, [date] + values)
+
+    #Record the rows of a loaded dataframe (needs 'date', keyCols and numCols)
+    def update(self, df):
+        if len(df) == 0:
+            return
+        attrs = {col: df[col].astype(str).tolist() for col in self.keyCols}
+        values = np.column_stack([df[col].to_numpy(np.float64) for col in self.numCols]).tolist()
+        dates = df['date'].astype(str).tolist()
+        with self.lock:
+            for i, date in enumerate(dates):
+                self._observe({col: attrs[col][i] for col in self.keyCols}, date, values[i])
+            self.stats['observed'] += len(dates)
+
+    #Seed the window from week snapshots read from DynamoDB (dict of week name -> snapshot columns)
+    def seed(self, snapshots, today):
+        with self.lock:
+            for name, date in zip(self.names, self.targetDates(today)):
+                columns = snapshots.get(name)
+                if columns is None:
+                    continue
+                for i in range(len(columns[self.keyCols[0]])):
+                    attrs = {col: str(columns[col][i]) for col in self.keyCols}
+                    self._observe(attrs, date, [float(columns[col][i]) for col in self.numCols])
+            self.seeded = True
+        logger.info(f"::RollingWindow {self.path} seeded {len(self.rows)} keys")
+
+    #Week snapshots in rateEngine's format for every key observed today, with each week's value carried forward
+    #from the key's latest observation at or before that week's date. Keys without one are left out of that week.
+    def snapshots(self, today):
+        targets = self.targetDates(today)
+        snapshots = {name: {col: [] for col in self.keyCols + self.numCols} for name in self.names}
+        with self.lock:
+            for row in self.rows.values():
+                obs = row['obs']
+                if not obs or obs[-1][0] != targets[0]:
+                    continue
+                dates = [o[0] for o in obs]
+                for name, target in zip(self.names, targets):
+                    i = bisect_right(dates, target)
+                    if i == 0:
+                        continue
+                    columns = snapshots[name]
+                    for col in self.keyCols:
+                        columns[col].append(row['attrs'][col])
+                    for col, value in zip(self.numCols, obs[i - 1][1:]):
+                        columns[col].append(value)
+        for columns in snapshots.values():
+            for col in self.keyCols:
+                columns[col] = np.array(columns[col], dtype=object)
+            for col in self.numCols:
+                columns[col] = np.array(columns[col], dtype=np.float64)
+        return snapshots
+
+    #Drop observations no longer needed: everything before the latest one at or before the oldest week
+    def prune(self, today):
+        oldest = self.targetDates(today)[-1]
+        with self.lock:
+            for row in self.rows.values():
+                obs = row['obs']
+                i = bisect_right([o[0] for o in obs], oldest)
+                if i > 1:
+                    del obs[:i - 1]
+                    self.stats['pruned'] += i - 1
+
+    #Persist the window for the next run (written to a temp file and swapped in)
+    def save(self, today=None):
+        self.prune(today or datetime.today())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with self.lock:
+            with open(tmp, 'w') as f:
+                json.dump({'weeks': self.weeks, 'rows': self.rows}, f)
+            os.replace(tmp, self.path)
+        logger.info(f"::RollingWindow {self.path} saved {len(self.rows)} keys, observed: {self.stats['observed']}")
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import threading
+import logging
+import json
+import os
+
+'''
+File: runManifest.py
+Author: SonnyP
+Per-object load status of the ETL, persisted locally after every change, so a run that stopped part way (e.g.
+on the 30th state) can be re-run and only load the S3 objects that are not loaded yet or changed since.
+Classes:
+    RunManifest
+'''
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = './loadTo/.manifest'
+#entries not updated for this many days are dropped when saving (S3 keys are dated, so they are not read again)
+KEEP_DAYS = 14
+
+#Load status of every S3 object read by the ETL, stored in <manifestDir>/<name>.json as
+#{key: {"etag": ETag, "status": "fetched" | "loaded" | "failed", "rows": n, "updated": iso time, "error": msg}}
+#With manifestDir None it is kept in memory only (used by parallelLoad workers, the parent persists their entries)
+class RunManifest:
+    def __init__(self, name='etl', manifestDir=MANIFEST_DIR, entries=None):
+        self.path = None if manifestDir is None else os.path.join(manifestDir, name + '.json')
+        self.lock = threading.Lock()
+        self.stats = {'loaded': 0, 'skipped': 0, 'failed': 0}
+        self.entries = dict(entries or {})
+        if entries is None and self.path is not None and os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        logger.info(f"::RunManifest {self.path} loaded {len(self.entries)} entries")
+
+    #ETag of key if it was completely loaded, else None
+    def loadedEtag(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry['status'] != 'loaded':
+            return None
+        return entry['etag']
+
+    def _set(self, key, save=True, **values):
+        with self.lock:
+            entry = self.entries.setdefault(key, {'etag': None, 'status': None, 'rows': 0, 'error': None})
+            entry.update(values, updated=datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
+        if save:
+            self.save()
+
+    #The object was downloaded (not loaded yet)
+    def fetched(self, key, etag):
+        self._set(key, save=False, etag=etag, status='fetched', rows=0, error=None)
+
+    #Every row of the fetched object was written
+    def loaded(self, key, rows):
+        self._set(key, status='loaded', rows=rows)
+        self.stats['loaded'] += 1
+
+    def failed(self, key, error):
+        self._set(key, status='failed', error=str(error))
+        self.stats['failed'] += 1
+
+    #The object is loaded and unchanged, so it was not read again
+    def skipped(self, key):
+        logger.info(f"::RunManifest {key} already loaded and unchanged, skipped")
+        self.stats['skipped'] += 1
+
+    #Merge an entry recorded by another manifest (a worker process)
+    def record(self, key, entry):
+        with self.lock:
+            self.entries[key] = dict(entry)
+        if entry['status'] in self.stats:
+            self.stats[entry['status']] += 1
+        self.save()
+
+    #Persist the manifest (written to a temp file and swapped in). No-op for in-memory manifests
+    def save(self):
+        if self.path is None:
+            return
+        cutoff = (datetime.utcnow() - timedelta(days=KEEP_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with self.lock:
+            self.entries = {key: entry for key, entry in self.entries.items() if entry['updated'] >= cutoff}
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp, self.path)
@@ -1,6 +1,16 @@
 import pytest
 import boto3
-from dashApp import api
+import sys
+import os
+
+#dashApp modules import each other as top-level modules (the app is run as dashApp/app.py), so the tests import
+#them the same way: a module imported both as api and dashApp.api would have two copies of its caches
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dashApp"))
+import api
+import cache
+import httpClient
+from botocore.exceptions import ClientError
+import io
 
 @pytest.fixture
 def ex_eventbrite_id():
@@ -30,4 +40,107 @@ def aws_resource():
     s3_client = boto3.client('s3')
     db_client = boto3.client('dynamodb')
     db_resource = boto3.resource('dynamodb', region_name=region)
-    return s3_client, db_client, db_resource
\ No newline at end of file
+    return s3_client, db_client, db_resource
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+    def json(self):
+        return self.payload
+
+#Eventbrite API stub: httpClient.get answers events/<id>/ and venues/<id>/ (events/404/ is not found, events/500/
+#a server error) and the event and venue caches start empty. Returns the list of paths requested
+@pytest.fixture
+def eventbrite_stub(monkeypatch):
+    requested = []
+    def fake_get(url, params=None, headers=None, timeout=httpClient.TIMEOUT):
+        path = url[len(api.EVENTBRITE_URL):]
+        requested.append(path)
+        if path == "events/404/":
+            return FakeResponse(404, {"status_code": 404, "error": "NOT_FOUND", "error_description": "gone"})
+        if path == "events/500/":
+            return FakeResponse(500, {"status_code": 500, "error": "INTERNAL_ERROR", "error_description": "oops"})
+        if path.startswith("events/"):
+            return FakeResponse(200, {"name": {"text": "n"}, "description": {"text": "d"}, "start": {"local": "s"},
+                                      "end": {"local": "e"}, "venue_id": "42", "logo": {"url": "u"}})
+        return FakeResponse(200, {"address": {"localized_address_display": "a", "postal_code": "94607", "region": "CA"}})
+    monkeypatch.setattr(httpClient, "get", fake_get)
+    monkeypatch.setattr(api, "eventCache", cache.TTLCache("event"))
+    monkeypatch.setattr(api, "venueCache", cache.TTLCache("venue"))
+    return requested
+
+#S3 client stub. objects: {key: body, or (body, Content-Encoding)}, or a function of the key returning either
+#(None for a missing key). ETags are '"v1"' unless set in etags, and IfNoneMatch on the current ETag gets a 304
+class FakeS3:
+    def __init__(self, objects=None):
+        self.objects = objects if callable(objects) else dict(objects or {})
+        self.etags = {}
+        self.requested = []
+        self.downloads = 0
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.requested.append(Key)
+        found = self.objects(Key) if callable(self.objects) else self.objects.get(Key)
+        if found is None:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "missing"}}, "GetObject")
+        etag = self.etags.get(Key, '"v1"')
+        if IfNoneMatch == etag:
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        body, encoding = found if isinstance(found, tuple) else (found, None)
+        self.downloads += 1
+        response = {"Body": io.BytesIO(body), "ETag": etag, "ResponseMetadata": {"HTTPStatusCode": 200}}
+        if encoding:
+            response["ContentEncoding"] = encoding
+        return response
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3
+
+#DynamoDB table stub: get_item finds items by the value of the first key attribute, query returns pages of items
+#in turn (with a LastEvaluatedKey while pages are left)
+class FakeTable:
+    def __init__(self, items=None, pages=None):
+        self.items = dict(items or {})
+        self.pages = list(pages or [])
+        self.reads = 0
+        self.queries = []
+    def get_item(self, Key):
+        self.reads += 1
+        item = self.items.get(next(iter(Key.values())))
+        response = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+        if item is not None:
+            response["Item"] = dict(item)
+        return response
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        page = kwargs.get("ExclusiveStartKey", {"page": 0})["page"]
+        response = {"Items": [dict(item) for item in self.pages[page]]}
+        if page + 1 < len(self.pages):
+            response["LastEvaluatedKey"] = {"page": page + 1}
+        return response
+
+class FakeResource:
+    def __init__(self, table):
+        self.table = table
+    def Table(self, name):
+        return self.table
+
+#Builds a DynamoDB resource stub whose every table is one FakeTable(items, pages), reachable as resource.table
+@pytest.fixture
+def fake_dynamo():
+    return lambda items=None, pages=None: FakeResource(FakeTable(items, pages))
+
+#batchWriter.ThrottledWriter stub recording (tableName, dataframe) for each put; raises while fail is set
+class FakeWriter:
+    def __init__(self):
+        self.written = []
+        self.fail = False
+    def putDf(self, df, tableName):
+        if self.fail:
+            raise RuntimeError("write failed")
+        self.written.append((tableName, df))
+
+@pytest.fixture
+def fake_writer():
+    return FakeWriter()
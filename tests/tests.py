@@ -1,8 +1,29 @@
 import pytest
 from loadTo import loadToDynamo
-from dashApp import api
-from dashApp import awsdb
+import api
+import awsdb
+import geoIndex
+import cache
+import mapCache
+import fanout
+import httpClient
+import metrics
+from decimal import Decimal
+from loadTo import rateEngine, partitionReader, pipeline, batchWriter, jsonStream, deltaStore
+from loadTo import countySnapshot as snapshotWriter
+from loadTo import rollingWindow, historyStore, parallelLoad, runManifest, compression
+from botocore.exceptions import ClientError
+import countySnapshot
+import pandas as pd
 import json
+import io
+import gzip
+import numpy as np
+import time
+import subprocess
+import multiprocessing
+import sys
+import os
 
 def test_eventbrite_api(ex_eventbrite_id):
     ebKey = api.authenticate_eventbrite()
@@ -26,3 +47,618 @@ def test_put_dyanmo_state(ex_test_state, table_name_covid, bucket_name_covid, aw
                                         bucketName = bucket_name_covid) == 200
 
     return
+
+
+def test_covid_rates_join_on_key():
+    today = {'state-county': np.array(['ca-a', 'ca-b', 'ca-c'], dtype=object),
+             'state': np.array(['ca', 'ca', 'ca'], dtype=object),
+             'cases': np.array([150., 80., 10.]), 'deaths': np.array([4., 2., 1.])}
+    # week3 out of order, missing ca-c, zero deaths for ca-a
+    week3 = {'state-county': np.array(['ca-b', 'ca-a'], dtype=object),
+             'state': np.array(['ca', 'ca'], dtype=object),
+             'cases': np.array([40., 100.]), 'deaths': np.array([1., 0.])}
+    ds = rateEngine.computeCovidRates({'today': today, 'week3': week3})
+
+    assert list(ds['cases-week3']) == [100, 40, 0]
+    assert list(ds['monthly-case-rate']) == [50.0, 100.0, 0.0]
+    assert list(ds['monthly-death-rate']) == [0.0, 100.0, 0.0]
+
+    return
+
+def test_partition_reader_follows_pages():
+    class PagedClient:
+        def __init__(self):
+            self.calls = []
+        def query(self, **request):
+            self.calls.append(request.get("ExclusiveStartKey"))
+            if "ExclusiveStartKey" not in request:
+                return {"Items": [{"region": {"S": "hhs1"}, "num_ili": {"N": "5"}}],
+                        "LastEvaluatedKey": {"region": {"S": "hhs1"}}}
+            return {"Items": [{"region": {"S": "hhs2"}, "num_ili": {"N": "7.5"}, "num_patients": {"N": "10"}}]}
+
+    client = PagedClient()
+    partitions = partitionReader.readPartitions(client, "flutable", ["2024-06-01"], ["region"], ["num_ili", "num_patients"])
+    columns = partitions["2024-06-01"]
+
+    assert len(client.calls) == 2
+    assert list(columns["region"]) == ["hhs1", "hhs2"]
+    assert columns["num_ili"].dtype == np.float64
+    assert list(columns["num_patients"]) == [0.0, 10.0]
+
+    return
+
+def test_partition_client_keeps_resource_endpoint():
+    from botocore.config import Config
+    resource = loadToDynamo.boto3.resource("dynamodb", region_name="us-west-1", endpoint_url="http://localhost:8000",
+                                           aws_access_key_id="test", aws_secret_access_key="test",
+                                           config=Config(retries={"max_attempts": 7}))
+    client = loadToDynamo.partitionClient(resource)
+    assert client.meta.endpoint_url == "http://localhost:8000" and client.meta.region_name == "us-west-1"
+    assert client.meta.config.retries["total_max_attempts"] == 8
+
+    return
+
+def test_pipeline_overlaps_stages():
+    def slow(value):
+        time.sleep(0.05)
+        return value
+
+    stages = [("fetch", slow, 1), ("transform", lambda v: v * 2, 1), ("write", slow, 1)]
+    start = time.perf_counter()
+    results = pipeline.runPipeline(range(10), stages, queueSize=2)
+    elapsed = time.perf_counter() - start
+
+    assert results == {i: i * 2 for i in range(10)}
+    # serial would be 10 * (0.05 + 0.05); overlapped is bounded by the slowest stage
+    assert elapsed < 0.85
+
+    def fail(value):
+        raise ValueError(value)
+    with pytest.raises(ValueError):
+        pipeline.runPipeline(range(10), [("fetch", slow, 2), ("write", fail, 1)])
+
+    return
+
+def test_throttled_writer_retries_unprocessed():
+    class FakeClient:
+        def __init__(self):
+            self.calls = []
+        def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+            requests = RequestItems["covidtable"]
+            self.calls.append(len(requests))
+            # first call leaves two items unprocessed
+            unprocessed = requests[:2] if len(self.calls) == 1 else []
+            return {"UnprocessedItems": {"covidtable": unprocessed} if unprocessed else {},
+                    "ConsumedCapacity": [{"TableName": "covidtable", "CapacityUnits": len(requests) - len(unprocessed)}]}
+
+    client = FakeClient()
+    writer = batchWriter.ThrottledWriter(client, writeCapacity=1000, baseDelay=0.001)
+    rows = [{"date": "2024-06-01", "state-county": f"ca-{i}", "cases": i, "rate": 0.5} for i in range(30)]
+
+    assert writer.putItems(rows, "covidtable") == 30
+    assert client.calls == [25, 2, 5]
+    assert writer.stats["items"] == 30 and writer.stats["retries"] == 1
+
+    bucket = batchWriter.TokenBucket(rate=100, capacity=10)
+    start = time.perf_counter()
+    for _ in range(3):
+        bucket.acquire(10)
+    assert time.perf_counter() - start >= 0.15
+
+    return
+
+def test_stream_parser_rows():
+    data = [{"province": "new york", "county": "kings",
+             "timeline": {"cases": {"3/8/23": 10, "3/9/23": 12}, "deaths": {"3/8/23": 1, "3/9/23": 2}}},
+            {"province": "new york", "county": "unassigned",
+             "timeline": {"cases": {"3/9/23": 1}, "deaths": {"3/9/23": 0}}},
+            {"province": "new york", "county": "out of ny", "note": "[x] \"é\" ]",
+             "timeline": {"cases": {"3/9/23": 1}, "deaths": {"3/9/23": 0}}}]
+    payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    # tiny reads split elements, strings and multi-byte characters across chunks
+    assert list(jsonStream.iterJsonArray(io.BytesIO(payload), chunkSize=3)) == data
+    assert list(jsonStream.iterJsonArray(io.BytesIO(b" [ 1, 22 ,333 ] "), chunkSize=1)) == [1, 22, 333]
+
+    rows = list(jsonStream.iterCovidRows(data, "2023-03-10"))
+    assert [(r["date"], r["state-county"], r["cases"]) for r in rows] == \
+        [("2023-03-09", "new york-kings", 10), ("2023-03-10", "new york-kings", 12)]
+
+    return
+
+def test_delta_store_skips_unchanged(tmp_path):
+    day1 = pd.DataFrame({"date": ["2024-06-01"] * 3, "state-county": ["ca-a", "ca-b", "ca-c"],
+                         "cases": [10, 20, 30], "deaths": [1, 2, 3]})
+    day2 = day1.assign(date="2024-06-02")
+    day2.loc[1, "cases"] = 25
+    day2.loc[3] = ["2024-06-02", "ca-d", 5, 0]
+
+    store = deltaStore.DeltaStore("covidtable", keyCols=["state-county"], deltaDir=str(tmp_path))
+    changed, skipped = store.filterChanged(day1)
+    assert (len(changed), skipped) == (3, 0)
+    store.update(changed)
+    store.save()
+
+    # a new run loads the fingerprints saved by the previous one
+    store = deltaStore.DeltaStore("covidtable", keyCols=["state-county"], deltaDir=str(tmp_path))
+    changed, skipped = store.filterChanged(day2)
+    assert list(changed["state-county"]) == ["ca-b", "ca-d"]
+    assert skipped == 2
+
+    return
+
+def test_delta_rates_carry_unchanged_rows_forward(tmp_path, fake_writer):
+    today = loadToDynamo.datetime.today()
+    def day(weeksAgo, cases):
+        date = (today - loadToDynamo.timedelta(days=7 * weeksAgo)).strftime("%Y-%m-%d")
+        return pd.DataFrame({"date": date, "state-county": ["ca-a", "ca-b"], "state": "ca",
+                             "cases": cases, "deaths": 0})
+    delta = deltaStore.DeltaStore("covidtable", keyCols=["state-county"], deltaDir=str(tmp_path))
+    window = rollingWindow.RollingWindow("covidtable", ["state-county", "state"], ["cases", "deaths"],
+                                         windowDir=str(tmp_path))
+    window.seed({}, today)
+    for weeksAgo, cases in [(3, [100, 100]), (1, [110, 150]), (0, [120, 150])]:
+        loadToDynamo.writeDynamo(day(weeksAgo, cases), "covidtable", fake_writer, delta, window)
+    # ca-b was unchanged today, so it is not in today's partition
+    assert list(fake_writer.written[-1][1]["state-county"]) == ["ca-a"]
+
+    ds = loadToDynamo.updateDynamoCovidRates(None, "covidtable", "covidmonthly", writer=fake_writer, window=window)
+    assert list(ds["state-county"]) == ["ca-a", "ca-b"]
+    assert [float(rate) for rate in ds["monthly-case-rate"]] == [20.0, 50.0]
+
+    # the date partitions alone would leave ca-b out of the rates
+    with pytest.raises(ValueError):
+        loadToDynamo.main(useDelta=True)
+
+    return
+
+def test_zip_index_lookup(tmp_path):
+    zips = geoIndex.loadZipIndex(indexPath=str(tmp_path / "geo_index.pkl"))
+    # second load comes from the pickle
+    assert geoIndex.loadZipIndex(indexPath=str(tmp_path / "geo_index.pkl")) == zips
+
+    assert geoIndex.lookupZip("35004") == ("Alabama", "St. Clair", ())
+    assert geoIndex.lookupZip("94105-1234")[:2] == ("California", "San Francisco")
+    # 10004 spans New Jersey and New York; the venue's region picks the county
+    assert geoIndex.lookupZip("10004", "NY") == ("New york", "New York", (("New jersey", "Hudson"),))
+    assert geoIndex.lookupZip("99999") is None
+
+    return
+
+def test_covid_cache_hits_and_run_marker(monkeypatch, fake_dynamo):
+    db_resource = fake_dynamo({"california-alameda": {"cases-today": Decimal(10), "deaths-today": Decimal(1),
+                                                      "monthly-case-rate": Decimal(5), "monthly-death-rate": Decimal(0)},
+                               awsdb.ETL_RUN_KEY: {"run-id": "run-1"}})
+    table = db_resource.table
+    monkeypatch.setattr(awsdb, "covidCache", cache.TTLCache("covidmonthly", markerInterval=0))
+
+    first = awsdb.get_df_covid("Alameda", "California", db_resource, awsdb.logging, "covidmonthly")[0]
+    first["monthly-covid-case-rate"] *= 100
+    second = awsdb.get_df_covid("Alameda", "California", db_resource, awsdb.logging, "covidmonthly")[0]
+    assert second["monthly-covid-case-rate"] == 5
+    assert awsdb.covidCache.stats()["hits"] == 1
+
+    # a new ETL run clears the cache
+    table.items[awsdb.ETL_RUN_KEY] = {"run-id": "run-2"}
+    awsdb.get_df_covid("Alameda", "California", db_resource, awsdb.logging, "covidmonthly")
+    assert awsdb.covidCache.stats()["invalidations"] == 1
+    assert awsdb.covidCache.stats()["misses"] == 2
+
+    return
+
+def test_map_cache_route(monkeypatch):
+    from flask import Flask
+    fetched = []
+    def fake_get_map(key, location, zoom="10", size="400x400"):
+        fetched.append(location)
+        return b"png-" + location.encode(), 200
+    monkeypatch.setattr(mapCache.api, "get_map", fake_get_map)
+    monkeypatch.setattr(mapCache, "mapCache", mapCache.MapCache(maxBytes=64))
+
+    server = Flask(__name__)
+    mapCache.register_routes(server)
+    client = server.test_client()
+
+    url = mapCache.get_map_url("key", "Alameda California")
+    assert mapCache.get_map_url("key", "Alameda California") == url
+    assert mapCache.get_map_url("key", "Kings New York") != url
+    assert fetched == ["Alameda California", "Kings New York"]
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b"png-Alameda California"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["ETag"] == f'"{url[len(mapCache.MAP_ROUTE):-4]}"'
+    revalidated = client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304 and revalidated.data == b""
+    assert client.get("/maps/unknown.png").status_code == 404
+
+    return
+
+def test_fanout_runs_calls_concurrently():
+    def slow(value, delay):
+        time.sleep(delay)
+        return value
+
+    start = time.perf_counter()
+    results = fanout.run_calls({"covid": (slow, ("c", 0.2), 1), "flu": (slow, ("f", 0.2), 1)})
+    assert results == {"covid": "c", "flu": "f"}
+    assert time.perf_counter() - start < 0.35
+
+    # a call past its deadline uses its fallback, or raises without one
+    results = fanout.run_calls({"map": (slow, ("m", 0.5), 0.05)}, fallbacks={"map": "default.png"})
+    assert results == {"map": "default.png"}
+    with pytest.raises(fanout.TimeoutError):
+        fanout.run_calls({"map": (slow, ("m", 0.5), 0.05)})
+
+    return
+
+def test_http_client_pools_sessions_and_keys(tmp_path, eventbrite_stub):
+    keyFile = tmp_path / "apikey.json"
+    keyFile.write_text(json.dumps({"eventbrite": "eb-key"}))
+    assert httpClient.get_key("eventbrite", str(keyFile)) == "eb-key"
+    keyFile.write_text(json.dumps({"eventbrite": "changed"}))
+    assert httpClient.get_key("eventbrite", str(keyFile)) == "eb-key"
+
+    session = httpClient.get_session("www.eventbriteapi.com")
+    assert httpClient.get_session("www.eventbriteapi.com") is session
+    assert httpClient.get_session("maps.googleapis.com") is not session
+    assert session.get_adapter("https://www.eventbriteapi.com/").max_retries.total == httpClient.RETRY.total
+
+    eventData, venueData, status = api.get_eventbrite("eb-key", 7)
+    assert eventbrite_stub == ["events/7/", "venues/42/"]
+    assert venueData["county"] == "Alameda" and status == "200"
+
+    return
+
+def test_eventbrite_cache_shares_venues_and_caches_not_found(eventbrite_stub):
+    requested = eventbrite_stub
+    # two events at one venue: one venue fetch, and repeats are served from the cache
+    api.get_eventbrite("k", 1)
+    api.get_eventbrite("k", 2)
+    api.get_eventbrite("k", 1)
+    assert requested == ["events/1/", "venues/42/", "events/2/"]
+
+    # not found is cached, other errors are not
+    for _ in range(2):
+        with pytest.raises(api.EventbriteNotFound):
+            api.get_eventbrite("k", 404)
+        with pytest.raises(api.EventbriteError):
+            api.get_eventbrite("k", 500)
+    assert requested.count("events/404/") == 1
+    # each hit raises a new exception: the cache does not keep a traceback growing with every raise
+    raised = []
+    for _ in range(3):
+        with pytest.raises(api.EventbriteNotFound) as info:
+            api.get_eventbrite("k", 404)
+        raised.append(info.value)
+    assert len({id(err) for err in raised}) == 3 and raised[0].status == 404
+    assert not isinstance(api.eventCache.get("404"), BaseException)
+    assert requested.count("events/500/") == 2
+
+    return
+
+# Import-time budget for the dashboard (microseconds, from python -X importtime). app's own time covers the
+# module body (Dash setup, layout); AWS and pandas must not be imported until a callback needs them.
+APP_SELF_IMPORT_BUDGET = 100000
+APP_TOTAL_IMPORT_BUDGET = 3000000
+
+def test_app_import_time_budget():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    env = dict(os.environ, PYTHONPATH=os.path.join(root, "dashApp"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=root, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            selfTime, cumulative, name = line[len("import time:"):].split("|")
+            if selfTime.strip().isdigit():
+                timings[name.strip()] = (int(selfTime), int(cumulative))
+
+    for heavy in ("pandas", "boto3", "botocore", "eventbrite"):
+        assert heavy not in timings, f"{heavy} imported at app import"
+    assert timings["app"][0] < APP_SELF_IMPORT_BUDGET
+    assert timings["app"][1] < APP_TOTAL_IMPORT_BUDGET
+
+    return
+
+def test_county_snapshot_lookup_and_hot_swap(tmp_path, fake_dynamo):
+    path = str(tmp_path / "snapshot.bin")
+    covid = pd.DataFrame({"state-county": ["new york-kings", "california-alameda", "california-los angeles"],
+                          "state": ["new york", "california", "california"],
+                          "cases-today": [30, 10, 20], "deaths-today": [3, 1, 2],
+                          "monthly-case-rate": [Decimal("50.0"), Decimal("5.0"), Decimal("-12.0")],
+                          "monthly-death-rate": [Decimal("0"), Decimal("100.0"), Decimal("7.0")]})
+    flu = pd.DataFrame({"region": ["hhs9", "hhs2"], "today-case-rate": [Decimal("0.025"), Decimal("0.01")],
+                        "week3-case-rate": [Decimal("0.0312"), Decimal("0.005")]})
+    snapshotWriter.writeSnapshot(covid, flu, "run-1", path)
+
+    now = [0]
+    reader = countySnapshot.SnapshotReader(path, checkInterval=5, clock=lambda: now[0])
+    assert reader.current().runId == "run-1"
+    assert reader.get_covid("Alameda", "California") == {"daily-covid-cases": 10, "daily-covid-deaths": 1,
+                                                         "monthly-covid-case-rate": 5, "monthly-covid-death-rate": 100}
+    assert reader.get_covid("Los Angeles", "california")["monthly-covid-case-rate"] == -12
+    assert reader.get_covid("Kings", "New York")["daily-covid-cases"] == 30
+    assert reader.get_covid("Orange", "California") is None
+    # flu rates are num_ili / num_patients fractions, shown as a percent of patients like awsdb.get_df_flu
+    fluPercent = {"today-case-rate": 2.5, "week3-case-rate": 3.12}
+    assert reader.get_flu("California", {"california": 9}) == fluPercent
+    fluResource = fake_dynamo({"hhs9": {"region": "hhs9", "today-case-rate": Decimal("0.025"),
+                                        "week3-case-rate": Decimal("0.0312")}, awsdb.ETL_RUN_KEY: {"run-id": "run-1"}})
+    assert awsdb.get_df_flu("California", fluResource, awsdb.logging, "flumonthly-test", {"california": 9})[0] == fluPercent
+
+    # a new snapshot is picked up after checkInterval
+    covid["cases-today"] = [31, 11, 21]
+    snapshotWriter.writeSnapshot(covid, flu, "run-2", path)
+    assert reader.get_covid("Alameda", "California")["daily-covid-cases"] == 10
+    now[0] = 6
+    assert reader.get_covid("Alameda", "California")["daily-covid-cases"] == 11
+    assert reader.current().runId == "run-2"
+
+    return
+
+def test_metrics_endpoint(monkeypatch):
+    from flask import Flask
+    class FakeResponse:
+        def __init__(self, status_code, content=b"png"):
+            self.status_code = status_code
+            self.content = content
+    statuses = iter([200, 500])
+    monkeypatch.setattr(httpClient, "get", lambda url, params=None, headers=None: FakeResponse(next(statuses)))
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(metrics, "_errors", {})
+
+    assert api.get_map("key", "Alameda California")[1] == 200
+    assert api.get_map("key", "Alameda California")[1] == 500
+    @metrics.timed("get_df_covid")
+    def failing():
+        raise KeyError("missing")
+    with pytest.raises(KeyError):
+        failing()
+
+    server = Flask(__name__)
+    metrics.register_routes(server)
+    body = server.test_client().get("/metrics").get_data(as_text=True)
+    assert 'esl_external_call_seconds_count{call="get_map"} 2' in body
+    assert 'esl_external_call_seconds_bucket{call="get_map",le="+Inf"} 2' in body
+    assert 'esl_external_call_errors_total{call="get_map",error="http_500"} 1' in body
+    assert 'esl_external_call_errors_total{call="get_df_covid",error="KeyError"} 1' in body
+    assert 'esl_cache_events_total{cache="covidmonthly",event="hits"}' in body
+    assert 'esl_cache_entries{cache="maps"}' in body
+
+    return
+
+def test_put_flu_concurrent_regions_and_epiweeks(tmp_path, fake_s3, fake_writer):
+    today = loadToDynamo.datetime.today()
+    def payload(key):
+        region = key.split("/")[1]
+        # hhs1 skips 202439 and hhs2 lags a week behind the other regions
+        weeks = {"hhs1": [202440, 202438], "hhs2": [202439]}.get(region, [202440])
+        rows = [{"release_date": "2024-10-10", "region": region, "epiweek": w, "lag": 0, "num_ili": 10 + w % 10,
+                 "num_patients": 1000, "wili": 1.0, "ili": 1.23456} for w in weeks]
+        return json.dumps({"epidata": rows}).encode()
+
+    s3 = fake_s3(payload)
+    window = rollingWindow.RollingWindow("flutable", ["region"], ["num_ili", "num_patients"], windowDir=str(tmp_path))
+    window.seed({}, today)
+    assert loadToDynamo.putDynamoFlu(s3, "bkt-test", "flutable", writer=fake_writer, window=window) == 200
+
+    df = fake_writer.written[0][1]
+    assert sorted(s3.requested) == sorted(loadToDynamo.fluKey(i, today.strftime("%Y-%m-%d")) for i in range(1, 11))
+    assert list(df.columns) == ["release_date", "region", "num_ili", "num_patients", "ili", "date"]
+    assert len(df) == 11 and set(df["ili"]) == {"1.23"}
+    def weeksAgo(n):
+        return (today - loadToDynamo.timedelta(days=7 * n)).strftime("%Y-%m-%d")
+    hhs1 = df[df["region"] == "hhs1"].set_index("date")["num_ili"]
+    assert hhs1.to_dict() == {weeksAgo(0): 10, weeksAgo(2): 18}
+    # hhs2's newest release is still loaded as today, so its monthly rates are updated too
+    assert df[df["region"] == "hhs2"].set_index("date")["num_ili"].to_dict() == {weeksAgo(0): 19}
+    rates = loadToDynamo.updateDynamoFluRates(None, "flutable", "flumonthly", writer=fake_writer, window=window)
+    assert sorted(rates["region"]) == sorted(f"hhs{i}" for i in range(1, 11))
+    monthly = fake_writer.written[-1]
+    assert monthly[0] == "flumonthly" and "hhs2" in set(monthly[1]["region"])
+    # epiweeks across a year boundary (2020 has 53 MMWR weeks)
+    assert loadToDynamo.epiweekStart(202101) - loadToDynamo.epiweekStart(202053) == loadToDynamo.timedelta(days=7)
+    assert loadToDynamo.epiweekStart(202501) == loadToDynamo.datetime(2024, 12, 29)
+
+    return
+
+def test_rolling_window_carries_forward(tmp_path):
+    today = loadToDynamo.datetime(2024, 10, 28)
+    window = rollingWindow.RollingWindow("covidtable", ["state-county", "state"], ["cases", "deaths"],
+                                         windowDir=str(tmp_path))
+    assert not window.seeded
+    history = [("2024-10-07", "ca-a", 100, 0), ("2024-10-07", "ca-b", 40, 1), ("2024-10-01", "ca-a", 90, 0),
+               ("2024-10-20", "ca-b", 70, 2), ("2024-10-28", "ca-a", 150, 4), ("2024-10-28", "ca-b", 80, 2)]
+    for date, key, cases, deaths in history:
+        window.update(pd.DataFrame({"date": [date], "state-county": [key], "state": ["ca"],
+                                    "cases": [cases], "deaths": [deaths]}))
+    window.save(today)
+
+    # reloaded from disk, pruned to what the oldest week needs
+    window = rollingWindow.RollingWindow("covidtable", ["state-county", "state"], ["cases", "deaths"],
+                                         windowDir=str(tmp_path))
+    assert window.seeded and window.stats == {"observed": 0, "pruned": 0}
+    assert [o[0] for o in window.rows["ca-a"]["obs"]] == ["2024-10-07", "2024-10-28"]
+    snapshots = window.snapshots(today)
+    # ca-b skipped on 10-21 carries its 10-20 value forward into week1
+    assert list(snapshots["week1"]["cases"]) == [100., 70.]
+    ds = rateEngine.computeCovidRates(snapshots, window.names)
+    assert list(ds["monthly-case-rate"]) == [50.0, 100.0]
+
+    # keys not loaded today are left out
+    window.update(pd.DataFrame({"date": ["2024-11-04"], "state-county": ["ca-a"], "state": ["ca"],
+                                "cases": [160], "deaths": [4]}))
+    assert list(window.snapshots(loadToDynamo.datetime(2024, 11, 4))["today"]["state-county"]) == ["ca-a"]
+
+    return
+
+def test_history_store_partitions_and_pushdown(tmp_path):
+    store = historyStore.covidHistory(str(tmp_path))
+    def rows(date, values):
+        return pd.DataFrame({"date": date, "state-county": [f"{s}-{c}" for s, c, _ in values],
+                             "state": [s for s, _, _ in values], "county": [c for _, c, _ in values],
+                             "cases": [v for _, _, v in values], "deaths": 1})
+    store.append(rows("2024-10-01", [("new york", "albany", 10), ("ohio", "adams", 5)]))
+    store.append(rows("2024-10-02", [("new york", "albany", 12), ("ohio", "adams", 6)]))
+    # re-load of a day: the latest write wins
+    store.append(rows("2024-10-02", [("new york", "albany", 13)]))
+
+    assert sorted(os.listdir(tmp_path / "covid" / "date=2024-10-01")) == ["state=new%20york", "state=ohio"]
+    trend = store.countyTrend("new york-albany")
+    assert list(trend.columns) == ["date", "cases", "deaths"]
+    assert trend["cases"].tolist() == [10, 13]
+    assert store.read(columns=["cases"], start="2024-10-02", state=["ohio"])["cases"].tolist() == [6]
+    assert len(historyStore.covidHistory(str(tmp_path / "missing")).read()) == 0
+
+    return
+
+def test_parallel_load_shares_write_budget(monkeypatch):
+    def fake_put(state, s3_client, tableName, bucketName, writer=None, history=None, manifest=None):
+        if state == "bad":
+            raise ValueError("no payload")
+        for _ in range(2):
+            writer.bucket(tableName).acquire(50)
+        return 200
+    # workers are forked (whatever the platform default start method is), so they inherit the patched functions
+    fork = multiprocessing.get_context("fork")
+    monkeypatch.setattr(loadToDynamo, "connectAWS", lambda region: (None, None, None))
+    monkeypatch.setattr(loadToDynamo, "putDynamoCovid", fake_put)
+    manager = parallelLoad.BudgetManager()
+    manager.start()
+    try:
+        buckets = {"covidtable": manager.TokenBucket(1000, 50)}
+        start = time.perf_counter()
+        workers, failures = parallelLoad.loadStates(["a", "b", "c", "d", "bad"], "covidtable", "bkt-test", buckets,
+                                                    processes=3, mpContext=fork)
+        # 400 WCU through one 1000 WCU/s budget (50 burst) takes >= 0.35s however many processes write
+        assert time.perf_counter() - start >= 0.3
+        assert sum(w["states"] for w in workers.values()) == 4
+        assert [(f["state"], f["error"]) for f in failures] == [("bad", "ValueError: no payload")]
+
+        workers, failures = parallelLoad.loadStates(["a", "b"], "covidtable", "bkt-test", buckets, processes=2,
+                                                    deadline=time.time() - 1, mpContext=fork)
+        assert workers == {} and sorted(f["state"] for f in failures) == ["a", "b"]
+    finally:
+        manager.shutdown()
+
+    return
+
+def test_run_manifest_skips_loaded_unchanged_objects(tmp_path, fake_s3, fake_writer):
+    payload = json.dumps([{"province": "ohio", "county": "adams",
+                           "timeline": {"cases": {"10/1/24": 5}, "deaths": {"10/1/24": 1}}}]).encode()
+    s3 = fake_s3(lambda key: payload)
+    writer = fake_writer
+
+    # first run fails on ohio: only ohio is left to load
+    manifest = runManifest.RunManifest(manifestDir=str(tmp_path))
+    assert loadToDynamo.putDynamoCovid("alabama", s3, "covidtable", "bkt-test", writer=writer, manifest=manifest) == 200
+    writer.fail = True
+    with pytest.raises(RuntimeError):
+        loadToDynamo.putDynamoCovid("ohio", s3, "covidtable", "bkt-test", writer=writer, manifest=manifest)
+
+    writer.fail = False
+    manifest = runManifest.RunManifest(manifestDir=str(tmp_path))
+    today = loadToDynamo.datetime.today().strftime("%Y-%m-%d")
+    assert manifest.entries[loadToDynamo.covidKey("ohio", today)]["status"] == "failed"
+    assert loadToDynamo.putDynamoCovid("alabama", s3, "covidtable", "bkt-test", writer=writer, manifest=manifest) == 304
+    assert loadToDynamo.putDynamoCovid("ohio", s3, "covidtable", "bkt-test", writer=writer, manifest=manifest) == 200
+    assert s3.downloads == 3 and manifest.stats == {"loaded": 1, "skipped": 1, "failed": 0}
+
+    # a changed object is loaded again
+    s3.etags[loadToDynamo.covidKey("alabama", today)] = '"v2"'
+    assert loadToDynamo.putDynamoCovid("alabama", s3, "covidtable", "bkt-test", writer=writer, manifest=manifest) == 200
+    assert runManifest.RunManifest(manifestDir=str(tmp_path)).loadedEtag(loadToDynamo.covidKey("alabama", today)) == '"v2"'
+
+    return
+
+def test_compressed_payloads_by_encoding_or_suffix(fake_s3):
+    today = loadToDynamo.datetime.today().strftime("%Y-%m-%d")
+    payload = json.dumps({"epidata": [{"release_date": "2024-10-10", "region": "hhs1", "epiweek": 202440, "lag": 0,
+                                       "num_ili": 10, "num_patients": 1000, "wili": 1.0, "ili": 1.0}]}).encode()
+
+    key = loadToDynamo.fluKey(1, today)
+    # gzip announced by Content-Encoding on the raw key
+    s3 = fake_s3({key: (gzip.compress(payload), "gzip")})
+    assert loadToDynamo.fetchFlu(1, s3, "bkt-test", today) == (payload, 200)
+    # raw key missing: the .gz copy is found by its suffix
+    s3 = fake_s3({key + ".gz": (gzip.compress(payload), None)})
+    assert loadToDynamo.fetchFlu(1, s3, "bkt-test", today) == (payload, 200)
+    assert s3.requested == [key, key + ".gz"]
+    with pytest.raises(ClientError):
+        loadToDynamo.fetchFlu(1, fake_s3({}), "bkt-test", today)
+
+    assert compression.detect("covid/ohio/2024-10-01_last1.zst") == "zstd"
+    assert compression.detect("covid/ohio/2024-10-01_last1", "identity") is None
+    # zstandard is optional
+    if compression.zstandard is not None:
+        s3 = fake_s3({key + ".zst": (compression.zstandard.ZstdCompressor().compress(payload), None)})
+        assert loadToDynamo.fetchFlu(1, s3, "bkt-test", today) == (payload, 200)
+
+    return
+
+def test_state_covid_query_pages_and_caches(monkeypatch, fake_dynamo):
+    monkeypatch.setattr(awsdb, "stateCache", cache.TTLCache("state-test"))
+    pages = [[{"state-county": "new york-kings", "state": "new york", "cases-today": Decimal(900),
+               "deaths-today": Decimal(9), "monthly-case-rate": Decimal("12.5"), "monthly-death-rate": Decimal("0")}],
+             [{"state-county": "new york-albany", "state": "new york", "cases-today": Decimal(100),
+               "deaths-today": Decimal(1), "monthly-case-rate": Decimal("-2.5"), "monthly-death-rate": Decimal("1")}]]
+    resource = fake_dynamo({awsdb.ETL_RUN_KEY: {"run-id": "run-1"}}, pages)
+    rows = awsdb.get_state_covid("New York", resource, awsdb.logging, "covidmonthly")
+    assert [row["county"] for row in rows] == ["albany", "kings"]
+    assert rows[1] == {"county": "kings", "daily-covid-cases": 900, "daily-covid-deaths": 9,
+                       "monthly-covid-case-rate": 12.5, "monthly-covid-death-rate": 0.0}
+    assert len(resource.table.queries) == 2 and resource.table.queries[0]["IndexName"] == awsdb.STATE_INDEX
+
+    rows[0]["county"] = "changed"
+    assert awsdb.get_state_covid("new york", resource, awsdb.logging, "covidmonthly")[0]["county"] == "albany"
+    assert len(resource.table.queries) == 2
+
+    return
+
+def test_county_search_and_key_validation(monkeypatch, fake_dynamo):
+    index = geoIndex.buildCountyIndex()
+    assert "kings" in index["new york"][0] and index["alabama"][1]["st. clair"] == "St. Clair"
+
+    assert geoIndex.normalizeName(" New_York ") == "new york"
+    assert geoIndex.searchCounties("california", "San B") == ["San Benito", "San Bernardino"]
+    assert geoIndex.searchCounties("California", "san", limit=2) == ["San Benito", "San Bernardino"]
+    assert geoIndex.searchCounties("nowhere", "a") == []
+    assert geoIndex.stateCountyKey("new_york", "Kings") == "new york-kings"
+    assert geoIndex.stateCountyKey("California", "kings") == "california-kings"
+    assert geoIndex.stateCountyKey("california", "alamedaa") is None
+    assert geoIndex.stateCountyKey("california", None) is None
+
+    # a county in geo_data.csv the monthly tables have no item for is reported under the form
+    import app
+    empty = fake_dynamo()
+    monkeypatch.setattr(app, "get_db_resource", lambda: empty)
+    monkeypatch.setattr(app, "get_aws_names", lambda: {"covidmonthlytable": "covidmonthly-test",
+                                                       "flumonthlytable": "flumonthly-test"})
+    monkeypatch.setattr(app.a, "authenticate_map", lambda: "map-key")
+    monkeypatch.setattr(app.mapCache, "get_map_url", lambda key, location: "/maps/x.png")
+    with pytest.raises(LookupError):
+        awsdb.get_df_covid("Kings", "New York", empty, awsdb.logging, "covidmonthly-test")
+    outputs = app.update_data_to_event(1, "new_york", "Kings")
+    assert outputs[:2] == (None, "No Covid data for Kings, New York")
+
+    # changing the state clears a county the new state does not have, and its suggestions
+    assert app.update_county_options(None, "ohio", "Kings") == ([], None)
+    assert app.update_county_options(None, "california", "Kings") == (["Kings"], app.no_update)
+    assert app.update_county_options("San B", "california", "Kings")[0] == ["San Benito", "San Bernardino"]
+    assert app.update_county_options(None, None, "Kings") == ([], None)
+    assert app.update_county_options(None, None, None) == ([], app.no_update)
+
+    # the state heat map is left empty when the state index query fails (e.g. the index is still backfilling)
+    failing = fake_dynamo()
+    def query(**kwargs):
+        raise ClientError({"Error": {"Code": "ValidationException", "Message": "no index"}}, "Query")
+    failing.table.query = query
+    monkeypatch.setattr(app, "get_db_resource", lambda: failing)
+    figure = app.update_state_heatmap("ohio")
+    assert figure["data"][0]["y"] == [] and figure["layout"]["title"]["text"] == "Covid by County: Ohio"
+
+    return